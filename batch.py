@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline import scan_receipt
+from ocr_cache import OCRCache
+from rule_store import RuleStore, merge_rule_hits, rule_hit_rows
+import metrics
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.pdf')
+
+
+def find_receipts(directory, recursive=False):
+    """
+    Collect receipt image paths from a directory, sorted for stable ordering.
+    """
+    paths = []
+    if recursive:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+    else:
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(entry.path)
+    return sorted(paths)
+
+
+# Per-process OCR cache, category rules and near-duplicate settings, opened by the pool initializer
+_worker_cache = None
+_worker_rules = None
+_worker_db = None
+_worker_duplicates = {}
+
+
+def _init_worker(cache_path, rules_path, collect_metrics=False, db_path=None, duplicates=None,
+                 category_cache_path=None):
+    global _worker_cache, _worker_rules, _worker_db, _worker_duplicates
+    if collect_metrics:
+        metrics.enable()
+    if category_cache_path:
+        from categorizer import category_cache
+        category_cache.load(category_cache_path)
+    if cache_path:
+        _worker_cache = OCRCache(cache_path)
+    if rules_path:
+        _worker_rules = RuleStore(rules_path)
+    if db_path:
+        from expense_db import ExpenseDB
+        _worker_db = ExpenseDB(db_path)
+        _worker_duplicates = duplicates or {}
+    # Load the OCR stack now rather than inside the first scan's latency
+    import ocr_utils  # noqa: F401
+
+
+def scan_file(image_path):
+    """
+    Run OCR and categorization for one receipt.
+    Runs inside a worker process, so every failure is returned instead of raised.
+    """
+    from categorizer import category_cache
+
+    start = time.perf_counter()
+    try:
+        # Stage timings, category cache lookups and rule hits travel back with the result; the parent merges them
+        hits, misses = category_cache.counts()
+        with metrics.capture() as timings:
+            result = scan_receipt(image_path, cache=_worker_cache, rules=_worker_rules,
+                                  duplicates=_worker_db, **_worker_duplicates)
+        return dict(
+            result.to_dict(),
+            ok=True,
+            stage_timings=timings,
+            category_cache=category_cache_delta(hits, misses),
+            rule_hits=_worker_rules.take_new_hits() if _worker_rules is not None else [],
+            latency=time.perf_counter() - start
+        )
+    except Exception as e:
+        return {
+            'path': image_path,
+            'ok': False,
+            'error': str(e),
+            'latency': time.perf_counter() - start
+        }
+
+
+def category_cache_delta(hits, misses):
+    """This process's category cache hits and misses since the given counts"""
+    from categorizer import category_cache
+    now_hits, now_misses = category_cache.counts()
+    return {'hits': now_hits - hits, 'misses': now_misses - misses}
+
+
+def scan_files(image_paths):
+    """scan_file for several receipts in one task, to save a round trip per receipt"""
+    return [scan_file(image_path) for image_path in image_paths]
+
+
+def scan_batch(image_paths, workers=None, cache_path=None, rules_path=None, db_path=None, duplicates=None,
+               category_cache_path=None):
+    """
+    Fan receipts out across a process pool and yield results as they finish.
+    At most a few tasks per worker are in flight, so huge batches don't
+    queue every path up front. With cache_path set, workers share an on-disk
+    OCR cache so duplicate receipts skip Tesseract. With rules_path set,
+    categories come from that rules file and follow its edits without a restart.
+    With db_path set, photos that are near-duplicates of receipts stored there
+    are reused or flagged; duplicates holds scan_receipt's on_duplicate and
+    min_similarity. category_cache_path is a categorizer.CategoryCache
+    snapshot each worker is pre-seeded from.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 4
+    paths = iter(image_paths)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_path, rules_path, metrics.is_enabled(), db_path, duplicates,
+                                       category_cache_path)) as executor:
+        pending = set()
+        for path in paths:
+            pending.add(executor.submit(scan_file, path))
+            if len(pending) >= max_pending:
+                break
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.add(executor.submit(scan_file, next_path))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(results, elapsed):
+    """Build a throughput summary from scan results and wall-clock seconds"""
+    latencies = [r['latency'] for r in results]
+    failed = sum(1 for r in results if not r['ok'])
+    return {
+        'receipts': len(results),
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'elapsed': elapsed,
+        'receipts_per_sec': len(results) / elapsed if elapsed > 0 else 0.0,
+        'p50_latency': percentile(latencies, 50),
+        'p95_latency': percentile(latencies, 95)
+    }
+
+
+def run_batch(directory, workers=None, recursive=False, on_result=None, cache_path=None,
+              rules_path=None, db_path=None, duplicates=None, stages=None, category_cache_path=None):
+    """
+    Scan every receipt in a directory and return the throughput summary.
+    on_result is called with each result as soon as it is available.
+    stages, a dict of stages.scan_staged worker counts, switches to the
+    two-stage preprocess/OCR pipeline (which skips the duplicate lookup).
+    """
+    paths = find_receipts(directory, recursive=recursive)
+    logging.info(f"Batch scan of {len(paths)} receipts from {directory}")
+
+    if stages is not None:
+        from stages import scan_staged
+        scanned = scan_staged(paths, cache_path=cache_path, rules_path=rules_path,
+                              category_cache_path=category_cache_path, **stages)
+    else:
+        scanned = scan_batch(paths, workers=workers, cache_path=cache_path, rules_path=rules_path,
+                             db_path=db_path, duplicates=duplicates, category_cache_path=category_cache_path)
+
+    results = []
+    cache_hits = cache_misses = 0
+    rule_hits = Counter()
+    start = time.perf_counter()
+    for result in scanned:
+        if result['ok']:
+            metrics.observe_all(result['stage_timings'])
+            cache_hits += result['category_cache']['hits']
+            cache_misses += result['category_cache']['misses']
+            merge_rule_hits(rule_hits, result['rule_hits'])
+            logging.info(f"Receipt processed: {result['path']}")
+        else:
+            logging.error(f"Error processing {result['path']}: {result['error']}")
+        # Only keep what the summary needs so huge batches stay small in memory
+        results.append({'ok': result['ok'], 'latency': result['latency']})
+        if on_result:
+            on_result(result)
+
+    summary = summarize(results, time.perf_counter() - start)
+    # Lookups the workers made while categorizing, summed over every scan
+    lookups = cache_hits + cache_misses
+    summary['category_cache'] = {'hits': cache_hits, 'misses': cache_misses,
+                                 'hit_rate': cache_hits / lookups if lookups else 0.0}
+    # [category, keyword, count] per keyword rule that matched, with rules_path set
+    summary['rule_hits'] = rule_hit_rows(rule_hits)
+    logging.info(f"Batch complete: {summary['succeeded']}/{summary['receipts']} receipts, "
+                 f"{summary['receipts_per_sec']:.2f} receipts/sec")
+    return summary
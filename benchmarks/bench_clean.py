@@ -0,0 +1,101 @@
+"""
+Benchmark OCR text cleaning on large synthetic OCR dumps: text_normalize on
+a whole dump and through its streaming line interface, against the previous
+clean_extracted_text that replaced O with 0 everywhere. --confusion-rate is
+the chance that OCR misreads a 0 or 1 of an amount as a letter.
+
+Usage:
+    python benchmarks/bench_clean.py [--lines 200000] [--repeat 3] [--confusion-rate 0.3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_normalize import normalize_text, iter_normalized_lines
+
+ITEM_WORDS = ['COFFEE', 'Food', 'ORDER', 'TOTAL', 'Oil', 'Bill', 'Iced tea', 'lotion', 'DOMINO\'S',
+              'notebook', 'GST', 'ﬁlter', 'ﬂour', 'Mom’s', 'Store', 'Cable']
+
+
+def legacy_clean(text):
+    """clean_extracted_text as it was before text_normalize"""
+    if not text:
+        return ""
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    cleaned_text = '\n'.join(lines)
+    replacements = {'|': 'I', 'O': '0', '§': 'S', 'ﬁ': 'fi', 'ﬂ': 'fl', '—': '-', '’': "'", '"': '"'}
+    for old, new in replacements.items():
+        cleaned_text = cleaned_text.replace(old, new)
+    return cleaned_text
+
+
+def confuse(amount, rng, rate):
+    """Swap some digits for the letters OCR tends to read instead"""
+    return ''.join(rng.choice('OoI') if ch in '01' and rng.random() < rate else ch for ch in amount)
+
+
+def make_line(rng, rate):
+    """One OCR-like line with padding, confusable characters and the odd blank line"""
+    kind = rng.random()
+    words = ' '.join(rng.choice(ITEM_WORDS) for _ in range(rng.randint(1, 4)))
+    amount = confuse(f"{rng.uniform(1, 20000):,.2f}", rng, rate)
+    if kind < 0.3:
+        return f"  {words} ₹{amount} "
+    if kind < 0.6:
+        return f"{words} | {amount}"
+    if kind < 0.75:
+        return f"\t{words} — {amount}\t"
+    if kind < 0.85:
+        return f"Invoice #{confuse(str(rng.randint(1000, 99999)), rng, rate)} {words}"
+    if kind < 0.9:
+        return "   "
+    return words
+
+
+def make_dump(num_lines, confusion_rate=0.3, seed=42):
+    rng = random.Random(seed)
+    return '\n'.join(make_line(rng, confusion_rate) for _ in range(num_lines))
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--confusion-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    text = make_dump(args.lines, args.confusion_rate)
+    megabytes = len(text.encode('utf-8')) / 1e6
+
+    legacy_seconds, legacy = best_time(lambda: legacy_clean(text), args.repeat)
+    new_seconds, cleaned = best_time(lambda: normalize_text(text), args.repeat)
+    stream_seconds, streamed = best_time(lambda: list(iter_normalized_lines(text.split('\n'))), args.repeat)
+
+    if streamed != cleaned.split('\n'):
+        print("streaming output differs from normalize_text", file=sys.stderr)
+        return 1
+    differing = sum(1 for old, new in zip(legacy.split('\n'), cleaned.split('\n')) if old != new)
+
+    print(f"{args.lines} lines, {megabytes:.1f} MB, best of {args.repeat}")
+    print(f"legacy:    {legacy_seconds:.3f}s ({megabytes / legacy_seconds:,.1f} MB/s)")
+    print(f"whole:     {new_seconds:.3f}s ({megabytes / new_seconds:,.1f} MB/s)")
+    print(f"streaming: {stream_seconds:.3f}s ({megabytes / stream_seconds:,.1f} MB/s)")
+    print(f"{differing} of {len(streamed)} lines differ from legacy (letters kept outside amounts)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
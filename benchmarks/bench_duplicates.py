@@ -0,0 +1,110 @@
+"""
+Benchmark near-duplicate image lookup (ExpenseDB.find_similar_image) on a
+large archive of synthetic perceptual hashes.
+
+Stored hashes are noisy variants of a number of templates, like receipts
+printed by the same till; queries are re-photographs of stored receipts
+(a few bits flipped) and unseen receipts.
+
+Usage:
+    python benchmarks/bench_duplicates.py [--receipts 1000000] [--templates 1000] [--queries 2000]
+                                          [--db bench_duplicates.sqlite3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense_db import ExpenseDB
+
+HASH_BITS = 256
+# Largest distance a lookup accepts: ocr_utils.max_hash_distance() at the
+# default similarity
+MAX_DISTANCE = 25
+# Bits flipped from its template per stored receipt, and per re-photograph.
+# Re-photographs sit right at the threshold, where a lossy index would miss.
+TEMPLATE_NOISE = 40
+PHOTO_NOISE = MAX_DISTANCE
+INSERT_BATCH = 10000
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << bit
+    return value
+
+
+def to_hex(value):
+    return value.to_bytes(HASH_BITS // 8, 'big').hex()
+
+
+def fill(db, receipts, templates, rng):
+    """Store receipts with hashes drawn around the templates; returns a sample of them"""
+    sample = []
+    records = []
+    for i in range(receipts):
+        value = flip_bits(rng.choice(templates), TEMPLATE_NOISE, rng)
+        if len(sample) < 10000:
+            sample.append(value)
+        records.append({'source_path': f"receipt_{i}.jpg", 'text': '', 'categories': {}, 'total': 0.0,
+                        'image_hash': to_hex(value)})
+        if len(records) >= INSERT_BATCH:
+            db.add_receipts(records)
+            records.clear()
+    if records:
+        db.add_receipts(records)
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=1000000)
+    parser.add_argument("--templates", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--db", default="bench_duplicates.sqlite3", help="reused if it already exists")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    templates = [rng.getrandbits(HASH_BITS) for _ in range(args.templates)]
+    existed = os.path.exists(args.db)
+    db = ExpenseDB(args.db)
+    try:
+        if existed:
+            sample = [int(h.hex(), 16) for (h,) in db._conn.execute(
+                "SELECT hash FROM receipt_images ORDER BY receipt_id LIMIT 10000")]
+        else:
+            start = time.perf_counter()
+            sample = fill(db, args.receipts, templates, rng)
+            print(f"stored {args.receipts} hashes in {time.perf_counter() - start:.1f}s")
+        stored = db._conn.execute("SELECT COUNT(*) FROM receipt_images").fetchone()[0]
+
+        # Separate stream, so queries never replay the flips used when filling
+        rng = random.Random(args.seed + 1)
+        for label, make_query in (
+            ("re-photographed", lambda: flip_bits(rng.choice(sample), PHOTO_NOISE, rng)),
+            ("unseen, known template", lambda: flip_bits(rng.choice(templates), TEMPLATE_NOISE, rng)),
+            ("unseen, new template", lambda: rng.getrandbits(HASH_BITS)),
+        ):
+            queries = [to_hex(make_query()) for _ in range(args.queries)]
+            found = 0
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                match = db.find_similar_image(query, MAX_DISTANCE)
+                latencies.append(time.perf_counter() - start)
+                found += match is not None
+            latencies.sort()
+            print(f"{label:<24} {stored} stored: p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, "
+                  f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms, "
+                  f"{found}/{len(queries)} matched")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Benchmark parse_amounts_and_items on large synthetic OCR dumps.
+
+Usage:
+    python benchmarks/bench_parse.py [--lines 200000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from categorizer import parse_amounts_and_items
+
+ITEM_WORDS = ['coffee', 'burger', 'uber', 'taxi', 'store', 'internet', 'movie', 'pharmacy',
+              'design', 'package', 'gst', 'fee', 'total', 'latte', 'notebook', 'cable']
+
+
+def make_line(rng):
+    """One OCR-like line: item words, an amount in one of the formats we parse, or noise"""
+    kind = rng.random()
+    words = ' '.join(rng.choice(ITEM_WORDS) for _ in range(rng.randint(1, 4)))
+    value = rng.uniform(1, 20000)
+    if kind < 0.25:
+        return f"{words.title()} ₹{value:,.2f}"
+    if kind < 0.5:
+        return f"{words} {value:,.2f}"
+    if kind < 0.7:
+        return f"{words.upper()} {value:.2f}"
+    if kind < 0.8:
+        whole, cents = f"{value:.2f}".split('.')
+        return f"{words} {whole} . {cents}"
+    if kind < 0.9:
+        return f"Invoice #{rng.randint(1000, 99999)} {words}"
+    return words
+
+
+def make_dump(num_lines, seed=42):
+    rng = random.Random(seed)
+    return '\n'.join(make_line(rng) for _ in range(num_lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = make_dump(args.lines)
+    best = float('inf')
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        amounts, items = parse_amounts_and_items(text)
+        best = min(best, time.perf_counter() - start)
+
+    print(f"{args.lines} lines, {len(amounts)} amounts, {len(items)} items")
+    print(f"best of {args.repeat}: {best:.3f}s ({args.lines / best:,.0f} lines/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+End-to-end benchmark of scan_receipt (OCR, parsing, categorization) on a
+synthetic receipt corpus with known ground truth.
+
+Reports throughput, per-stage latency, peak RSS and extraction accuracy, and
+saves them as a JSON baseline that later runs can be compared against.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--corpus bench_corpus] [--count 50] [--workers 4]
+                                        [--save baseline.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# OCR every receipt in the fixed mode order, so runs are comparable
+os.environ["RECEPTIX_FIXED_MODE_ORDER"] = "1"
+
+import metrics
+from batch import scan_batch, summarize
+from synthetic_receipts import generate_corpus
+
+# Relative throughput drop / absolute accuracy drop that count as a regression
+THROUGHPUT_TOLERANCE = 0.10
+ACCURACY_TOLERANCE = 0.02
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and its (reaped) workers.
+    Without the resource module only this process's peak is known, and only
+    when psutil is installed; missing figures are None.
+    """
+    if resource is None:
+        if psutil is None:
+            return {'self': None, 'workers': None}
+        memory = psutil.Process().memory_info()
+        return {'self': getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024), 'workers': None}
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {'self': self_kb / scale, 'workers': children_kb / scale}
+
+
+def score_receipt(result, truth):
+    """Amount recall and item categorization hits for one scanned receipt"""
+    expected = Counter(round(item['amount'], 2) for item in truth['items'])
+    expected[round(truth['total'], 2)] += 1
+    # The amounts the pipeline itself returned, layout pairing included
+    found = Counter(round(amount, 2) for amount in result['amounts'])
+    amounts_found = sum((expected & found).values())
+
+    categorized_ok = 0
+    for item in truth['items']:
+        data = result['categories'].get(item['category'], {'items': []})
+        if any(item['name'].split()[0].lower() in text.lower() for text in data['items']):
+            categorized_ok += 1
+
+    return {
+        'amounts_expected': sum(expected.values()),
+        'amounts_found': amounts_found,
+        'items_expected': len(truth['items']),
+        'items_categorized': categorized_ok,
+        'total_found': found[round(truth['total'], 2)] > 0
+    }
+
+
+def run(corpus_dir, workers):
+    with open(os.path.join(corpus_dir, "ground_truth.json"), encoding="utf-8") as f:
+        ground_truth = json.load(f)
+    receipts = ground_truth['receipts']
+    paths = [os.path.join(corpus_dir, name) for name in sorted(receipts)]
+
+    metrics.reset()
+    metrics.enable()
+    results = []
+    scores = []
+    start = time.perf_counter()
+    for result in scan_batch(paths, workers=workers):
+        results.append({'ok': result['ok'], 'latency': result['latency']})
+        if result['ok']:
+            metrics.observe_all(result['stage_timings'])
+        else:
+            # A failed scan still counts against accuracy, with nothing found
+            result = dict(result, text='', amounts=[], categories={})
+        scores.append(score_receipt(result, receipts[os.path.basename(result['path'])]))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(results, elapsed)
+    amounts_expected = sum(s['amounts_expected'] for s in scores) or 1
+    items_expected = sum(s['items_expected'] for s in scores) or 1
+    return {
+        'corpus': {'dir': corpus_dir, 'seed': ground_truth['seed'], 'config': ground_truth['config'],
+                   'receipts': len(paths)},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'workers': workers},
+        'throughput': summary,
+        'stages': {stage: {'mean': s['mean'], 'max': s['max'], 'count': s['count']}
+                   for stage, s in metrics.snapshot().items()},
+        'peak_rss_mb': peak_rss_mb(),
+        'accuracy': {
+            'amount_recall': sum(s['amounts_found'] for s in scores) / amounts_expected,
+            'category_accuracy': sum(s['items_categorized'] for s in scores) / items_expected,
+            'total_match_rate': sum(1 for s in scores if s['total_found']) / len(paths) if paths else 0.0
+        }
+    }
+
+
+def compare(report, baseline):
+    """Print differences from a baseline and return the list of regressions"""
+    regressions = []
+    old_rate = baseline['throughput']['receipts_per_sec']
+    new_rate = report['throughput']['receipts_per_sec']
+    print(f"receipts/sec: {old_rate:.2f} -> {new_rate:.2f}")
+    if old_rate and new_rate < old_rate * (1 - THROUGHPUT_TOLERANCE):
+        regressions.append(f"throughput dropped {100 * (1 - new_rate / old_rate):.1f}%")
+
+    for key, new_value in report['accuracy'].items():
+        old_value = baseline['accuracy'].get(key, 0.0)
+        print(f"{key}: {old_value:.3f} -> {new_value:.3f}")
+        if new_value < old_value - ACCURACY_TOLERANCE:
+            regressions.append(f"{key} dropped from {old_value:.3f} to {new_value:.3f}")
+
+    for stage, stats in report['stages'].items():
+        old_stats = baseline['stages'].get(stage)
+        if old_stats:
+            print(f"  {stage}: {old_stats['mean'] * 1000:.1f} ms -> {stats['mean'] * 1000:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="bench_corpus", help="corpus directory (generated if missing)")
+    parser.add_argument("--count", type=int, default=50, help="receipts to generate for a new corpus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--save", help="write the results JSON here")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.corpus, "ground_truth.json")):
+        generate_corpus(args.corpus, args.count, seed=args.seed)
+
+    report = run(args.corpus, args.workers)
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
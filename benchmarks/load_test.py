@@ -0,0 +1,162 @@
+"""
+Load test for the local scanning service (receptix.py serve).
+
+Keeps --concurrency clients uploading synthetic receipts for --duration
+seconds, each on its own keep-alive connection, and reports sustained
+receipts/sec, tail latency and how often the service pushed back with 429.
+
+Usage:
+    python receptix.py serve --workers 4 &
+    python benchmarks/load_test.py [--url http://127.0.0.1:8765] [--concurrency 8] [--duration 30]
+                                   [--mode sync|poll] [--corpus bench_corpus] [--save load.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import find_receipts, percentile
+from synthetic_receipts import generate_corpus
+
+# Seconds between result polls in poll mode, and the longest 429 back-off
+POLL_INTERVAL = 0.05
+MAX_BACKOFF = 1.0
+
+
+def encode_upload(path):
+    """(content type, multipart body) uploading path as the "file" field"""
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        data = f.read()
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n").encode("utf-8")
+    return f"multipart/form-data; boundary={boundary}", head + data + f"\r\n--{boundary}--\r\n".encode("ascii")
+
+
+class Client(threading.Thread):
+    def __init__(self, url, uploads, mode, deadline, stats, lock):
+        super().__init__(daemon=True)
+        self.url = urlsplit(url)
+        self.uploads = uploads
+        self.mode = mode
+        self.deadline = deadline
+        self.stats = stats
+        self.lock = lock
+
+    def request(self, conn, method, path, body=None, headers=None):
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.getheader("Retry-After"), json.loads(response.read() or b"null")
+
+    def scan(self, conn, content_type, body):
+        """(result, 429 count) for one receipt, retrying while the service pushes back"""
+        rejected = 0
+        path = "/scan?wait=1" if self.mode == "sync" else "/scan"
+        while True:
+            status, retry_after, payload = self.request(conn, "POST", path, body, {"Content-Type": content_type})
+            if status != 429:
+                break
+            rejected += 1
+            time.sleep(min(MAX_BACKOFF, float(retry_after or MAX_BACKOFF)))
+            if time.monotonic() > self.deadline:
+                return None, rejected
+
+        # Sync requests that outlive the service's wait come back as 202 too
+        while status == 202:
+            time.sleep(POLL_INTERVAL)
+            status, _, payload = self.request(conn, "GET", f"/jobs/{payload['id']}/result")
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}: {payload}")
+        return payload, rejected
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=300)
+        i = 0
+        while time.monotonic() < self.deadline:
+            content_type, body = self.uploads[i % len(self.uploads)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                result, rejected = self.scan(conn, content_type, body)
+                error = None
+            except Exception as e:
+                result, rejected, error = None, 0, str(e)
+                conn.close()
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.stats['rejected'] += rejected
+                if error is not None:
+                    self.stats['errors'].append(error)
+                elif result is not None:
+                    self.stats['latencies'].append(latency)
+                    self.stats['ok' if result['ok'] else 'failed'] += 1
+        conn.close()
+
+
+def run(url, uploads, concurrency, duration, mode):
+    stats = {'latencies': [], 'ok': 0, 'failed': 0, 'rejected': 0, 'errors': []}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    clients = [Client(url, uploads, mode, deadline, stats, lock) for _ in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = stats['latencies']
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'completed': len(latencies),
+        'ok': stats['ok'],
+        'failed': stats['failed'],
+        'rejected_429': stats['rejected'],
+        'errors': len(stats['errors']),
+        'first_error': stats['errors'][0] if stats['errors'] else None,
+        'receipts_per_sec': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_latency': percentile(latencies, 50),
+        'p95_latency': percentile(latencies, 95),
+        'p99_latency': percentile(latencies, 99),
+        'max_latency': max(latencies, default=0.0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to keep uploading")
+    parser.add_argument("--mode", choices=("sync", "poll"), default="sync")
+    parser.add_argument("--corpus", default="bench_corpus", help="receipt directory (generated if missing)")
+    parser.add_argument("--count", type=int, default=50, help="receipts to generate for a new corpus")
+    parser.add_argument("--save", help="write the results JSON here")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.corpus):
+        generate_corpus(args.corpus, args.count)
+    uploads = [encode_upload(path) for path in find_receipts(args.corpus)]
+    if not uploads:
+        print(f"No receipts in {args.corpus}", file=sys.stderr)
+        return 1
+
+    report = run(args.url, uploads, args.concurrency, args.duration, args.mode)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
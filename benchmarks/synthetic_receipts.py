@@ -0,0 +1,140 @@
+"""
+Render synthetic receipts with known ground truth, fully offline with PIL.
+
+Usage:
+    python benchmarks/synthetic_receipts.py <out_dir> [--count 50] [--seed 1]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from categorizer import CATEGORY_KEYWORDS
+
+MERCHANTS = ['CITY MART', 'CORNER CAFE', 'METRO STORES', 'QUICK PHARMACY', 'OFFICE HUB']
+FILLER_WORDS = ['large', 'combo', 'regular', 'pack', 'deluxe', 'classic', 'extra']
+
+DEFAULT_CONFIG = {
+    'lines': 8,
+    'font': None,
+    'font_size': 28,
+    'width': 900,
+    'noise': 12.0,
+    'skew': 2.0,
+    'currency': '$'
+}
+
+
+def load_font(path, size):
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def make_items(rng, count):
+    """Ground-truth line items drawn from the categorizer's own keyword table"""
+    categories = [c for c in CATEGORY_KEYWORDS if c != 'Miscellaneous']
+    items = []
+    for _ in range(count):
+        category = rng.choice(categories)
+        keyword = rng.choice(CATEGORY_KEYWORDS[category])
+        name = f"{keyword} {rng.choice(FILLER_WORDS)}".upper()
+        amount = round(rng.uniform(1.5, 2500), 2)
+        items.append({'name': name, 'amount': amount, 'category': category})
+    return items
+
+
+def format_amount(amount, currency):
+    return f"{currency}{amount:,.2f}"
+
+
+def render_receipt(rng, config):
+    """Return (grayscale PIL image, ground truth dict) for one receipt"""
+    font = load_font(config['font'], config['font_size'])
+    items = make_items(rng, config['lines'])
+    total = round(sum(item['amount'] for item in items), 2)
+
+    line_height = int(config['font_size'] * 1.6)
+    margin = config['font_size']
+    width = config['width']
+    height = line_height * (len(items) + 6) + 2 * margin
+
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    y = margin
+    draw.text((margin, y), rng.choice(MERCHANTS), fill=0, font=font)
+    y += 2 * line_height
+
+    for item in items + [{'name': 'TOTAL', 'amount': total}]:
+        amount_text = format_amount(item['amount'], config['currency'])
+        amount_width = draw.textlength(amount_text, font=font)
+        draw.text((margin, y), item['name'], fill=0, font=font)
+        draw.text((width - margin - amount_width, y), amount_text, fill=0, font=font)
+        y += line_height
+
+    pixels = np.asarray(image, dtype=np.float32)
+    if config['noise']:
+        pixels = pixels + np.random.default_rng(rng.randint(0, 2 ** 32 - 1)).normal(0, config['noise'], pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    if config['skew']:
+        angle = rng.uniform(-config['skew'], config['skew'])
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    truth = {'items': items, 'total': total, 'currency': config['currency']}
+    return image, truth
+
+
+def generate_corpus(out_dir, count, seed=1, **overrides):
+    """
+    Write count receipts plus ground_truth.json into out_dir.
+    The same seed and config always produce the same corpus.
+    """
+    config = dict(DEFAULT_CONFIG, **overrides)
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    truth = {}
+    for i in range(count):
+        image, receipt_truth = render_receipt(rng, config)
+        name = f"receipt_{i:05d}.png"
+        image.save(os.path.join(out_dir, name))
+        truth[name] = receipt_truth
+
+    with open(os.path.join(out_dir, "ground_truth.json"), "w", encoding="utf-8") as f:
+        json.dump({'seed': seed, 'config': config, 'receipts': truth}, f, indent=2, ensure_ascii=False)
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--lines", type=int, default=DEFAULT_CONFIG['lines'])
+    parser.add_argument("--font", help="TrueType font file (default: PIL's built-in font)")
+    parser.add_argument("--font-size", type=int, default=DEFAULT_CONFIG['font_size'])
+    parser.add_argument("--width", type=int, default=DEFAULT_CONFIG['width'], help="image width in pixels")
+    parser.add_argument("--noise", type=float, default=DEFAULT_CONFIG['noise'], help="gaussian noise sigma")
+    parser.add_argument("--skew", type=float, default=DEFAULT_CONFIG['skew'], help="max rotation in degrees")
+    parser.add_argument("--currency", default=DEFAULT_CONFIG['currency'], choices=['$', '₹'])
+    args = parser.parse_args()
+
+    generate_corpus(args.out_dir, args.count, seed=args.seed, lines=args.lines, font=args.font,
+                    font_size=args.font_size, width=args.width, noise=args.noise, skew=args.skew,
+                    currency=args.currency)
+    print(f"Wrote {args.count} receipts to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
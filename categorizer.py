@@ -1,6 +1,13 @@
+import os
 import re
+import json
+import bisect
 import logging
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+
+from keyword_index import get_matcher, table_generation
+import metrics
 
 # Predefined category keywords
 CATEGORY_KEYWORDS = {
@@ -15,65 +22,350 @@ CATEGORY_KEYWORDS = {
 }
 
 
-def parse_amounts_and_items(text):
+# Distinct (rule set, item text) pairs kept by the category cache
+DEFAULT_CATEGORY_CACHE_SIZE = 100000
+
+
+# One alternation, tried left to right at each position, so every amount is
+# matched exactly once and overlapping patterns can't double count it
+AMOUNT_RE = re.compile(
+    r'₹\s?(?P<rupee>\d+(?:,\d{3})*(?:\.\d{2})?)'   # ₹13,715.52
+    r'|(?P<grouped>\d{1,3}(?:,\d{3})+(?:\.\d{2})?)'  # 9,999.00
+    r'|(?P<decimal>\d+\.\d{2})'                       # 975.00
+    r'|(?P<whole>\d+)\s*\.\s*(?P<cents>\d{2})'          # 99 . 00
+)
+NON_WORD_RE = re.compile(r'[^\w\s-]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+MIN_AMOUNT = 1
+MAX_AMOUNT = 999999
+
+# OCR lines overlapping vertically by at least this fraction of the shorter
+# one form one receipt row (sparse modes often split a name from its price)
+ROW_OVERLAP = 0.5
+# An amount whose right edge is within this fraction of the text width of
+# the price column is the row's price
+PRICE_COLUMN_TOLERANCE = 0.05
+
+
+def _match_value(match):
+    group = match.lastgroup
+    if group == 'cents':
+        return float(f"{match.group('whole')}.{match.group('cents')}")
+    return float(match.group(group).replace(',', ''))
+
+
+def split_amounts(line):
+    """
+    Scan a line once and return (amounts, item_text).
+    Every matched amount span is removed from the item text, even when the
+    value is out of range and not counted.
+    """
+    amounts = []
+    pieces = []
+    last = 0
+    for match in AMOUNT_RE.finditer(line):
+        pieces.append(line[last:match.start()])
+        last = match.end()
+
+        # Inlined _match_value: this loop is the parser's hot path
+        group = match.lastgroup
+        if group == 'cents':
+            value = float(f"{match.group('whole')}.{match.group('cents')}")
+        else:
+            value = float(match.group(group).replace(',', ''))
+        if MIN_AMOUNT <= value <= MAX_AMOUNT:
+            amounts.append(value)
+
+    if not amounts:
+        return amounts, ''
+
+    pieces.append(line[last:])
+    item_text = NON_WORD_RE.sub(' ', ''.join(pieces))
+    item_text = WHITESPACE_RE.sub(' ', item_text).strip()
+    return amounts, item_text
+
+
+def group_rows(lines):
+    """
+    Merge OCR lines (with top/bottom/words geometry) into receipt rows by
+    vertical overlap. Returns each row's words left to right, rows top to bottom.
+    """
+    rows = []
+    for line in sorted(lines, key=lambda line: line.top):
+        if rows:
+            row = rows[-1]
+            overlap = min(row['bottom'], line.bottom) - max(row['top'], line.top)
+            shorter = min(row['bottom'] - row['top'], line.bottom - line.top)
+            if overlap > 0 and overlap >= ROW_OVERLAP * shorter:
+                row['words'].extend(line.words)
+                row['top'] = min(row['top'], line.top)
+                row['bottom'] = max(row['bottom'], line.bottom)
+                continue
+        rows.append({'words': list(line.words), 'top': line.top, 'bottom': line.bottom})
+    return [sorted(row['words'], key=lambda word: word.left) for row in rows]
+
+
+def split_row_amounts(words):
+    """
+    Like split_amounts for one row of OCR words, but each amount comes with
+    the right edge of the word it ends in: ([(value, right)], item_text).
+    """
+    text = ' '.join(word.text for word in words)
+    # Character offset just past each word, to map matches back to words
+    word_ends = []
+    offset = 0
+    for word in words:
+        offset += len(word.text)
+        word_ends.append(offset)
+        offset += 1
+
+    amounts = []
+    pieces = []
+    last = 0
+    for match in AMOUNT_RE.finditer(text):
+        pieces.append(text[last:match.start()])
+        last = match.end()
+        value = _match_value(match)
+        if MIN_AMOUNT <= value <= MAX_AMOUNT:
+            amounts.append((value, words[bisect.bisect_left(word_ends, match.end())].right))
+
+    if not amounts:
+        return amounts, ''
+
+    pieces.append(text[last:])
+    item_text = NON_WORD_RE.sub(' ', ''.join(pieces))
+    item_text = WHITESPACE_RE.sub(' ', item_text).strip()
+    return amounts, item_text
+
+
+def parse_layout(lines):
+    """
+    Pair item text with prices using OCR line geometry.
+    Lines are merged into rows first, so a price Tesseract put on its own line
+    still joins its item. When a row holds several amounts (e.g. '2 x 3.50
+    7.00'), only the one in the right-aligned price column is counted.
+    """
+    rows = [split_row_amounts(words) for words in group_rows(lines)]
+    rights = sorted(max(right for _, right in found) for found, _ in rows if found)
+    if not rights:
+        return [], []
+
+    # Most priced rows end at the price column, so the median finds it
+    price_column = rights[len(rights) // 2]
+    words = [word for line in lines for word in line.words]
+    tolerance = PRICE_COLUMN_TOLERANCE * (max(word.right for word in words) - min(word.left for word in words))
+
+    amounts = []
+    items = []
+    for found, item_text in rows:
+        if not found or len(item_text) <= 2:
+            continue
+        priced = [value for value, right in found if abs(right - price_column) <= tolerance]
+        items.append(item_text)
+        amounts.extend(priced[-1:] or [value for value, _ in found])
+    return amounts, items
+
+
+@metrics.timed('categorize.parse')
+def parse_amounts_and_items(text, lines=None):
+    """
+    Return (amounts, item texts) found in OCR text. With OCR lines carrying
+    word boxes, items and prices are paired by geometry (see parse_layout).
+    """
+    if lines:
+        amounts, items = parse_layout(lines)
+        logging.info(f"✅ Found {len(amounts)} amounts and {len(items)} item lines.")
+        return amounts, items
+
     amounts = []
     items = []
 
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-
-    amount_patterns = [
-        r'₹\s?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)',     # ₹13,715.52
-        r'(\d{1,3}(?:,\d{3})+(?:\.\d{2})?)',         # 9,999.00
-        r'(\d+\.\d{2})',                             # 975.00
-        r'(\d+)\s*\.\s*(\d{2})'                      # 99 . 00
-    ]
-
-    for line in lines:
-        found_amounts = []
-        for pattern in amount_patterns:
-            matches = re.findall(pattern, line)
-            for match in matches:
-                try:
-                    if isinstance(match, tuple):
-                        amount = float(f"{match[0]}.{match[1]}")
-                    else:
-                        amount = float(match.replace(',', ''))
-                    if 1 <= amount <= 999999:
-                        found_amounts.append(amount)
-                except:
-                    continue
-
-        if found_amounts:
-            item_text = line
-            for pattern in amount_patterns:
-                item_text = re.sub(pattern, '', item_text)
-            item_text = re.sub(r'[^\w\s-]', ' ', item_text)
-            item_text = re.sub(r'\s+', ' ', item_text).strip()
-            if len(item_text) > 2:
-                items.append(item_text)
-                amounts.extend(found_amounts)
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        found_amounts, item_text = split_amounts(line)
+        if found_amounts and len(item_text) > 2:
+            items.append(item_text)
+            amounts.extend(found_amounts)
 
     logging.info(f"✅ Found {len(amounts)} amounts and {len(items)} item lines.")
     return amounts, items
 
 
-def categorize_expenses(items):
+# A keyword table's matcher, matching mode and rules_version(), with the same
+# attribute names as rule_store.CompiledRules so either can be categorized with
+KeywordRuleSet = namedtuple('KeywordRuleSet', ['matcher', 'first_match_wins', 'fingerprint'])
+
+_keyword_rule_sets = {}
+
+
+def keyword_rule_set(table=None, word_boundary=False, priorities=None, first_match_wins=True):
+    """
+    KeywordRuleSet of a keyword table (default CATEGORY_KEYWORDS) and matching
+    options. Like get_matcher, it is rebuilt and re-hashed only when another
+    table is passed or keyword_index.table_changed(table) was called.
+    """
+    table = CATEGORY_KEYWORDS if table is None else table
+    key = (word_boundary, tuple(sorted((priorities or {}).items())), first_match_wins)
+    generation = table_generation(table)
+    cached = _keyword_rule_sets.get(key)
+    if cached is None or cached[0] is not table or cached[1] != generation:
+        from rule_store import rules_version
+        version = rules_version(table, {
+            'priorities': priorities or {},
+            'word_boundary': word_boundary,
+            'first_match_wins': first_match_wins
+        })
+        matcher = get_matcher(table, word_boundary=word_boundary, priorities=priorities)
+        cached = (table, generation, KeywordRuleSet(matcher, first_match_wins, version))
+        _keyword_rule_sets[key] = cached
+    return cached[2]
+
+
+class CategoryCache:
+    """
+    Bounded LRU map from (rules version, lowercased item text) to the winning
+    (category, keyword) rule, or None when no keyword matched. Entries are
+    keyed on the rules version, so editing the keyword table makes them miss
+    instead of returning stale categories. Safe to share between threads.
+    """
+
+    def __init__(self, max_size=DEFAULT_CATEGORY_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, version, text, match):
+        """The cached rule for text under version, calling match(text) on a miss"""
+        key = (version, text)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        rule = match(text)
+        self._store(key, rule)
+        return rule
+
+    def _store(self, key, rule):
+        with self._lock:
+            self._entries[key] = rule
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def counts(self):
+        """(hits, misses) so far, to diff around a unit of work"""
+        with self._lock:
+            return self.hits, self.misses
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def save(self, path):
+        """Write every entry, least recently used first, to a JSON snapshot"""
+        with self._lock:
+            entries = [[version, text, rule and rule[0], rule and rule[1]]
+                       for (version, text), rule in self._entries.items()]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({'entries': entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logging.info(f"Saved {len(entries)} category cache entries to {path}")
+
+    def load(self, path):
+        """
+        Pre-seed from a snapshot written by save(). Entries of other rule
+        versions load too, and simply never hit. A missing file is ignored;
+        an unreadable or corrupt one is logged and the cache starts empty.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)['entries']
+            rules = [((version, text), None if category is None else (category, keyword))
+                     for version, text, category, keyword in entries]
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # json.JSONDecodeError and UnicodeDecodeError are ValueErrors
+            logging.warning(f"Ignoring unreadable category cache {path}: {e}")
+            return 0
+        for key, rule in rules:
+            self._store(key, rule)
+        logging.info(f"Loaded {len(entries)} category cache entries from {path}")
+        return len(entries)
+
+
+# Shared by every categorize_expenses call in this process
+category_cache = CategoryCache()
+
+
+@metrics.timed('categorize.match')
+def categorize_expenses(items, keywords=None, first_match_wins=True, word_boundary=False, priorities=None,
+                        rules=None, rule_set=None):
+    """
+    Assign each item to a category using a prebuilt keyword automaton.
+    The defaults keep the original behaviour: substring matching, and the
+    first category in table order with a matching keyword wins.
+    With a RuleStore as rules, its current compiled index and matching
+    options are used (it hot-reloads when the rules file changes) and
+    per-rule hits are counted.
+    rule_set, a CompiledRules or KeywordRuleSet the caller already resolved,
+    is used as is instead of looking the rules up again.
+    Winning rules are memoized per item text in category_cache.
+    """
+    if rule_set is None:
+        if rules is not None:
+            rule_set = rules.rules()
+        else:
+            rule_set = keyword_rule_set(keywords, word_boundary, priorities, first_match_wins)
+    matcher = rule_set.matcher
+    first_match_wins = rule_set.first_match_wins
+    version = rule_set.fingerprint
     categorized = defaultdict(lambda: {'items': [], 'amounts': []})
 
+    def match(text):
+        return matcher.match_rule(text, first_match_wins=first_match_wins)
+
     for item in items:
-        matched = False
-        item_lower = item.lower()
-        for category, keywords in CATEGORY_KEYWORDS.items():
-            if any(keyword in item_lower for keyword in keywords):
-                categorized[category]['items'].append(item)
-                matched = True
-                break
-        if not matched:
+        # The parser already collapses whitespace in item text; lowercasing
+        # is the matcher's own normalization
+        rule = category_cache.lookup(version, item.lower(), match)
+        if rule is None:
             categorized['Miscellaneous']['items'].append(item)
+            continue
+        if rules is not None:
+            rules.record_hit(*rule)
+        categorized[rule[0]]['items'].append(item)
 
     return categorized
 
 
+@metrics.timed('categorize.assign')
 def assign_amounts_to_categories(amounts, categorized):
     all_items = sum(len(data['items']) for data in categorized.values())
     if all_items == 0 or not amounts:
@@ -98,8 +390,13 @@ def assign_amounts_to_categories(amounts, categorized):
     return categorized
 
 
-def smart_categorize(text):
+def categorize_parsed(amounts, items, rules=None, rule_set=None):
+    """Categorize already-parsed amounts and items, without re-reading the text"""
+    categorized = categorize_expenses(items, rules=rules, rule_set=rule_set)
+    return assign_amounts_to_categories(amounts, categorized)
+
+
+def smart_categorize(text, rules=None):
     amounts, items = parse_amounts_and_items(text)
-    categorized = categorize_expenses(items)
-    categorized = assign_amounts_to_categories(amounts, categorized)
+    categorized = categorize_parsed(amounts, items, rules=rules)
     return categorized, sum(amounts)
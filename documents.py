@@ -0,0 +1,225 @@
+"""
+Multi-page receipt documents: PDF invoices and multi-frame TIFF scans.
+
+Pages are rendered one at a time and OCR'd on a small thread pool; at most
+`workers` rendered pages are held in memory at once. The page texts are
+merged in page order, with each page's offsets into the merged text.
+
+PDFs are rasterized with pypdfium2 when it is installed, otherwise with the
+poppler command line tools (pdftoppm / pdfinfo).
+"""
+import os
+import re
+import logging
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from expense_db import file_sha256
+from ocr_cache import make_cache_key
+from ocr_utils import (DEFAULT_MIN_CONFIDENCE, fit_to_edge, get_ocr_backend, ocr_cache_params,
+                       preprocess_array, recognize_text)
+import metrics
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+PDF_EXTENSIONS = ('.pdf',)
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+DOCUMENT_EXTENSIONS = PDF_EXTENSIONS + TIFF_EXTENSIONS
+
+# Rasterization resolution for PDF pages
+PDF_DPI = 300
+
+# Pages OCR'd at once; each holds one rendered page in memory
+DEFAULT_PAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Seconds allowed for poppler to render one page
+PDFTOPPM_TIMEOUT = 120
+
+PDFINFO_PAGES_RE = re.compile(r"^Pages:\s+(\d+)", re.MULTILINE)
+
+# number is 1-based; start/end are offsets of the page's text in the merged text
+PageText = namedtuple('PageText', ['number', 'start', 'end'])
+DocumentText = namedtuple('DocumentText', ['text', 'pages'])
+
+
+def is_document(path):
+    """True for files that go through the page-by-page loader"""
+    return path.lower().endswith(DOCUMENT_EXTENSIONS)
+
+
+def page_count(path):
+    """Number of pages (PDF) or frames (TIFF) without rendering any of them"""
+    if path.lower().endswith(TIFF_EXTENSIONS):
+        with Image.open(path) as image:
+            return getattr(image, 'n_frames', 1)
+
+    if pypdfium2 is not None:
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    try:
+        completed = subprocess.run(["pdfinfo", path], capture_output=True, text=True, check=True)
+    except FileNotFoundError:
+        raise RuntimeError("Reading PDFs needs pypdfium2 or poppler's pdftoppm/pdfinfo")
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"Could not read PDF {path}: {e.stderr.strip()}")
+    match = PDFINFO_PAGES_RE.search(completed.stdout)
+    if not match:
+        raise ValueError(f"Could not read page count of {path}")
+    return int(match.group(1))
+
+
+def _render_pdf_pages(path, numbers, dpi):
+    if pypdfium2 is not None:
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            for number in numbers:
+                page = pdf[number - 1]
+                try:
+                    bitmap = page.render(scale=dpi / 72, grayscale=True)
+                    gray = np.array(bitmap.to_pil().convert('L'))
+                finally:
+                    page.close()
+                yield number, gray
+        finally:
+            pdf.close()
+        return
+
+    for number in numbers:
+        # Without an output root pdftoppm writes the single page to stdout
+        completed = subprocess.run(
+            ["pdftoppm", "-r", str(dpi), "-f", str(number), "-l", str(number), "-gray", "-png", path],
+            capture_output=True, check=True, timeout=PDFTOPPM_TIMEOUT
+        )
+        gray = cv2.imdecode(np.frombuffer(completed.stdout, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError(f"Could not render page {number} of {path}")
+        yield number, gray
+
+
+def _read_tiff_frames(path, numbers):
+    wanted = set(numbers)
+    with Image.open(path) as image:
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            if index + 1 in wanted:
+                yield index + 1, np.array(frame.convert('L'))
+
+
+def iter_pages(path, numbers=None, dpi=PDF_DPI):
+    """
+    Lazily yield (page number, grayscale array) for the requested 1-based
+    page numbers (default: all), downscaled to the preprocessing max edge.
+    """
+    if numbers is None:
+        numbers = range(1, page_count(path) + 1)
+    if path.lower().endswith(TIFF_EXTENSIONS):
+        pages = _read_tiff_frames(path, numbers)
+    else:
+        pages = _render_pdf_pages(path, numbers, dpi)
+
+    while True:
+        with metrics.span('ocr.render'):
+            page = next(pages, None)
+        if page is None:
+            return
+        number, gray = page
+        yield number, fit_to_edge(gray)
+
+
+def _page_cache_key(digest, number, params):
+    return make_cache_key(f"{digest}:page={number}".encode("ascii"), params)
+
+
+def _ocr_page(gray, backend, min_confidence, learned_order):
+    with metrics.span('ocr.page'):
+        image, profile = preprocess_array(gray, return_profile=True)
+        return recognize_text(image, backend=backend, min_confidence=min_confidence, profile=profile,
+                              learned_order=learned_order)
+
+
+def merge_pages(page_texts):
+    """DocumentText from {page number: text}, pages joined in order by newlines"""
+    parts = []
+    pages = []
+    offset = 0
+    for number in sorted(page_texts):
+        text = page_texts[number]
+        if parts:
+            offset += 1
+        pages.append(PageText(number, offset, offset + len(text)))
+        parts.append(text)
+        offset += len(text)
+    return DocumentText("\n".join(parts), tuple(pages))
+
+
+@metrics.timed('ocr.document')
+def extract_text_from_document(path, dpi=PDF_DPI, backend=None, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                               cache=None, workers=None):
+    """
+    OCR every page of a PDF or TIFF and return a DocumentText.
+    With an OCRCache, each page is cached separately, so only pages that
+    missed are rendered at all.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File not found: {path}")
+
+    backend = get_ocr_backend(backend)
+    workers = workers or DEFAULT_PAGE_WORKERS
+    numbers = range(1, page_count(path) + 1)
+
+    page_texts = {}
+    keys = {}
+    if cache is not None:
+        digest = file_sha256(path)
+        params = dict(ocr_cache_params(True, backend, min_confidence), dpi=dpi)
+        for number in numbers:
+            keys[number] = _page_cache_key(digest, number, params)
+            cached = cache.get(keys[number])
+            if cached is not None:
+                page_texts[number] = cached
+    missing = [number for number in numbers if number not in page_texts]
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page') as executor:
+            pending = {}
+            pages = iter_pages(path, missing, dpi=dpi)
+            try:
+                while True:
+                    # Render the next page only when a worker is free for it
+                    while len(pending) < workers:
+                        page = next(pages, None)
+                        if page is None:
+                            break
+                        number, gray = page
+                        pending[executor.submit(_ocr_page, gray, backend, min_confidence, cache is None)] = number
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        number = pending.pop(future)
+                        try:
+                            page_texts[number] = future.result()
+                        except Exception as e:
+                            logging.error(f"OCR failed on page {number} of {path}: {e}")
+                            raise Exception(f"OCR failed on page {number}: {e}")
+                        if cache is not None:
+                            cache.put(keys[number], page_texts[number])
+            finally:
+                pages.close()
+                for future in pending:
+                    future.cancel()
+
+    logging.info(f"OCR'd {len(missing)} of {len(numbers)} pages: {path}")
+    return merge_pages(page_texts)
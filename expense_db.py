@@ -0,0 +1,494 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime
+from itertools import combinations
+
+DEFAULT_DB_PATH = os.path.join("reports", "expenses.sqlite3")
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY,
+    source_path TEXT,
+    source_hash TEXT,
+    scanned_at TEXT NOT NULL,
+    total REAL NOT NULL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_receipts_scanned_at ON receipts(scanned_at);
+CREATE INDEX IF NOT EXISTS idx_receipts_source_hash ON receipts(source_hash);
+
+CREATE TABLE IF NOT EXISTS line_items (
+    id INTEGER PRIMARY KEY,
+    receipt_id INTEGER NOT NULL REFERENCES receipts(id) ON DELETE CASCADE,
+    item TEXT NOT NULL,
+    category TEXT NOT NULL,
+    amount REAL,
+    -- Copied from the receipt so date-range aggregates stay on one index
+    scanned_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_line_items_category_date ON line_items(category, scanned_at, amount);
+CREATE INDEX IF NOT EXISTS idx_line_items_date ON line_items(scanned_at, category, amount);
+CREATE INDEX IF NOT EXISTS idx_line_items_receipt ON line_items(receipt_id);
+
+-- Parsed OCR output, so re-categorization never re-parses text, and the
+-- rule set that produced the receipt's current line items
+CREATE TABLE IF NOT EXISTS receipt_parses (
+    receipt_id INTEGER PRIMARY KEY REFERENCES receipts(id) ON DELETE CASCADE,
+    amounts TEXT NOT NULL,
+    items TEXT NOT NULL,
+    rules_version TEXT
+);
+
+-- Perceptual hash of each receipt's image, for near-duplicate lookup
+CREATE TABLE IF NOT EXISTS receipt_images (
+    receipt_id INTEGER PRIMARY KEY REFERENCES receipts(id) ON DELETE CASCADE,
+    hash BLOB NOT NULL
+);
+
+-- Multi-index over the image hashes: one row per hash chunk, keyed by
+-- chunk position and value (see _hash_chunks). Rows of deleted receipts are
+-- left behind and dropped by the join with receipt_images. It replaces
+-- receipt_image_chunks, which used a coarser chunk layout.
+CREATE TABLE IF NOT EXISTS receipt_image_keys (
+    chunk INTEGER NOT NULL,
+    receipt_id INTEGER NOT NULL,
+    PRIMARY KEY (chunk, receipt_id)
+) WITHOUT ROWID;
+
+-- Every rule set receipts were categorized with, by content hash
+CREATE TABLE IF NOT EXISTS rule_sets (
+    version TEXT PRIMARY KEY,
+    rules TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- How often each keyword rule of a rule set matched, summed over batch runs
+CREATE TABLE IF NOT EXISTS rule_hits (
+    version TEXT NOT NULL,
+    category TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (version, category, keyword)
+);
+"""
+
+
+def file_sha256(path):
+    """Hex sha256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _timestamp(value):
+    if value is None:
+        return datetime.now().strftime(TIMESTAMP_FORMAT)
+    if isinstance(value, datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+
+def _range_clause(start, end, column="scanned_at"):
+    clauses = []
+    params = []
+    if start is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(_timestamp(start))
+    if end is not None:
+        clauses.append(f"{column} < ?")
+        params.append(_timestamp(end))
+    return (" AND ".join(clauses) or "1"), params
+
+
+# Image hashes are indexed in this many chunks of (nearly) equal width. A
+# hash that differs from the query in at most max_distance bits differs in at
+# most max_distance // chunks bits in some chunk (pigeonhole), so probing
+# every chunk value within that radius finds every match. 13 chunks of 19-20
+# bits keep the default threshold (25 of 256 bits) at one-bit probes.
+IMAGE_HASH_CHUNKS = 13
+# Chunk keys per query, below SQLite's oldest limit on bound parameters
+PROBE_BATCH_SIZE = 500
+
+
+def _chunk_widths(bits):
+    base, extra = divmod(bits, IMAGE_HASH_CHUNKS)
+    return [base + 1] * extra + [base] * (IMAGE_HASH_CHUNKS - extra)
+
+
+def _hash_chunks(image_hash):
+    """Multi-index keys of an image hash: chunk position << 32 | chunk value"""
+    value = int.from_bytes(image_hash, 'big')
+    shift = len(image_hash) * 8
+    keys = []
+    for i, width in enumerate(_chunk_widths(shift)):
+        shift -= width
+        keys.append((i << 32) | ((value >> shift) & ((1 << width) - 1)))
+    return keys
+
+
+def _probe_keys(image_hash, radius):
+    """Keys of every chunk value within radius bits of image_hash's chunks"""
+    keys = []
+    for key, width in zip(_hash_chunks(image_hash), _chunk_widths(len(image_hash) * 8)):
+        for flips in range(radius + 1):
+            for bits in combinations(range(width), flips):
+                probe = key
+                for bit in bits:
+                    probe ^= 1 << bit
+                keys.append(probe)
+    return keys
+
+
+def _line_rows(receipt_id, categories, scanned_at):
+    rows = []
+    for category, data in categories.items():
+        amounts = data['amounts']
+        for i, item in enumerate(data['items']):
+            amount = amounts[i] if i < len(amounts) else None
+            rows.append((receipt_id, item, category, amount, scanned_at))
+    return rows
+
+
+class ExpenseDB:
+    """
+    Indexed SQLite store of scanned receipts and their categorized line items.
+    Date ranges are half-open: start <= scanned_at < end.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._migrate_image_index()
+
+    def _migrate_image_index(self):
+        """Re-index image hashes stored under the old 4-byte chunk layout"""
+        old = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'receipt_image_chunks'"
+        ).fetchone()
+        if old is None:
+            return
+        with self._conn:
+            rows = self._conn.execute("SELECT receipt_id, hash FROM receipt_images").fetchall()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO receipt_image_keys (chunk, receipt_id) VALUES (?, ?)",
+                [(chunk, receipt_id) for receipt_id, image_hash in rows for chunk in _hash_chunks(image_hash)]
+            )
+            self._conn.execute("DROP TABLE receipt_image_chunks")
+
+    def add_receipt(self, source_path, text, categorized, total, scanned_at=None, source_hash=None,
+                    amounts=None, items=None, rules_version=None, image_hash=None):
+        """Store one receipt and return its id"""
+        return self.add_receipts([{
+            'source_path': source_path,
+            'text': text,
+            'categories': categorized,
+            'total': total,
+            'scanned_at': scanned_at,
+            'source_hash': source_hash,
+            'amounts': amounts,
+            'items': items,
+            'rules_version': rules_version,
+            'image_hash': image_hash
+        }])[0]
+
+    def add_scan(self, result, source_hash=None, scanned_at=None):
+        """Store a ScanResult and return its id"""
+        return self.add_receipts([{
+            'source_path': result.source_path,
+            'text': result.text,
+            'categories': result.categories,
+            'total': result.total,
+            'scanned_at': scanned_at,
+            'source_hash': source_hash,
+            'amounts': result.amounts,
+            'items': result.items,
+            'rules_version': result.rules_version,
+            'image_hash': result.image_hash
+        }])[0]
+
+    def add_receipts(self, records):
+        """
+        Store many receipts in one transaction and return their ids.
+        Each record has source_path, text, categories ({category: {'items',
+        'amounts'}}), total and optionally scanned_at, source_hash and the
+        parsed amounts, items and rules_version they were categorized with,
+        and image_hash (hex perceptual hash of the receipt photo).
+        """
+        ids = []
+        with self._lock, self._conn:
+            line_rows = []
+            parse_rows = []
+            image_rows = []
+            chunk_rows = []
+            for record in records:
+                scanned_at = _timestamp(record.get('scanned_at'))
+                cursor = self._conn.execute(
+                    "INSERT INTO receipts (source_path, source_hash, scanned_at, total, text) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (record.get('source_path'), record.get('source_hash'), scanned_at,
+                     record['total'], record.get('text'))
+                )
+                receipt_id = cursor.lastrowid
+                ids.append(receipt_id)
+                line_rows.extend(_line_rows(receipt_id, record['categories'], scanned_at))
+                if record.get('amounts') is not None and record.get('items') is not None:
+                    parse_rows.append((receipt_id, json.dumps(list(record['amounts'])),
+                                       json.dumps(list(record['items'])), record.get('rules_version')))
+                if record.get('image_hash'):
+                    image_hash = bytes.fromhex(record['image_hash'])
+                    image_rows.append((receipt_id, image_hash))
+                    chunk_rows.extend((chunk, receipt_id) for chunk in _hash_chunks(image_hash))
+            self._conn.executemany(
+                "INSERT INTO line_items (receipt_id, item, category, amount, scanned_at) VALUES (?, ?, ?, ?, ?)",
+                line_rows
+            )
+            self._conn.executemany(
+                "INSERT INTO receipt_parses (receipt_id, amounts, items, rules_version) VALUES (?, ?, ?, ?)",
+                parse_rows
+            )
+            self._conn.executemany("INSERT INTO receipt_images (receipt_id, hash) VALUES (?, ?)", image_rows)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO receipt_image_keys (chunk, receipt_id) VALUES (?, ?)", chunk_rows
+            )
+        return ids
+
+    def register_rules(self, version, table, options=None):
+        """Remember the rule set behind a rules version (no-op if already known)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO rule_sets (version, rules, created_at) VALUES (?, ?, ?)",
+                (version, json.dumps({'table': table, 'options': options or {}}), _timestamp(None))
+            )
+
+    def get_rules(self, version):
+        """(table, options) registered for a rules version, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT rules FROM rule_sets WHERE version = ?", (version,)).fetchone()
+        if row is None:
+            return None
+        rules = json.loads(row[0])
+        return rules['table'], rules['options']
+
+    def add_rule_hits(self, version, rows):
+        """Add [category, keyword, count] rule hit rows to the totals of a rules version"""
+        params = [(count, version, category, keyword) for category, keyword, count in rows]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO rule_hits (version, category, keyword, hits) VALUES (?2, ?3, ?4, 0)", params
+            )
+            self._conn.executemany(
+                "UPDATE rule_hits SET hits = hits + ?1 WHERE version = ?2 AND category = ?3 AND keyword = ?4", params
+            )
+
+    def rule_hits(self, version):
+        """Counter of (category, keyword) match counts stored for a rules version"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT category, keyword, hits FROM rule_hits WHERE version = ?", (version,)
+            ).fetchall()
+        return Counter({(category, keyword): hits for category, keyword, hits in rows})
+
+    def backfill_parses(self, parse, batch_size=500):
+        """
+        Parse the stored text of receipts saved without parsed amounts/items,
+        once, with parse(text) -> (amounts, items). Returns how many were filled.
+        """
+        filled = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT r.id, r.text FROM receipts r LEFT JOIN receipt_parses p ON p.receipt_id = r.id "
+                    "WHERE p.receipt_id IS NULL ORDER BY r.id LIMIT ?",
+                    (batch_size,)
+                ).fetchall()
+            if not rows:
+                return filled
+            parse_rows = []
+            for receipt_id, text in rows:
+                amounts, items = parse(text or '')
+                # Unknown rules version: the next re-categorization re-evaluates it fully
+                parse_rows.append((receipt_id, json.dumps(list(amounts)), json.dumps(list(items)), None))
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO receipt_parses (receipt_id, amounts, items, rules_version) "
+                    "VALUES (?, ?, ?, ?)",
+                    parse_rows
+                )
+            filled += len(parse_rows)
+
+    def stale_parses(self, version, after_id=0, limit=500):
+        """
+        [(receipt_id, amounts, items, rules_version)] not yet categorized with
+        version, in receipt id order after after_id.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT receipt_id, amounts, items, rules_version FROM receipt_parses "
+                "WHERE receipt_id > ? AND (rules_version IS NULL OR rules_version != ?) "
+                "ORDER BY receipt_id LIMIT ?",
+                (after_id, version, limit)
+            ).fetchall()
+        return [(receipt_id, json.loads(amounts), json.loads(items), rules_version)
+                for receipt_id, amounts, items, rules_version in rows]
+
+    def stale_versions(self, version):
+        """{rules version or None: receipt count} for receipts not categorized with version"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rules_version, COUNT(*) FROM receipt_parses "
+                "WHERE rules_version IS NULL OR rules_version != ? GROUP BY rules_version",
+                (version,)
+            ).fetchall()
+        return dict(rows)
+
+    def apply_categories(self, version, updates):
+        """
+        Record a re-categorization pass in one transaction. updates is
+        [(receipt_id, categories or None)]; None means the receipt's line items
+        are unchanged and only its rules version moves to version.
+        """
+        with self._lock, self._conn:
+            for receipt_id, categories in updates:
+                if categories is None:
+                    continue
+                scanned_at = self._conn.execute(
+                    "SELECT scanned_at FROM receipts WHERE id = ?", (receipt_id,)
+                ).fetchone()[0]
+                self._conn.execute("DELETE FROM line_items WHERE receipt_id = ?", (receipt_id,))
+                self._conn.executemany(
+                    "INSERT INTO line_items (receipt_id, item, category, amount, scanned_at) VALUES (?, ?, ?, ?, ?)",
+                    _line_rows(receipt_id, categories, scanned_at)
+                )
+            self._conn.executemany(
+                "UPDATE receipt_parses SET rules_version = ? WHERE receipt_id = ?",
+                [(version, receipt_id) for receipt_id, _ in updates]
+            )
+
+    def category_totals(self, start=None, end=None):
+        """{category: total amount} for line items scanned in [start, end)"""
+        where, params = _range_clause(start, end)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT category, SUM(amount) FROM line_items WHERE {where} "
+                "GROUP BY category ORDER BY category",
+                params
+            ).fetchall()
+        return {category: total or 0.0 for category, total in rows}
+
+    def category_total(self, category, start=None, end=None):
+        """Total spend in one category for [start, end)"""
+        where, params = _range_clause(start, end)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT SUM(amount) FROM line_items WHERE category = ? AND {where}",
+                [category] + params
+            ).fetchone()
+        return row[0] or 0.0
+
+    def daily_totals(self, start=None, end=None):
+        """[(YYYY-MM-DD, total)] of receipt totals per day in [start, end)"""
+        where, params = _range_clause(start, end)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT substr(scanned_at, 1, 10) AS day, SUM(total) FROM receipts WHERE {where} "
+                "GROUP BY day ORDER BY day",
+                params
+            ).fetchall()
+
+    def find_by_hash(self, source_hash):
+        """Id of a receipt already stored for this source hash, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM receipts WHERE source_hash = ? LIMIT 1", (source_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_similar_image(self, image_hash, max_distance):
+        """
+        (receipt_id, distance) of the stored receipt whose image hash is
+        nearest to image_hash (hex), if within max_distance bits, else None.
+        Every such receipt is found. Only receipts with a hash chunk within
+        max_distance // IMAGE_HASH_CHUNKS bits of this hash's are compared, so
+        the cost follows the number of look-alike receipts, not the size of
+        the archive.
+        """
+        image_hash = bytes.fromhex(image_hash)
+        keys = _probe_keys(image_hash, max_distance // IMAGE_HASH_CHUNKS)
+        rows = {}
+        with self._lock:
+            for offset in range(0, len(keys), PROBE_BATCH_SIZE):
+                batch = keys[offset:offset + PROBE_BATCH_SIZE]
+                rows.update(self._conn.execute(
+                    "SELECT i.receipt_id, i.hash FROM receipt_image_keys c "
+                    "JOIN receipt_images i ON i.receipt_id = c.receipt_id "
+                    f"WHERE c.chunk IN ({', '.join('?' * len(batch))})",
+                    batch
+                ).fetchall())
+
+        value = int.from_bytes(image_hash, 'big')
+        best = None
+        for receipt_id, stored in rows.items():
+            distance = bin(value ^ int.from_bytes(stored, 'big')).count('1')
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (receipt_id, distance)
+        return best
+
+    def get_parse(self, receipt_id):
+        """(text, amounts, items) of a stored receipt, amounts/items None if never parsed"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT r.text, p.amounts, p.items FROM receipts r "
+                "LEFT JOIN receipt_parses p ON p.receipt_id = r.id WHERE r.id = ?",
+                (receipt_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        text, amounts, items = row
+        if amounts is None:
+            return text, None, None
+        return text, json.loads(amounts), json.loads(items)
+
+    def get_receipt(self, receipt_id):
+        """A stored receipt with its categories rebuilt, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, source_path, source_hash, scanned_at, total, text FROM receipts WHERE id = ?",
+                (receipt_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            items = self._conn.execute(
+                "SELECT item, category, amount FROM line_items WHERE receipt_id = ? ORDER BY id",
+                (receipt_id,)
+            ).fetchall()
+
+        categories = {}
+        for item, category, amount in items:
+            data = categories.setdefault(category, {'items': [], 'amounts': []})
+            data['items'].append(item)
+            if amount is not None:
+                data['amounts'].append(amount)
+        keys = ('id', 'source_path', 'source_hash', 'scanned_at', 'total', 'text')
+        receipt = dict(zip(keys, row))
+        receipt['categories'] = categories
+        return receipt
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
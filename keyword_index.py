@@ -0,0 +1,156 @@
+from collections import deque
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a {category: [keywords]} table.
+    Finds every keyword occurrence in a single pass over the text, so the cost
+    per item no longer grows with the number of keywords.
+    """
+
+    def __init__(self, table, word_boundary=False, priorities=None):
+        self.categories = list(table)
+        self.word_boundary = word_boundary
+        self.priorities = priorities or {}
+
+        # Pattern id -> (category index, keyword)
+        self.patterns = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for category_index, category in enumerate(self.categories):
+            for keyword in table[category]:
+                keyword = keyword.lower()
+                if keyword:
+                    self._add(keyword, len(self.patterns))
+                    self.patterns.append((category_index, keyword))
+        self._build_failure_links()
+
+    def _add(self, keyword, pattern_id):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._out[state].append(pattern_id)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                # Inherit matches that end here through the failure chain
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def find_all(self, text):
+        """
+        Yield (start, end, pattern_id) for every keyword occurrence in text.
+        Text is expected to be lowercased already.
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in out[state]:
+                keyword = self.patterns[pattern_id][1]
+                start = i + 1 - len(keyword)
+                if self.word_boundary and not self._on_boundary(text, start, i + 1):
+                    continue
+                yield start, i + 1, pattern_id
+
+    @staticmethod
+    def _on_boundary(text, start, end):
+        if start > 0 and _is_word_char(text[start - 1]):
+            return False
+        if end < len(text) and _is_word_char(text[end]):
+            return False
+        return True
+
+    def match_rule(self, text, first_match_wins=True):
+        """
+        Return (category, keyword) for the winning match in text, or None.
+
+        first_match_wins reproduces the original rule: the first category in
+        table order with any matching keyword. Otherwise the highest priority
+        category wins, then the longest keyword, then the earliest position.
+        """
+        best = None
+        best_rank = None
+        for start, end, pattern_id in self.find_all(text):
+            category_index, keyword = self.patterns[pattern_id]
+            if first_match_wins:
+                rank = (category_index,)
+            else:
+                category = self.categories[category_index]
+                rank = (-self.priorities.get(category, 0), -len(keyword), start, category_index)
+            if best_rank is None or rank < best_rank:
+                best_rank = rank
+                best = pattern_id
+                if first_match_wins and category_index == 0:
+                    break
+        if best is None:
+            return None
+        category_index, keyword = self.patterns[best]
+        return self.categories[category_index], keyword
+
+    def match(self, text, first_match_wins=True):
+        """Return the winning category for text, or None if no keyword matches"""
+        rule = self.match_rule(text, first_match_wins=first_match_wins)
+        return rule[0] if rule else None
+
+
+# Edit count per keyword table, by id(). Code that edits a table in place
+# calls table_changed(); cached matchers are checked against the table's
+# identity and this count, never by walking the table.
+_table_generations = {}
+_matchers = {}
+
+
+def table_changed(table):
+    """Record an in-place edit of a keyword table so its matcher is rebuilt"""
+    _table_generations[id(table)] = _table_generations.get(id(table), 0) + 1
+
+
+def table_generation(table):
+    """Edit count of a keyword table, as recorded by table_changed()"""
+    return _table_generations.get(id(table), 0)
+
+
+def get_matcher(table, word_boundary=False, priorities=None):
+    """
+    Return a compiled matcher for table, building it only when another
+    table is passed, table_changed(table) was called, or the matching
+    options changed since the last call. The check costs the same for any
+    table size.
+    """
+    key = (
+        word_boundary,
+        tuple(sorted((priorities or {}).items()))
+    )
+    generation = table_generation(table)
+    cached = _matchers.get(key)
+    # The entry holds the table itself, so its id() cannot be reused meanwhile
+    if cached is None or cached[0] is not table or cached[1] != generation:
+        cached = (table, generation, KeywordMatcher(table, word_boundary=word_boundary, priorities=priorities))
+        _matchers[key] = cached
+    return cached[2]
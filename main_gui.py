@@ -1,33 +1,101 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-from PIL import Image, ImageTk
 import os
 from datetime import datetime
+import queue
 import threading
-from ocr_utils import extract_text_from_image
-from categorizer import categorize_expenses, parse_amounts_and_items,smart_categorize
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import scan_receipt
+from batch import IMAGE_EXTENSIONS
+from categorizer import CATEGORY_KEYWORDS
+from rule_store import rules_version
+from ocr_cache import OCRCache
+from expense_db import ExpenseDB, file_sha256
+from reports import write_text_report
+import metrics
+import startup
 import logging
+import sys
+
+try:
+    from tkinterdnd2 import TkinterDnD, DND_FILES
+except ImportError:
+    TkinterDnD = None
+
+# Background scan threads. Tesseract runs as a subprocess and OpenCV releases
+# the GIL, so a few threads keep several cores busy without a process pool
+MAX_SCAN_WORKERS = min(4, os.cpu_count() or 1)
+
+# How often worker messages are drained into the UI (milliseconds), and the
+# most messages applied per tick so a burst of finished scans can't stall Tk
+POLL_INTERVAL_MS = 200
+MAX_MESSAGES_PER_TICK = 500
+
+
+class ScanJob:
+    """One receipt in the scan queue. Only the Tk main thread mutates it."""
+    
+    def __init__(self, job_id, path):
+        self.id = job_id
+        self.path = path
+        self.status = "queued"
+        self.latency = None
+        self.result = None
+        self.error = None
+        self.future = None
+        # Bumped on retry so late messages from an earlier attempt are dropped
+        self.attempt = 0
+        self.cancel_event = threading.Event()
+
 
 class ReceptixGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Receptix - Smart Receipt Scanner")
-        self.root.geometry("900x700")
+        self.root.geometry("900x820")
         self.root.configure(bg="#f0f0f0")
         
         # Initialize variables
         self.current_image_path = None
-        self.extracted_text = ""
-        self.expense_data = {}
+        self.scan_result = None
+        
+        # Scan queue. Jobs belong to the Tk main thread; worker threads never
+        # touch them or any widget, they post (job_id, attempt, changes)
+        # messages which _drain_messages applies on a timer.
+        self.jobs = {}
+        self.messages = queue.SimpleQueue()
+        self._next_job_id = 0
+        self._category_rows = {}
+        self.executor = ThreadPoolExecutor(max_workers=MAX_SCAN_WORKERS, thread_name_prefix="scan")
         
         # Setup logging
         self.setup_logging()
         
+        # Per-stage timing histograms, exported to logs/ after each scan
+        if os.environ.get("RECEPTIX_METRICS"):
+            metrics.enable()
+        
+        # Re-scanned or re-uploaded receipts are served from the OCR cache
+        self.ocr_cache = OCRCache()
+        
+        # Saved reports also go into the indexed expense database, along with
+        # the rule set they were categorized with for later re-categorization
+        self.expense_db = ExpenseDB()
+        self.expense_db.register_rules(rules_version(CATEGORY_KEYWORDS), CATEGORY_KEYWORDS)
+        
         # Create GUI elements
         self.create_widgets()
         
         # Center the window
         self.center_window()
+        
+        # Start refreshing the progress table
+        self.root.after(POLL_INTERVAL_MS, self._drain_messages)
+        
+        # The OCR stack is imported on a background thread once the window
+        # is drawn; a scan started before it finishes just imports it itself
+        self.root.after_idle(startup.warm_up)
     
     def setup_logging(self):
         """Setup logging configuration"""
@@ -60,6 +128,7 @@ class ReceptixGUI:
         
         # Create main frames
         self.create_upload_frame()
+        self.create_queue_frame()
         self.create_text_display_frame()
         self.create_results_frame()
         self.create_action_buttons_frame()
@@ -79,7 +148,7 @@ class ReceptixGUI:
         upload_frame.pack(fill="x", padx=20, pady=10)
         
         # File path display
-        self.file_path_var = tk.StringVar(value="No file selected")
+        self.file_path_var = tk.StringVar(value="No file selected - browse or drop receipt images")
         path_label = tk.Label(
             upload_frame, 
             textvariable=self.file_path_var,
@@ -92,7 +161,7 @@ class ReceptixGUI:
         # Browse button
         browse_btn = tk.Button(
             upload_frame,
-            text="📁 Browse Image",
+            text="📁 Browse Images",
             command=self.browse_image,
             bg="#3498db",
             fg="white",
@@ -102,6 +171,69 @@ class ReceptixGUI:
         )
         browse_btn.pack(side="right", padx=10, pady=10)
     
+    def create_queue_frame(self):
+        """Create scan queue section with per-file progress"""
+        queue_frame = tk.LabelFrame(
+            self.root,
+            text="📋 Scan Queue",
+            font=("Arial", 12, "bold"),
+            bg="#f0f0f0",
+            fg="#34495e"
+        )
+        queue_frame.pack(fill="x", padx=20, pady=5)
+        
+        table_frame = tk.Frame(queue_frame, bg="#f0f0f0")
+        table_frame.pack(side="left", fill="both", expand=True, padx=10, pady=5)
+        
+        self.job_tree = ttk.Treeview(
+            table_frame,
+            columns=("Status", "Latency"),
+            show="tree headings",
+            height=5
+        )
+        self.job_tree.heading("#0", text="File")
+        self.job_tree.heading("Status", text="Status")
+        self.job_tree.heading("Latency", text="Latency")
+        self.job_tree.column("#0", width=400)
+        self.job_tree.column("Status", width=100, anchor="center")
+        self.job_tree.column("Latency", width=100, anchor="center")
+        self.job_tree.bind("<<TreeviewSelect>>", self._on_job_selected)
+        
+        job_scroll = ttk.Scrollbar(table_frame, orient="vertical", command=self.job_tree.yview)
+        self.job_tree.configure(yscrollcommand=job_scroll.set)
+        self.job_tree.pack(side="left", fill="both", expand=True)
+        job_scroll.pack(side="right", fill="y")
+        
+        # Drag and drop needs tkinterdnd2; without it, use Browse
+        if TkinterDnD is not None and hasattr(self.job_tree, "drop_target_register"):
+            self.job_tree.drop_target_register(DND_FILES)
+            self.job_tree.dnd_bind("<<Drop>>", self._on_drop)
+        
+        queue_buttons = tk.Frame(queue_frame, bg="#f0f0f0")
+        queue_buttons.pack(side="right", fill="y", padx=10, pady=5)
+        
+        tk.Button(
+            queue_buttons,
+            text="⏹ Cancel",
+            command=self.cancel_jobs,
+            bg="#e67e22",
+            fg="white",
+            font=("Arial", 10, "bold"),
+            cursor="hand2",
+            relief="flat"
+        ).pack(fill="x", pady=2)
+        
+        tk.Button(
+            queue_buttons,
+            text="🔁 Retry",
+            command=self.retry_jobs,
+            bg="#8e44ad",
+            fg="white",
+            font=("Arial", 10, "bold"),
+            cursor="hand2",
+            relief="flat"
+        ).pack(fill="x", pady=2)
+    
     def create_text_display_frame(self):
         """Create extracted text display section"""
         text_frame = tk.LabelFrame(
@@ -116,7 +248,7 @@ class ReceptixGUI:
         # Text display area
         self.text_display = scrolledtext.ScrolledText(
             text_frame,
-            height=8,
+            height=6,
             font=("Courier", 10),
             bg="#ffffff",
             fg="#2c3e50",
@@ -271,129 +403,265 @@ class ReceptixGUI:
         status_bar.pack(side="bottom", fill="x")
     
     def browse_image(self):
-        """Open file dialog to browse for image"""
+        """Open file dialog to browse for one or more images"""
         file_types = [
-            ("Image files", "*.png *.jpg *.jpeg *.gif *.bmp *.tiff"),
+            ("Receipts", "*.png *.jpg *.jpeg *.gif *.bmp *.tiff *.tif *.pdf"),
+            ("PDF documents", "*.pdf"),
             ("PNG files", "*.png"),
             ("JPEG files", "*.jpg *.jpeg"),
             ("All files", "*.*")
         ]
         
-        file_path = filedialog.askopenfilename(
-            title="Select Receipt Image",
+        file_paths = filedialog.askopenfilenames(
+            title="Select Receipt Images",
             filetypes=file_types
         )
         
-        if file_path:
-            self.current_image_path = file_path
-            self.file_path_var.set(os.path.basename(file_path))
-            self.scan_btn.config(state="normal")
-            self.status_var.set(f"Image loaded: {os.path.basename(file_path)}")
-            logging.info(f"Image loaded: {file_path}")
+        if file_paths:
+            self.add_files(file_paths)
+    
+    def _on_drop(self, event):
+        """Queue image files dropped onto the scan queue"""
+        paths = [p for p in self.root.tk.splitlist(event.data) if p.lower().endswith(IMAGE_EXTENSIONS)]
+        if paths:
+            self.add_files(paths)
+    
+    def add_files(self, file_paths):
+        """Add receipt images to the scan queue (called from main thread)"""
+        for path in file_paths:
+            job = ScanJob(self._next_job_id, path)
+            self._next_job_id += 1
+            self.jobs[job.id] = job
+            self.job_tree.insert("", "end", iid=str(job.id), text=os.path.basename(path),
+                                 values=(job.status, ""))
+            logging.info(f"Image loaded: {path}")
+        
+        self.current_image_path = file_paths[-1]
+        if len(file_paths) == 1:
+            self.file_path_var.set(os.path.basename(file_paths[0]))
+        else:
+            self.file_path_var.set(f"{len(file_paths)} images added")
+        self.scan_btn.config(state="normal")
+        self.status_var.set(f"{self._count_jobs('queued')} receipt(s) queued - press Scan & Categorize")
     
     def scan_and_categorize(self):
-        """Perform OCR and categorization in a separate thread"""
-        if not self.current_image_path:
+        """Submit every queued receipt to the background worker pool"""
+        pending = [job for job in self.jobs.values() if job.status == "queued" and job.future is None]
+        if not pending:
             messagebox.showerror("Error", "Please select an image first!")
             return
         
-        self.scan_btn.config(state="disabled", text="🔄 Processing...")
-        self.status_var.set("Processing image - This may take a moment...")
-        
-        # Run OCR in separate thread to prevent GUI freezing
-        thread = threading.Thread(target=self._process_image)
-        thread.daemon = True
-        thread.start()
+        for job in pending:
+            self._submit(job)
+        self.status_var.set(f"Processing {len(pending)} receipt(s) - This may take a moment...")
+    
+    def _submit(self, job):
+        job.future = self.executor.submit(self._run_job, job.id, job.attempt, job.path, job.cancel_event)
     
-    def _process_image(self):
-        """Process image (OCR and categorization) - runs in separate thread"""
+    def _run_job(self, job_id, attempt, path, cancel_event):
+        """OCR and analyze one queued receipt - runs on a worker thread"""
+        if cancel_event.is_set():
+            # Cancelled after the pool picked it up: say so, or it stays queued
+            self.messages.put((job_id, attempt, {'status': "cancelled"}))
+            return
+        self.messages.put((job_id, attempt, {'status': "running"}))
+        
+        start = time.perf_counter()
+        result = None
+        error = None
         try:
-            # Extract text using OCR
-            self.status_var.set("Extracting text from image...")
-            self.extracted_text = extract_text_from_image(self.current_image_path)
-            
-            # Update text display in main thread
-            self.root.after(0, self._update_text_display)
-            
-            # Parse amounts and items
-            self.status_var.set("Analyzing expenses...")
-            amounts, items = parse_amounts_and_items(self.extracted_text)
-            
-            # Categorize expenses
-            
-            self.expense_data, total_amount = smart_categorize(self.extracted_text)
-
-            # Update GUI in main thread
-            self.root.after(0, self._update_results)
+            with metrics.capture() as timings:
+                result = scan_receipt(path, cache=self.ocr_cache, duplicates=self.expense_db)
             
             # Log the scan
-            logging.info(f"Receipt processed: {self.current_image_path}")
-            logging.info(f"Total amount: ${sum(amounts):.2f}")
-            logging.info(f"Categories found: {list(self.expense_data.keys())}")
-            
+            logging.info(f"Receipt processed: {result.source_path}")
+            logging.info(f"Total amount: ${result.total:.2f}")
+            logging.info(f"Categories found: {list(result.categories.keys())}")
+            self._log_timings(timings)
         except Exception as e:
-            error_msg = f"Error processing image: {str(e)}"
-            logging.error(error_msg)
-            self.root.after(0, lambda: self._show_error(error_msg))
-        finally:
-            # Re-enable button in main thread
-            self.root.after(0, self._reset_scan_button)
+            error = f"Error processing image: {str(e)}"
+            logging.error(error)
+        
+        if cancel_event.is_set():
+            status = "cancelled"
+        else:
+            status = "failed" if error else "done"
+        self.messages.put((job_id, attempt, {
+            'status': status,
+            'latency': time.perf_counter() - start,
+            'result': result,
+            'error': error
+        }))
+    
+    def _drain_messages(self):
+        """
+        Apply pending worker messages (runs on the Tk main loop).
+        Messages for the same job are coalesced so each changed row, the
+        results panel and the status bar are repainted at most once per tick.
+        """
+        changed = {}
+        for _ in range(MAX_MESSAGES_PER_TICK):
+            try:
+                job_id, attempt, changes = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs.get(job_id)
+            if job is None or attempt != job.attempt:
+                continue
+            for name, value in changes.items():
+                setattr(job, name, value)
+            # Re-insert so the most recently updated job ends up last
+            changed.pop(job_id, None)
+            changed[job_id] = job
+        
+        if changed:
+            for job in changed.values():
+                latency = f"{job.latency:.2f}s" if job.latency is not None else ""
+                self.job_tree.item(str(job.id), values=(job.status, latency))
+            
+            finished = [job for job in changed.values() if job.status == "done"]
+            if finished:
+                self._show_result(finished[-1].result)
+            self._update_queue_status()
+        
+        self.root.after(POLL_INTERVAL_MS, self._drain_messages)
+    
+    def _count_jobs(self, *statuses):
+        return sum(1 for job in self.jobs.values() if job.status in statuses)
+    
+    def _update_queue_status(self):
+        """Summarize queue progress in the status bar"""
+        active = self._count_jobs("queued", "running")
+        done = self._count_jobs("done")
+        failed = self._count_jobs("failed")
+        if active:
+            self.status_var.set(f"Processing... {done} done, {failed} failed, {active} remaining")
+        else:
+            self.status_var.set(f"Queue finished: {done} done, {failed} failed. Select a row to review it.")
+    
+    def _selected_jobs(self):
+        return [self.jobs[int(iid)] for iid in self.job_tree.selection() if int(iid) in self.jobs]
     
-    def _update_text_display(self):
+    def _on_job_selected(self, event=None):
+        """Show the results of the selected finished job"""
+        selected = self._selected_jobs()
+        if len(selected) != 1:
+            return
+        job = selected[0]
+        self.current_image_path = job.path
+        self.file_path_var.set(os.path.basename(job.path))
+        if job.result:
+            self._show_result(job.result)
+        elif job.error:
+            self.status_var.set(job.error)
+    
+    def cancel_jobs(self):
+        """Cancel the selected jobs, or every unfinished job if none is selected"""
+        targets = self._selected_jobs() or list(self.jobs.values())
+        for job in targets:
+            if job.status not in ("queued", "running"):
+                continue
+            job.cancel_event.set()
+            # Jobs already running finish their scan, then report as cancelled
+            if job.future is None or job.future.cancel():
+                job.status = "cancelled"
+                self.job_tree.item(str(job.id), values=(job.status, ""))
+        self._update_queue_status()
+    
+    def retry_jobs(self):
+        """Re-queue the selected failed or cancelled jobs, or all of them if none is selected"""
+        targets = self._selected_jobs() or list(self.jobs.values())
+        retried = 0
+        for job in targets:
+            if job.status not in ("failed", "cancelled"):
+                continue
+            job.attempt += 1
+            job.status = "queued"
+            job.cancel_event = threading.Event()
+            job.result = None
+            job.error = None
+            job.latency = None
+            self._submit(job)
+            self.job_tree.item(str(job.id), values=(job.status, ""))
+            retried += 1
+        if retried:
+            self.status_var.set(f"Retrying {retried} receipt(s)...")
+    
+    def _log_timings(self, timings):
+        """Log per-stage timings of a scan and export the metrics files"""
+        if not metrics.is_enabled():
+            return
+        stages = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings)
+        logging.info(f"Stage timings: {stages}")
+        metrics.write_jsonl("logs/metrics.jsonl")
+        metrics.write_prometheus("logs/metrics.prom")
+    
+    def _show_result(self, result):
+        """Display a finished ScanResult (called from main thread)"""
+        self.scan_result = result
+        self._update_text_display(result.text)
+        self._update_results(result)
+    
+    def _update_text_display(self, text):
         """Update text display widget (called from main thread)"""
         self.text_display.delete(1.0, tk.END)
-        self.text_display.insert(1.0, self.extracted_text)
+        self.text_display.insert(1.0, text)
     
-    def _update_results(self):
-        """Update results display (called from main thread)"""
-        # Calculate total
-        total = sum(sum(data['amounts']) for data in self.expense_data.values())
-        self.total_amount_var.set(f"${total:.2f}")
-        
-        # Clear existing tree items
-        for item in self.category_tree.get_children():
-            self.category_tree.delete(item)
-        
-        # Populate category tree
-        for category, data in self.expense_data.items():
+    def _update_results(self, result):
+        """Update results display from a ScanResult (called from main thread)"""
+        self.total_amount_var.set(f"${result.categorized_total:.2f}")
+        
+        # Update category rows in place: only changed values are rewritten,
+        # rows for categories that disappeared are removed
+        shown = []
+        for category, data in result.categories.items():
             if data['amounts']:  # Only show categories with amounts
-                category_total = sum(data['amounts'])
                 items_text = ", ".join(data['items'][:3])  # Show first 3 items
                 if len(data['items']) > 3:
                     items_text += f" (+{len(data['items'])-3} more)"
+                values = (f"${result.category_totals[category]:.2f}", items_text)
                 
-                self.category_tree.insert(
-                    "",
-                    "end",
-                    text=f"🏷️ {category}",
-                    values=(f"${category_total:.2f}", items_text)
-                )
+                row = self._category_rows.get(category)
+                if row is None:
+                    row = self.category_tree.insert("", "end", text=f"🏷️ {category}", values=values)
+                    self._category_rows[category] = row
+                elif tuple(self.category_tree.item(row, "values")) != values:
+                    self.category_tree.item(row, values=values)
+                self.category_tree.move(row, "", len(shown))
+                shown.append(category)
+        
+        for category in set(self._category_rows) - set(shown):
+            self.category_tree.delete(self._category_rows.pop(category))
         
         self.save_btn.config(state="normal")
-        self.status_var.set("Analysis complete! Review the results above.")
+        if result.duplicate_of is not None:
+            self.status_var.set(f"Looks like saved receipt #{result.duplicate_of} - results reused, OCR skipped")
+        else:
+            self.status_var.set("Analysis complete! Review the results above.")
     
-    def _show_error(self, error_msg):
-        """Show error message (called from main thread)"""
-        messagebox.showerror("Processing Error", error_msg)
-        self.status_var.set("Error occurred - Please try again")
-    
-    def _reset_scan_button(self):
-        """Reset scan button state (called from main thread)"""
-        self.scan_btn.config(state="normal", text="🔍 Scan & Categorize")
+    def _forget_jobs(self):
+        """Cancel unfinished jobs and empty the scan queue"""
+        # Late messages from still-running scans no longer match a job and are dropped
+        for job in self.jobs.values():
+            job.cancel_event.set()
+            if job.future is not None:
+                job.future.cancel()
+        self.jobs.clear()
+        self.job_tree.delete(*self.job_tree.get_children())
     
     def clear_all(self):
         """Clear all data and reset interface"""
+        self._forget_jobs()
         self.current_image_path = None
-        self.extracted_text = ""
-        self.expense_data = {}
+        self.scan_result = None
         
-        self.file_path_var.set("No file selected")
+        self.file_path_var.set("No file selected - browse or drop receipt images")
         self.text_display.delete(1.0, tk.END)
         self.total_amount_var.set("$0.00")
         
         # Clear tree
-        for item in self.category_tree.get_children():
-            self.category_tree.delete(item)
+        self.category_tree.delete(*self.category_tree.get_children())
+        self._category_rows.clear()
         
         self.scan_btn.config(state="disabled")
         self.save_btn.config(state="disabled")
@@ -402,10 +670,16 @@ class ReceptixGUI:
         logging.info("Interface cleared")
     
     def save_report(self):
-        """Save expense report to file"""
-        if not self.expense_data:
+        """Save expense report to the expense database and a text file"""
+        result = self.scan_result
+        if result is None or not result.categories:
             messagebox.showwarning("Warning", "No data to save!")
             return
+        if result.duplicate_of is not None and not messagebox.askyesno(
+                "Possible duplicate",
+                f"This photo looks like receipt #{result.duplicate_of}, which is already saved.\n"
+                "Save it again anyway?"):
+            return
         
         # Create reports directory
         os.makedirs("reports", exist_ok=True)
@@ -415,34 +689,13 @@ class ReceptixGUI:
         filename = f"reports/receipt_report_{timestamp}.txt"
         
         try:
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write("=" * 50 + "\n")
-                f.write("RECEPTIX - EXPENSE REPORT\n")
-                f.write("=" * 50 + "\n")
-                f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Source Image: {os.path.basename(self.current_image_path) if self.current_image_path else 'N/A'}\n")
-                f.write("-" * 50 + "\n\n")
-                
-                # Write extracted text
-                f.write("EXTRACTED TEXT:\n")
-                f.write("-" * 20 + "\n")
-                f.write(self.extracted_text + "\n\n")
-                
-                # Write expense breakdown
-                f.write("EXPENSE BREAKDOWN:\n")
-                f.write("-" * 20 + "\n")
-                
-                total = 0
-                for category, data in self.expense_data.items():
-                    if data['amounts']:
-                        category_total = sum(data['amounts'])
-                        total += category_total
-                        f.write(f"\n{category.upper()}:\n")
-                        f.write(f"  Total: ${category_total:.2f}\n")
-                        f.write(f"  Items: {', '.join(data['items'])}\n")
-                
-                f.write(f"\nGRAND TOTAL: ${total:.2f}\n")
-                f.write("=" * 50 + "\n")
+            source_hash = None
+            if result.source_path and os.path.exists(result.source_path):
+                source_hash = file_sha256(result.source_path)
+            
+            with metrics.span('report.write'):
+                self.expense_db.add_scan(result, source_hash=source_hash)
+                write_text_report(filename, result)
             
             messagebox.showinfo("Success", f"Report saved to:\n{filename}")
             self.status_var.set(f"Report saved: {os.path.basename(filename)}")
@@ -456,9 +709,20 @@ class ReceptixGUI:
 
 def main():
     """Main application entry point"""
-    root = tk.Tk()
+    if "--import-time" in sys.argv[1:]:
+        startup.print_import_times()
+        return
+    
+    # tkinterdnd2's root enables dropping files onto the scan queue
+    root = TkinterDnD.Tk() if TkinterDnD is not None else tk.Tk()
     app = ReceptixGUI(root)
     root.mainloop()
+    # Drop queued scans; a scan already running finishes in the background
+    for job in app.jobs.values():
+        job.cancel_event.set()
+        if job.future is not None:
+            job.future.cancel()
+    app.executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+"""
+Lightweight timing instrumentation for the scan pipeline.
+
+    with metrics.span('ocr.psm_6'):
+        ...
+
+    @metrics.timed('categorize.parse')
+    def parse(...):
+        ...
+
+Spans cost one flag check while metrics are disabled. When enabled, each
+span feeds a per-stage histogram which can be exported as JSON lines or in
+the Prometheus text format.
+"""
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram for one stage"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))
+        }
+
+
+_enabled = False
+_histograms = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def observe(stage, seconds):
+    """Record one duration for a stage (no-op while disabled)"""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+    captured = getattr(_local, 'captured', None)
+    if captured is not None:
+        captured.append((stage, seconds))
+
+
+def observe_all(timings):
+    """Record (stage, seconds) pairs, e.g. timings sent back by a worker process"""
+    for stage, seconds in timings:
+        observe(stage, seconds)
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage):
+    """Context manager timing a block as one observation of stage"""
+    return _Span(stage) if _enabled else _NOOP
+
+
+def timed(stage):
+    """Decorator timing every call of a function as stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def capture():
+    """
+    Collect the (stage, seconds) observations made by this thread inside the
+    block, e.g. to attach one scan's stage timings to its result.
+    """
+    previous = getattr(_local, 'captured', None)
+    captured = []
+    _local.captured = captured
+    try:
+        yield captured
+    finally:
+        _local.captured = previous
+
+
+def snapshot():
+    """{stage: histogram summary} for every stage seen so far"""
+    with _lock:
+        return {stage: histogram.snapshot() for stage, histogram in sorted(_histograms.items())}
+
+
+def _write_atomically(path, content):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_jsonl(path):
+    """Append one JSON line per stage with the current histogram summary"""
+    timestamp = time.time()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for stage, summary in snapshot().items():
+            f.write(json.dumps({'timestamp': timestamp, 'stage': stage, **summary}) + "\n")
+
+
+def render_prometheus():
+    """Histograms in the Prometheus text exposition format"""
+    lines = [
+        "# HELP receptix_stage_seconds Time spent in each scan pipeline stage.",
+        "# TYPE receptix_stage_seconds histogram"
+    ]
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'receptix_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'receptix_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'receptix_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'receptix_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """Write (atomically replace) a Prometheus textfile-collector file"""
+    _write_atomically(path, render_prometheus())
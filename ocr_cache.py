@@ -0,0 +1,132 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join("cache", "ocr_cache.sqlite3")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# How many least-recently-used rows to drop per eviction round
+EVICTION_CHUNK = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache(last_access);
+CREATE TABLE IF NOT EXISTS ocr_cache_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO ocr_cache_meta (id, total_bytes) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS ocr_cache_insert AFTER INSERT ON ocr_cache BEGIN
+    UPDATE ocr_cache_meta SET total_bytes = total_bytes + NEW.size WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS ocr_cache_delete AFTER DELETE ON ocr_cache BEGIN
+    UPDATE ocr_cache_meta SET total_bytes = total_bytes - OLD.size WHERE id = 1;
+END;
+"""
+
+
+def make_cache_key(image_bytes, params):
+    """
+    Content-addressed key: hash of the image bytes plus everything that can
+    change the OCR output (preprocessing parameters, OCR modes, engine version).
+    """
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    Persistent OCR result cache backed by SQLite with LRU eviction.
+    Safe to share between threads, and between processes through the file.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def get(self, key):
+        """Return cached text for key, or None on a miss"""
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE ocr_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, text):
+        """Store text under key and evict least-recently-used entries if over budget"""
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM ocr_cache WHERE key = ?", (key,))
+                self._conn.execute(
+                    "INSERT INTO ocr_cache (key, text, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, text, size, time.time())
+                )
+                self._evict()
+
+    def _evict(self):
+        evicted = 0
+        while self._total_bytes() > self.max_bytes:
+            cursor = self._conn.execute(
+                "DELETE FROM ocr_cache WHERE key IN "
+                "(SELECT key FROM ocr_cache ORDER BY last_access LIMIT ?)",
+                (EVICTION_CHUNK,)
+            )
+            if cursor.rowcount == 0:
+                break
+            evicted += cursor.rowcount
+        if evicted:
+            logging.info(f"OCR cache evicted {evicted} entries")
+
+    def _total_bytes(self):
+        return self._conn.execute("SELECT total_bytes FROM ocr_cache_meta WHERE id = 1").fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters for this instance plus the current cache size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+            total_bytes = self._total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': total_bytes
+        }
+
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM ocr_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -3,89 +3,883 @@ from PIL import Image, ImageEnhance, ImageFilter
 import cv2
 import numpy as np
 import os
+import json
 import logging
+import threading
+import time
+import tracemalloc
+from collections import namedtuple, defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ocr_cache import make_cache_key
+from text_normalize import normalize_text
+import metrics
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 # Configure Tesseract path
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\tesseract.exe' 
 
-def preprocess_image(image_path):
+# Preprocessing recipe (also part of the OCR cache key)
+PREPROCESS_PARAMS = {
+    'alpha': 2.0,
+    'beta': 50,
+    'blur_kernel': 3,
+    'threshold': 150,
+    # Longest image edge kept after decoding; ~300 DPI for a long receipt
+    'max_edge': 3000,
+    # Crop to the detected receipt and drop blank bands before OCR
+    'crop': True,
+    'text_bands': True,
+    # Pick a profile from PREPROCESS_PROFILES per image; False always uses 'standard'
+    'adaptive': True
+}
+
+# Alternative binarization recipes chosen per image by choose_profile().
+# 'standard' is the fixed contrast/blur/Otsu recipe in PREPROCESS_PARAMS.
+PREPROCESS_PROFILES = {
+    'standard': {},
+    # Faded thermal paper: equalize locally instead of boosting globally
+    'clahe': {'clip_limit': 2.0, 'tile_grid': 8},
+    # Shadows and uneven lighting: threshold against the local neighbourhood
+    'adaptive': {'block_size': 31, 'c': 15},
+    # Grainy photos: edge-preserving smoothing before Otsu
+    'denoise': {'diameter': 7, 'sigma_color': 50, 'sigma_space': 50}
+}
+
+# Image statistics thresholds used by choose_profile()
+PROBE_THRESHOLDS = {
+    # Ink-to-paper spread (1st to 95th percentile) below this is faded
+    'min_contrast': 100,
+    # Mean absolute difference from a 3x3 median above this is noisy
+    'max_noise': 6.0,
+    # Brightness spread across an 8x8 grid above this is unevenly lit
+    'max_unevenness': 20.0,
+    # Laplacian variance below this is already soft; skip the extra blur
+    'min_sharpness': 100.0,
+    # Estimated DPI below this is upscaled 2x before thresholding
+    'min_dpi': 150
+}
+
+# Typical thermal receipt width, used to estimate scan resolution
+RECEIPT_WIDTH_INCHES = 3.15
+
+# Perceptual hash of a receipt: one bit per low-frequency DCT coefficient
+# (above or below their median) of the cropped receipt scaled to PHASH_SCALE
+# square. 64-bit hashes cannot tell apart receipts printed from the same
+# template, so the hash keeps PHASH_SIZE x PHASH_SIZE coefficients.
+PHASH_SIZE = 16
+PHASH_SCALE = 64
+PHASH_BITS = PHASH_SIZE * PHASH_SIZE
+
+# Fraction of equal hash bits at which a new photo counts as a re-photograph
+# of a stored receipt
+DEFAULT_MIN_SIMILARITY = 0.9
+
+# A real receipt sets about half the hash bits (the median split). Blank or
+# uniform images give a hash with almost none set, which would match every
+# other blank photo, so such hashes are never looked up or stored.
+MIN_PHASH_BITS_SET = PHASH_BITS // 8
+
+# Receipt detection runs on a copy scaled to this long edge
+DETECTION_EDGE = 600
+# A detected outline must cover at least this fraction of the frame
+MIN_RECEIPT_AREA = 0.2
+# Skew corrections outside this range (degrees) are treated as misdetections
+MIN_SKEW_ANGLE = 0.5
+MAX_SKEW_ANGLE = 15.0
+# Blank rows kept around each text band when compacting
+BAND_PADDING = 8
+# Blank gaps shorter than this (pixels) don't split a band
+BAND_MIN_GAP = 6
+
+# JPEG decoders can downscale by these factors while decoding
+REDUCED_GRAYSCALE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+]
+
+
+ImageProbe = namedtuple('ImageProbe', ['mean', 'contrast', 'noise', 'unevenness', 'sharpness', 'dpi'])
+
+
+def probe_image(gray):
+    """Cheap image statistics, computed on a copy scaled to DETECTION_EDGE"""
+    small = fit_to_edge(gray, DETECTION_EDGE)
+
+    hist = cv2.calcHist([small], [0], None, [256], [0, 256]).ravel()
+    cdf = np.cumsum(hist) / hist.sum()
+    ink, paper = np.searchsorted(cdf, 0.01), np.searchsorted(cdf, 0.95)
+    lighting = cv2.resize(cv2.medianBlur(small, 21), (8, 8), interpolation=cv2.INTER_AREA)
+
+    return ImageProbe(
+        mean=float(small.mean()),
+        contrast=int(paper - ink),
+        noise=float(cv2.absdiff(small, cv2.medianBlur(small, 3)).mean()),
+        unevenness=float(lighting.std()),
+        sharpness=float(cv2.Laplacian(small, cv2.CV_64F).var()),
+        dpi=gray.shape[1] / RECEIPT_WIDTH_INCHES
+    )
+
+
+def choose_profile(probe):
+    """Name of the PREPROCESS_PROFILES entry suited to an ImageProbe"""
+    if not PREPROCESS_PARAMS['adaptive']:
+        return 'standard'
+    if probe.noise > PROBE_THRESHOLDS['max_noise']:
+        return 'denoise'
+    if probe.unevenness > PROBE_THRESHOLDS['max_unevenness']:
+        return 'adaptive'
+    if probe.contrast < PROBE_THRESHOLDS['min_contrast']:
+        return 'clahe'
+    return 'standard'
+
+
+class StageStats:
+    """
+    Times each preprocessing stage into the metrics histograms and, when a
+    stats dict is given, also records wall time and peak traced memory per
+    stage there. Memory tracing is only switched on while stats are collected.
+
+    tracemalloc.reset_peak is new in Python 3.9. Before that the peak can't
+    be reset, so a stage records the running peak minus the memory traced
+    when it started, which is only exact while each stage peaks above the last.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self._started_tracing = stats is not None and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._baseline = 0
+        if stats is not None:
+            self._reset_peak()
+        self._last = time.perf_counter()
+
+    def _reset_peak(self):
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            self._baseline = tracemalloc.get_traced_memory()[0]
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        metrics.observe(f'preprocess.{stage}', now - self._last)
+        if self.stats is not None:
+            self.stats[stage] = {
+                'seconds': now - self._last,
+                'peak_bytes': tracemalloc.get_traced_memory()[1] - self._baseline
+            }
+            self._reset_peak()
+        self._last = time.perf_counter()
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+
+
+def load_grayscale(image_path, max_edge=None):
+    """
+    Decode an image straight to grayscale, at reduced resolution when it is
+    larger than OCR needs. The size comes from the file header, so the
+    full-resolution colour image is never held in memory.
+    """
+    max_edge = max_edge or PREPROCESS_PARAMS['max_edge']
+    with Image.open(image_path) as header:
+        long_edge = max(header.size)
+
+    flag = cv2.IMREAD_GRAYSCALE
+    for factor, reduced_flag in REDUCED_GRAYSCALE_FLAGS:
+        if long_edge // factor >= max_edge:
+            flag = reduced_flag
+            break
+
+    gray = cv2.imread(image_path, flag)
+    if gray is None:
+        raise ValueError(f"Could not decode image: {image_path}")
+
+    # Whatever the decoder couldn't shave off, resize down to the target
+    return fit_to_edge(gray, max_edge)
+
+
+def fit_to_edge(gray, max_edge=None):
+    """Downscale a grayscale array so its longest edge is at most max_edge"""
+    max_edge = max_edge or PREPROCESS_PARAMS['max_edge']
+    scale = max_edge / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def order_corners(points):
+    """Order four corner points as top-left, top-right, bottom-right, bottom-left"""
+    points = points.reshape(4, 2).astype(np.float32)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)]
+    ], dtype=np.float32)
+
+
+def find_receipt_outline(gray):
+    """
+    Find the receipt's four corners with edge detection and contour
+    approximation on a downscaled copy. Returns full-resolution corners
+    ordered by order_corners, or None if no convincing outline is found.
+    """
+    small = fit_to_edge(gray, DETECTION_EDGE)
+    # Exact factor fit_to_edge used, to map corners back to full resolution
+    scale = min(1.0, DETECTION_EDGE / max(gray.shape))
+
+    edges = cv2.Canny(cv2.GaussianBlur(small, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = MIN_RECEIPT_AREA * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4:
+            return order_corners(approx / scale)
+    return None
+
+
+def warp_to_outline(gray, corners):
+    """Perspective-warp the region inside corners to a flat, upright rectangle"""
+    tl, tr, br, bl = corners
+    width = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+    height = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+
+def estimate_skew(gray):
+    """Estimate text skew in degrees from the minimum-area box around dark pixels"""
+    small = fit_to_edge(gray, DETECTION_EDGE)
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(ink)
+    if coords is None:
+        return 0.0
+    angle = cv2.minAreaRect(coords)[-1]
+    # The reported range differs between OpenCV versions; fold into (-45, 45]
+    while angle > 45:
+        angle -= 90
+    while angle <= -45:
+        angle += 90
+    return angle
+
+
+def deskew(gray):
+    """Rotate the image so text lines run horizontally"""
+    angle = estimate_skew(gray)
+    if not MIN_SKEW_ANGLE <= abs(angle) <= MAX_SKEW_ANGLE:
+        return gray
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def detect_receipt(gray):
+    """
+    Crop a grayscale photo down to the receipt: perspective-warp to the
+    detected outline when there is one, then deskew.
+    """
+    corners = find_receipt_outline(gray)
+    if corners is not None:
+        gray = warp_to_outline(gray, corners)
+    return deskew(gray)
+
+
+def perceptual_hash(gray):
+    """PHASH_BITS-bit DCT hash of a grayscale array, as hex"""
+    small = cv2.resize(gray, (PHASH_SCALE, PHASH_SCALE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coefficients = cv2.dct(small)[:PHASH_SIZE, :PHASH_SIZE].ravel()
+    # The DC term is overall brightness, which changes with lighting, not content
+    coefficients[0] = 0
+    return np.packbits(coefficients > np.median(coefficients)).tobytes().hex()
+
+
+def is_distinctive_hash(image_hash):
+    """Whether a hex perceptual hash has enough bits set to match duplicates on"""
+    return bin(int(image_hash, 16)).count('1') >= MIN_PHASH_BITS_SET
+
+
+def max_hash_distance(min_similarity=DEFAULT_MIN_SIMILARITY):
+    """Largest Hamming distance between two hashes at least min_similarity alike"""
+    return int((1 - min_similarity) * PHASH_BITS)
+
+
+@metrics.timed('ocr.phash')
+def hash_image(image_path):
+    """
+    Pre-OCR stage for near-duplicate lookup. Returns the decoded grayscale
+    (pass it on as preprocess_image's gray) and the perceptual hash of the
+    receipt cropped out of a small copy, so framing and lighting of a
+    re-photograph barely move the hash.
+    """
+    gray = load_grayscale(image_path)
+    return gray, perceptual_hash(detect_receipt(fit_to_edge(gray, DETECTION_EDGE)))
+
+
+def text_bands(binary):
+    """
+    Find horizontal bands containing text in a binarized (black on white)
+    image from its row ink profile. Returns (top, bottom) row ranges.
+    """
+    # Ignore the side margins, where leftover background edges show up as ink
+    margin = binary.shape[1] // 50
+    inner = binary[:, margin:binary.shape[1] - margin]
+    ink_per_row = np.count_nonzero(inner == 0, axis=1)
+    has_ink = ink_per_row > max(2, inner.shape[1] // 200)
+
+    bands = []
+    top = None
+    gap = 0
+    for row, inked in enumerate(has_ink):
+        if inked:
+            if top is None:
+                top = row
+            gap = 0
+        elif top is not None:
+            gap += 1
+            if gap >= BAND_MIN_GAP:
+                bands.append((top, row - gap + 1))
+                top = None
+    if top is not None:
+        bands.append((top, len(has_ink) - gap))
+    return bands
+
+
+def compact_text_bands(binary):
+    """
+    Stack only the text bands of a binarized image, separated by a little
+    white padding, so Tesseract doesn't scan blank paper.
+    """
+    bands = text_bands(binary)
+    if not bands:
+        return binary
+    blank = np.full((BAND_PADDING, binary.shape[1]), 255, dtype=binary.dtype)
+    pieces = [blank]
+    for top, bottom in bands:
+        pieces.append(binary[top:bottom])
+        pieces.append(blank)
+    compacted = np.vstack(pieces)
+    return compacted if compacted.shape[0] < binary.shape[0] else binary
+
+
+def preprocess_image(image_path, stats=None, return_profile=False, gray=None):
     """
     Preprocess image using OpenCV for better OCR results.
+    Returns the binarized numpy array, which the OCR backends take directly,
+    or (array, profile name) with return_profile. Every step after decoding
+    runs in place on the same buffer. Pass a dict as stats to get per-stage
+    time and peak memory, plus the probe and chosen profile under 'profile'.
+    gray is load_grayscale(image_path) when the caller already decoded it.
+    """
+    timer = StageStats(stats)
+    try:
+        # Decode to grayscale, downscaled for large photos
+        if gray is None:
+            gray = load_grayscale(image_path)
+            timer.mark('decode')
+        gray, profile = _preprocess_gray(gray, timer)
+
+    except Exception as e:
+        logging.error(f"Preprocessing failed: {e}")
+        gray, profile = Image.open(image_path), None
+
+    finally:
+        timer.close()
+
+    return (gray, profile) if return_profile else gray
+
+
+def preprocess_array(gray, stats=None, return_profile=False):
+    """
+    Preprocess an already decoded grayscale array (e.g. a rendered PDF page)
+    the same way preprocess_image does. Works in place on gray.
     """
+    timer = StageStats(stats)
     try:
-        image = cv2.imread(image_path)
+        gray, profile = _preprocess_gray(gray, timer)
+    finally:
+        timer.close()
+    return (gray, profile) if return_profile else gray
+
+
+def _preprocess_gray(gray, timer):
+    # Crop to the receipt itself before spending work on the background
+    if PREPROCESS_PARAMS['crop']:
+        gray = detect_receipt(gray)
+        timer.mark('crop')
+
+    probe = probe_image(gray)
+    profile = choose_profile(probe)
+    timer.mark('probe')
+    if timer.stats is not None:
+        timer.stats['profile'] = dict(probe._asdict(), name=profile)
+    logging.info(
+        f"Preprocessing profile {profile}: contrast={probe.contrast}, noise={probe.noise:.1f}, "
+        f"unevenness={probe.unevenness:.1f}, sharpness={probe.sharpness:.0f}, dpi~{probe.dpi:.0f}"
+    )
+
+    # Tesseract wants ~300 DPI; small phone crops are upscaled first
+    if probe.dpi < PROBE_THRESHOLDS['min_dpi'] and max(gray.shape) * 2 <= PREPROCESS_PARAMS['max_edge']:
+        gray = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        timer.mark('upscale')
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    kernel = PREPROCESS_PARAMS['blur_kernel']
+    soft = probe.sharpness < PROBE_THRESHOLDS['min_sharpness']
+    options = PREPROCESS_PROFILES[profile]
 
+    if profile == 'clahe':
+        clahe = cv2.createCLAHE(clipLimit=options['clip_limit'],
+                                tileGridSize=(options['tile_grid'], options['tile_grid']))
+        clahe.apply(gray, dst=gray)
+        timer.mark('clahe')
+    elif profile == 'denoise':
+        gray = cv2.bilateralFilter(gray, options['diameter'], options['sigma_color'], options['sigma_space'])
+        timer.mark('denoise')
+    elif profile == 'standard':
         # Increase contrast and brightness
-        gray = cv2.convertScaleAbs(gray, alpha=2.0, beta=50)
+        cv2.convertScaleAbs(gray, dst=gray, alpha=PREPROCESS_PARAMS['alpha'], beta=PREPROCESS_PARAMS['beta'])
+        timer.mark('contrast')
 
-        # Optional: Gaussian blur
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+    # Optional: Gaussian blur, skipped when the image is already soft
+    if not soft:
+        cv2.GaussianBlur(gray, (kernel, kernel), 0, dst=gray)
+        timer.mark('blur')
 
-        # Thresholding
-        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Thresholding
+    if profile == 'adaptive':
+        cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                              options['block_size'], options['c'], dst=gray)
+    else:
+        cv2.threshold(gray, PREPROCESS_PARAMS['threshold'], 255,
+                      cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=gray)
+    timer.mark('threshold')
 
-        return Image.fromarray(thresh)
+    # Only the rows that actually hold text go to Tesseract
+    if PREPROCESS_PARAMS['text_bands']:
+        gray = compact_text_bands(gray)
+        timer.mark('text_bands')
+
+    return gray, profile
 
-    except Exception as e:
-        logging.error(f"Preprocessing failed: {e}")
-        return Image.open(image_path)
 
+@metrics.timed('ocr.clean')
 def clean_extracted_text(text):
-    if not text:
-        return ""
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    cleaned_text = '\n'.join(lines)
-    replacements = {
-        '|': 'I',
-        'O': '0',
-        '§': 'S',
-        'ﬁ': 'fi',
-        'ﬂ': 'fl',
-        '—': '-',
-        '’': "'",
-        '"': '"'
+    """
+    Strip lines, drop blank ones and fix common OCR character confusions.
+    O/I/l are only read as digits inside amounts (see text_normalize).
+    """
+    return normalize_text(text)
+
+# Candidate page segmentation modes, tried in order until one is confident enough
+OCR_MODES = [
+    {'psm': 6, 'whitelist': '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ:.%₹,/-'},
+    {'psm': 4},
+    {'psm': 11}
+]
+
+# Mean word confidence (0-100) at which we stop trying further modes
+DEFAULT_MIN_CONFIDENCE = 80.0
+
+# Bump when text cleaning or the cached payload changes so stale cached OCR output is not reused
+OCR_CACHE_VERSION = 5
+
+# One recognized word and its pixel box in the preprocessed image
+OCRWord = namedtuple('OCRWord', ['text', 'confidence', 'left', 'top', 'right', 'bottom'])
+# One text line: its words in reading order, their joined text, box and mean confidence
+OCRLine = namedtuple('OCRLine', ['text', 'words', 'confidence', 'left', 'top', 'right', 'bottom'])
+# One OCR pass; lines is a tuple of OCRLine (empty when the engine gave no layout)
+OCRPass = namedtuple('OCRPass', ['psm', 'text', 'confidence', 'lines'])
+# The selected pass after cleaning, as returned by recognize_layout()
+OCRLayout = namedtuple('OCRLayout', ['text', 'lines', 'confidence', 'psm'])
+
+
+def make_line(words):
+    """OCRLine from its OCRWords"""
+    return OCRLine(
+        text=' '.join(word.text for word in words),
+        words=tuple(words),
+        confidence=sum(word.confidence for word in words) / len(words),
+        left=min(word.left for word in words),
+        top=min(word.top for word in words),
+        right=max(word.right for word in words),
+        bottom=max(word.bottom for word in words)
+    )
+
+
+def lines_from_words(words_by_line):
+    """(tuple of OCRLine, joined text, mean word confidence) from lists of OCRWords"""
+    lines = tuple(make_line(words) for words in words_by_line if words)
+    confidences = [word.confidence for line in lines for word in line.words]
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return lines, '\n'.join(line.text for line in lines), confidence
+
+
+def layout_to_json(layout):
+    """Compact JSON for the OCR cache: lines are stored as lists of word tuples"""
+    return json.dumps({
+        'text': layout.text,
+        'confidence': layout.confidence,
+        'psm': layout.psm,
+        'lines': [[list(word) for word in line.words] for line in layout.lines]
+    }, ensure_ascii=False)
+
+
+def layout_from_json(payload):
+    data = json.loads(payload)
+    lines = tuple(make_line([OCRWord(*word) for word in words]) for words in data['lines'])
+    return OCRLayout(data['text'], lines, data['confidence'], data['psm'])
+
+
+def _clean_layout(text, lines, confidence, psm):
+    """
+    Clean the text once and carry the cleaned words back onto the lines.
+    Cleaning never adds or removes spaces or newlines inside non-empty
+    lines, so lines and words still line up one to one.
+    """
+    cleaned = clean_extracted_text(text)
+    cleaned_lines = cleaned.split('\n')
+    if len(cleaned_lines) != len(lines):
+        return OCRLayout(cleaned, (), confidence, psm)
+
+    fixed = []
+    for line, cleaned_line in zip(lines, cleaned_lines):
+        tokens = cleaned_line.split(' ')
+        if len(tokens) != len(line.words):
+            return OCRLayout(cleaned, (), confidence, psm)
+        fixed.append(make_line([word._replace(text=token) for word, token in zip(line.words, tokens)]))
+    return OCRLayout(cleaned, tuple(fixed), confidence, psm)
+
+# Selections per profile before its own mode order replaces OCR_MODES order
+MIN_PROFILE_SAMPLES = 20
+# The first confident pass wins, so a learned order can change the text of
+# an image. Benchmarks set this to keep OCR output reproducible across runs.
+LEARN_MODE_ORDER = not os.environ.get("RECEPTIX_FIXED_MODE_ORDER")
+
+# {profile: Counter(psm of the pass whose text was used)}, for this process
+_profile_wins = defaultdict(Counter)
+_profile_lock = threading.Lock()
+
+
+def record_profile_win(profile, psm):
+    with _profile_lock:
+        _profile_wins[profile][psm] += 1
+
+
+def profile_stats():
+    """{profile: {psm: times its pass was selected}} for this process"""
+    with _profile_lock:
+        return {profile: dict(wins) for profile, wins in _profile_wins.items()}
+
+
+def modes_for_profile(profile):
+    """
+    OCR_MODES with the modes that most often win for this profile first, so
+    the early exit in run_ocr_passes usually happens on the first pass.
+    """
+    if not LEARN_MODE_ORDER:
+        return OCR_MODES
+    with _profile_lock:
+        wins = Counter(_profile_wins.get(profile, ()))
+    if sum(wins.values()) < MIN_PROFILE_SAMPLES:
+        return OCR_MODES
+    return sorted(OCR_MODES, key=lambda mode: -wins[mode['psm']])
+
+
+def tesseract_config(mode):
+    """Build the pytesseract config string for one OCR mode"""
+    config = f"--oem 3 --psm {mode['psm']} -l eng"
+    if mode.get('whitelist'):
+        config += f" -c tessedit_char_whitelist={mode['whitelist']}"
+    return config
+
+
+class PytesseractBackend:
+    """
+    Runs the tesseract CLI through pytesseract.
+    image_to_data gives us the text and word confidences from a single call.
+    """
+    name = 'pytesseract'
+
+    def recognize(self, image, mode):
+        data = pytesseract.image_to_data(
+            image, config=tesseract_config(mode), output_type=pytesseract.Output.DICT
+        )
+        words_by_line = {}
+        for i, word in enumerate(data['text']):
+            conf = float(data['conf'][i])
+            word = word.strip()
+            if conf < 0 or not word:
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            left, top = data['left'][i], data['top'][i]
+            words_by_line.setdefault(key, []).append(
+                OCRWord(word, conf, left, top, left + data['width'][i], top + data['height'][i])
+            )
+
+        lines, text, confidence = lines_from_words(words_by_line.values())
+        return OCRPass(mode['psm'], text, confidence, lines)
+
+
+class TesserocrBackend:
+    """
+    Keeps libtesseract loaded in-process through tesserocr, so there is no
+    subprocess fork, temp file or traineddata reload per pass.
+    The tesseract API object is not thread-safe, so each thread gets its own.
+    """
+    name = 'tesserocr'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _api(self):
+        api = getattr(self._local, 'api', None)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang='eng', oem=tesserocr.OEM.DEFAULT)
+            self._local.api = api
+        return api
+
+    def recognize(self, image, mode):
+        api = self._api()
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+        api.SetPageSegMode(mode['psm'])
+        api.SetVariable('tessedit_char_whitelist', mode.get('whitelist', ''))
+        api.SetImage(image)
+        api.Recognize()
+
+        words_by_line = []
+        iterator = api.GetIterator()
+        if iterator is not None:
+            level = tesserocr.RIL.WORD
+            for word_iterator in tesserocr.iterate_level(iterator, level):
+                word = (word_iterator.GetUTF8Text(level) or '').strip()
+                if not word:
+                    continue
+                if word_iterator.IsAtBeginningOf(tesserocr.RIL.TEXTLINE) or not words_by_line:
+                    words_by_line.append([])
+                left, top, right, bottom = word_iterator.BoundingBox(level)
+                words_by_line[-1].append(OCRWord(word, word_iterator.Confidence(level), left, top, right, bottom))
+
+        lines, text, confidence = lines_from_words(words_by_line)
+        return OCRPass(mode['psm'], text, confidence, lines)
+
+
+_backends = {}
+
+
+def get_ocr_backend(name=None):
+    """
+    Return an OCR backend by name ('tesserocr' or 'pytesseract').
+    By default the in-process tesserocr engine is used when it is installed.
+    A backend returned earlier is passed through unchanged.
+    """
+    if isinstance(name, (PytesseractBackend, TesserocrBackend)):
+        return name
+    if name is None:
+        name = 'tesserocr' if tesserocr is not None else 'pytesseract'
+    if name not in _backends:
+        if name == 'tesserocr':
+            if tesserocr is None:
+                raise ValueError("tesserocr is not installed")
+            _backends[name] = TesserocrBackend()
+        elif name == 'pytesseract':
+            _backends[name] = PytesseractBackend()
+        else:
+            raise ValueError(f"Unknown OCR backend: {name}")
+    return _backends[name]
+
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=len(OCR_MODES), thread_name_prefix='ocr')
+    return _executor
+
+
+def _recognize_safely(backend, image, mode):
+    try:
+        with metrics.span(f"ocr.psm_{mode['psm']}"):
+            return backend.recognize(image, mode)
+    except Exception as e:
+        logging.warning(f"OCR pass psm {mode['psm']} failed: {e}")
+        return None
+
+
+def run_ocr_passes(image, backend=None, concurrent=False, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                   modes=None):
+    """
+    Run the candidate OCR modes (default OCR_MODES) and return the passes that produced text.
+
+    Sequentially, we stop as soon as a pass reaches min_confidence.
+    Concurrently, all modes run at once (the tesseract work happens outside the
+    GIL) and modes that haven't started yet are cancelled once one is confident.
+    """
+    backend = backend or get_ocr_backend()
+    modes = modes or OCR_MODES
+    passes = []
+
+    if concurrent:
+        futures = [_get_executor().submit(_recognize_safely, backend, image, mode) for mode in modes]
+        for future in as_completed(futures):
+            result = future.result()
+            if result and result.text.strip():
+                passes.append(result)
+                if result.confidence >= min_confidence:
+                    for other in futures:
+                        other.cancel()
+                    break
+    else:
+        for mode in modes:
+            result = _recognize_safely(backend, image, mode)
+            if result and result.text.strip():
+                passes.append(result)
+                if result.confidence >= min_confidence:
+                    break
+
+    return passes
+
+
+_engine_versions = {}
+
+
+def ocr_engine_version(backend):
+    """Tesseract version string for a backend, looked up once per process"""
+    if backend.name not in _engine_versions:
+        if backend.name == 'tesserocr':
+            _engine_versions[backend.name] = tesserocr.tesseract_version()
+        else:
+            _engine_versions[backend.name] = str(pytesseract.get_tesseract_version())
+    return _engine_versions[backend.name]
+
+
+def ocr_cache_params(preprocess, backend, min_confidence):
+    """Everything besides the image content that can change the OCR text"""
+    return {
+        'format': OCR_CACHE_VERSION,
+        'preprocess': PREPROCESS_PARAMS if preprocess else None,
+        'profiles': [PREPROCESS_PROFILES, PROBE_THRESHOLDS] if preprocess else None,
+        'modes': [tesseract_config(mode) for mode in OCR_MODES],
+        'min_confidence': min_confidence,
+        'engine': backend.name,
+        'version': ocr_engine_version(backend)
     }
-    for old, new in replacements.items():
-        cleaned_text = cleaned_text.replace(old, new)
-    return cleaned_text
 
-def extract_text_from_image(image_path, preprocess=True):
+
+def ocr_cache_key(image_path, preprocess, backend, min_confidence):
+    """Cache key for an image file under the current preprocessing and OCR settings"""
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    return make_cache_key(image_bytes, ocr_cache_params(preprocess, backend, min_confidence))
+
+
+def select_pass(passes):
+    """The pass with the highest mean word confidence; more text breaks ties"""
+    return max(passes, key=lambda p: (p.confidence, len(p.text)))
+
+
+def recognize_layout(image, backend=None, concurrent=False, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                     profile=None, learned_order=True):
+    """
+    OCR a preprocessed image (array or PIL image) and return an OCRLayout:
+    the cleaned text of the most confident pass plus its lines and word boxes.
+    backend is a backend name or an already resolved backend. profile is the
+    preprocessing profile the image went through; the mode that wins is
+    recorded against it. Results that will be cached pass learned_order=False:
+    they are OCR'd in the fixed OCR_MODES order, so a cached text never
+    depends on what the process happened to scan before.
+    """
+    backend = get_ocr_backend(backend)
+    modes = modes_for_profile(profile) if learned_order else OCR_MODES
+    passes = run_ocr_passes(image, backend=backend, concurrent=concurrent,
+                            min_confidence=min_confidence, modes=modes)
+
+    if not passes:
+        return OCRLayout(clean_extracted_text(pytesseract.image_to_string(image)), (), 0.0, None)
+
+    selected = select_pass(passes)
+    if profile is not None:
+        record_profile_win(profile, selected.psm)
+    return _clean_layout(selected.text, selected.lines, selected.confidence, selected.psm)
+
+
+def recognize_text(image, backend=None, concurrent=False, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                   profile=None, learned_order=True):
+    """OCR a preprocessed image and return the cleaned text (see recognize_layout)"""
+    return recognize_layout(image, backend=backend, concurrent=concurrent, min_confidence=min_confidence,
+                            profile=profile, learned_order=learned_order).text
+
+
+def extract_text_from_image(image_path, preprocess=True, backend=None, concurrent=False,
+                            min_confidence=DEFAULT_MIN_CONFIDENCE, cache=None, stats=None):
     """
     Extract text using Tesseract with fallback modes.
+    If an OCRCache is given, identical image content is only OCR'd once.
+    A stats dict is filled with per-stage preprocessing time and peak memory.
+    Multi-page PDFs and TIFFs are OCR'd page by page and their text merged.
+    """
+    from documents import is_document, extract_text_from_document
+    if is_document(image_path):
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"File not found: {image_path}")
+        return extract_text_from_document(image_path, backend=backend, min_confidence=min_confidence,
+                                          cache=cache).text
+
+    return extract_layout_from_image(image_path, preprocess=preprocess, backend=backend,
+                                     concurrent=concurrent, min_confidence=min_confidence,
+                                     cache=cache, stats=stats).text
+
+
+@metrics.timed('ocr.extract')
+def extract_layout_from_image(image_path, preprocess=True, backend=None, concurrent=False,
+                              min_confidence=DEFAULT_MIN_CONFIDENCE, cache=None, stats=None, gray=None):
+    """
+    Like extract_text_from_image for a single image, but returns the OCRLayout
+    with line and word geometry. The cache stores the whole layout. gray is
+    the already decoded image from hash_image(), if any.
     """
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"File not found: {image_path}")
 
-    try:
-        image = preprocess_image(image_path) if preprocess else Image.open(image_path)
-
-        text_results = []
-
-        # Try multiple PSM modes
-        configs = [
-            '--oem 3 --psm 6 -l eng -c tessedit_char_whitelist=0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ:.%₹,/-',
-            '--oem 3 --psm 4 -l eng',
-            '--oem 3 --psm 11 -l eng'
-        ]
-
-        for config in configs:
-            try:
-                result = pytesseract.image_to_string(image, config=config)
-                if result:
-                    text_results.append(result)
-            except:
-                continue
+    backend = get_ocr_backend(backend)
+    key = None
+    if cache is not None:
+        key = ocr_cache_key(image_path, preprocess, backend, min_confidence)
+        cached = cache.get(key)
+        if cached is not None:
+            logging.info(f"OCR cache hit: {image_path}")
+            return layout_from_json(cached)
 
-        if text_results:
-            extracted = max(text_results, key=len)
+    try:
+        if preprocess:
+            image, profile = preprocess_image(image_path, stats=stats, return_profile=True, gray=gray)
         else:
-            extracted = pytesseract.image_to_string(image)
-
-        return clean_extracted_text(extracted)
+            image, profile = Image.open(image_path), None
+        layout = recognize_layout(image, backend=backend, concurrent=concurrent, min_confidence=min_confidence,
+                                  profile=profile, learned_order=cache is None)
 
     except Exception as e:
         logging.error(f"OCR failed: {e}")
         raise Exception(f"OCR failed: {e}")
+
+    if cache is not None:
+        cache.put(key, layout_to_json(layout))
+    return layout
@@ -0,0 +1,169 @@
+import time
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from categorizer import parse_amounts_and_items, categorize_parsed, keyword_rule_set
+
+
+@dataclass(frozen=True)
+class ScanResult:
+    """
+    Everything one scan produces, computed exactly once.
+    The GUI, logging, the expense database and report writers all read from
+    this instead of re-parsing the text or re-summing amounts.
+    """
+    source_path: str
+    text: str
+    amounts: tuple
+    items: tuple
+    # {category: {'items': tuple, 'amounts': tuple}}, read-only
+    categories: MappingProxyType
+    # {category: sum of its amounts, rounded to cents}, read-only
+    category_totals: MappingProxyType
+    total: float
+    # Sum of the rounded category_totals, so a listing of them adds up to it
+    categorized_total: float
+    # {'ocr': seconds, 'analyze': seconds, 'total': seconds}
+    timings: MappingProxyType
+    # PageText(number, start, end) offsets into text, for multi-page documents
+    pages: tuple = ()
+    # rules_version() of the rule set the items were categorized with
+    rules_version: str = None
+    # Hex perceptual hash of the receipt image (see ocr_utils.hash_image)
+    image_hash: str = None
+    # Id of the stored receipt this image is a near-duplicate of
+    duplicate_of: int = None
+
+    def to_dict(self):
+        """Plain, JSON-serializable copy"""
+        return {
+            'path': self.source_path,
+            'text': self.text,
+            'amounts': list(self.amounts),
+            'items': list(self.items),
+            'categories': {
+                category: {'items': list(data['items']), 'amounts': list(data['amounts'])}
+                for category, data in self.categories.items()
+            },
+            'category_totals': dict(self.category_totals),
+            'total': self.total,
+            'categorized_total': self.categorized_total,
+            'timings': dict(self.timings),
+            'pages': [page._asdict() for page in self.pages],
+            'rules_version': self.rules_version,
+            'image_hash': self.image_hash,
+            'duplicate_of': self.duplicate_of
+        }
+
+
+def _freeze_categories(categorized):
+    return MappingProxyType({
+        category: MappingProxyType({'items': tuple(data['items']), 'amounts': tuple(data['amounts'])})
+        for category, data in categorized.items()
+    })
+
+
+def analyze_text(text, source_path=None, rules=None, ocr_seconds=0.0, pages=(), lines=None,
+                 image_hash=None, duplicate_of=None):
+    """
+    Parse, categorize and total OCR text once, returning a ScanResult.
+    OCR lines with word boxes, when available, let items pair with prices by layout.
+    """
+    start = time.perf_counter()
+    amounts, items = parse_amounts_and_items(text, lines=lines)
+    return analyze_parsed(text, amounts, items, source_path=source_path, rules=rules,
+                          ocr_seconds=ocr_seconds, pages=pages, start=start,
+                          image_hash=image_hash, duplicate_of=duplicate_of)
+
+
+def analyze_parsed(text, amounts, items, source_path=None, rules=None, ocr_seconds=0.0, pages=(),
+                   start=None, image_hash=None, duplicate_of=None):
+    """Categorize and total already parsed amounts and items into a ScanResult"""
+    start = start or time.perf_counter()
+    # Resolved once, so the items are categorized with exactly the rules
+    # the result is labeled with, even if the rules file hot-reloads meanwhile
+    rule_set = rules.rules() if rules is not None else keyword_rule_set()
+    categorized = categorize_parsed(amounts, items, rules=rules, rule_set=rule_set)
+    categories = _freeze_categories(categorized)
+    category_totals = MappingProxyType({
+        category: round(sum(data['amounts']), 2) for category, data in categories.items()
+    })
+    analyze_seconds = time.perf_counter() - start
+
+    return ScanResult(
+        source_path=source_path,
+        text=text,
+        amounts=tuple(amounts),
+        items=tuple(items),
+        categories=categories,
+        category_totals=category_totals,
+        total=sum(amounts),
+        categorized_total=round(sum(category_totals.values()), 2),
+        timings=MappingProxyType({
+            'ocr': ocr_seconds,
+            'analyze': analyze_seconds,
+            'total': ocr_seconds + analyze_seconds
+        }),
+        pages=tuple(pages),
+        rules_version=rule_set.fingerprint,
+        image_hash=image_hash,
+        duplicate_of=duplicate_of
+    )
+
+
+def _reuse_duplicate(db, receipt_id, image_path, image_hash, rules, start):
+    stored = db.get_parse(receipt_id)
+    if stored is None:
+        return None
+    text, amounts, items = stored
+    if amounts is None:
+        # Stored before parses were kept
+        amounts, items = parse_amounts_and_items(text or '')
+    # Categorized again, so a rule change since it was stored still applies
+    return analyze_parsed(text or '', amounts, items, source_path=image_path, rules=rules,
+                          ocr_seconds=time.perf_counter() - start, image_hash=image_hash,
+                          duplicate_of=receipt_id)
+
+
+def scan_receipt(image_path, cache=None, rules=None, duplicates=None, on_duplicate='reuse',
+                 min_similarity=None):
+    """
+    Run OCR and analysis for one receipt image, PDF or multi-page TIFF.
+    With an ExpenseDB as duplicates, a photo that is a near-duplicate of a
+    stored receipt (by perceptual hash) either reuses the stored result
+    without OCR (on_duplicate='reuse') or is OCR'd and flagged ('flag');
+    both set duplicate_of. Documents are always OCR'd.
+    """
+    # Imported here so analyze_text() on stored text never loads OpenCV
+    from ocr_utils import (DEFAULT_MIN_SIMILARITY, extract_layout_from_image, hash_image,
+                           is_distinctive_hash, max_hash_distance)
+    from documents import is_document, extract_text_from_document
+
+    start = time.perf_counter()
+    if is_document(image_path):
+        text, pages = extract_text_from_document(image_path, cache=cache)
+        return analyze_text(text, source_path=image_path, rules=rules,
+                            ocr_seconds=time.perf_counter() - start, pages=pages)
+
+    gray = image_hash = match = None
+    if duplicates is not None:
+        gray, image_hash = hash_image(image_path)
+        if not is_distinctive_hash(image_hash):
+            logging.info(f"{image_path}: image hash has too few bits set, skipping the duplicate check")
+            image_hash = None
+    if image_hash is not None:
+        max_distance = max_hash_distance(min_similarity or DEFAULT_MIN_SIMILARITY)
+        match = duplicates.find_similar_image(image_hash, max_distance)
+        if match is not None:
+            logging.info(f"{image_path} is a near-duplicate of stored receipt {match[0]} "
+                         f"({match[1]} of {len(image_hash) * 4} hash bits differ)")
+            if on_duplicate == 'reuse':
+                result = _reuse_duplicate(duplicates, match[0], image_path, image_hash, rules, start)
+                if result is not None:
+                    return result
+
+    layout = extract_layout_from_image(image_path, cache=cache, gray=gray)
+    return analyze_text(layout.text, source_path=image_path, rules=rules,
+                        ocr_seconds=time.perf_counter() - start, lines=layout.lines,
+                        image_hash=image_hash, duplicate_of=match[0] if match is not None else None)
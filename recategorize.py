@@ -0,0 +1,136 @@
+"""
+Incremental re-categorization of the stored receipt archive.
+
+Each stored receipt keeps its parsed (amounts, items) and the version of the
+rule set that categorized it. When the rules change, only receipts with an
+item containing a keyword whose matching could differ are categorized again;
+the rest just move to the new version. Work runs in parallel chunks and each
+finished chunk is committed, so an interrupted run resumes where it stopped.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from categorizer import (CATEGORY_KEYWORDS, parse_amounts_and_items, categorize_expenses,
+                         assign_amounts_to_categories)
+from keyword_index import KeywordMatcher
+from rule_store import affected_keywords, normalize_options, rules_version
+
+# Receipts per unit of work sent to a worker process
+CHUNK_SIZE = 500
+
+
+def recategorize_chunk(rows, table, options, keywords_by_version):
+    """
+    Re-evaluate one chunk of (receipt_id, amounts, items, rules_version) rows.
+    keywords_by_version maps each old version to the changed keywords (None:
+    re-evaluate every receipt of that version). Returns (updates, items
+    checked, items affected) where updates is [(receipt_id, categories or
+    None)], None meaning the receipt's categories cannot have changed.
+    """
+    detectors = {
+        version: KeywordMatcher({'changed': keywords}) if keywords else None
+        for version, keywords in keywords_by_version.items()
+        if keywords is not None
+    }
+    updates = []
+    checked = 0
+    affected = 0
+    for receipt_id, amounts, items, version in rows:
+        checked += len(items)
+        if keywords_by_version.get(version) is None:
+            hits = len(items)
+        else:
+            detector = detectors[version]
+            # Substring hits are a superset of word-boundary hits, so this never misses
+            hits = 0 if detector is None else sum(
+                1 for item in items if next(iter(detector.find_all(item.lower())), None) is not None
+            )
+        if not hits:
+            updates.append((receipt_id, None))
+            continue
+
+        affected += hits
+        categorized = categorize_expenses(
+            items,
+            keywords=table,
+            first_match_wins=options['first_match_wins'],
+            word_boundary=options['word_boundary'],
+            priorities=options['priorities']
+        )
+        categorized = assign_amounts_to_categories(amounts, categorized)
+        updates.append((receipt_id, {category: dict(data) for category, data in categorized.items()}))
+    return updates, checked, affected
+
+
+def _chunks(db, version, chunk_size):
+    after_id = 0
+    while True:
+        rows = db.stale_parses(version, after_id=after_id, limit=chunk_size)
+        if not rows:
+            return
+        after_id = rows[-1][0]
+        yield rows
+
+
+def recategorize_archive(db, table=None, options=None, workers=None, chunk_size=CHUNK_SIZE, on_progress=None):
+    """
+    Bring every receipt in an ExpenseDB up to date with a rule set (default:
+    CATEGORY_KEYWORDS). on_progress(done, total) is called after each chunk.
+    Returns a summary dict.
+    """
+    start = time.perf_counter()
+    table = CATEGORY_KEYWORDS if table is None else table
+    options = normalize_options(options)
+    version = rules_version(table, options)
+    db.register_rules(version, table, options)
+
+    # Receipts stored before parses were kept are parsed from their text once
+    backfilled = db.backfill_parses(parse_amounts_and_items)
+
+    stale = db.stale_versions(version)
+    total = sum(stale.values())
+    keywords_by_version = {}
+    for old_version in stale:
+        old_rules = db.get_rules(old_version) if old_version else None
+        if old_rules is None:
+            keywords_by_version[old_version] = None
+        else:
+            keywords = affected_keywords(old_rules[0], old_rules[1], table, options)
+            keywords_by_version[old_version] = None if keywords is None else sorted(keywords)
+    logging.info(f"Re-categorizing {total} receipts to rules {version} "
+                 f"({sum(1 for k in keywords_by_version.values() if k is None)} full re-evaluations)")
+
+    summary = {'version': version, 'backfilled': backfilled, 'receipts': total, 'changed': 0,
+               'items_checked': 0, 'items_affected': 0}
+    done = 0
+    workers = workers or os.cpu_count() or 1
+    if total:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # A couple of chunks per worker in flight; the rest are read as they finish
+            max_pending = workers * 2
+            chunks = _chunks(db, version, chunk_size)
+            pending = set()
+            while True:
+                while len(pending) < max_pending:
+                    rows = next(chunks, None)
+                    if rows is None:
+                        break
+                    pending.add(executor.submit(recategorize_chunk, rows, table, options, keywords_by_version))
+                if not pending:
+                    break
+
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    updates, checked, affected = future.result()
+                    db.apply_categories(version, updates)
+                    done += len(updates)
+                    summary['changed'] += sum(1 for _, categories in updates if categories is not None)
+                    summary['items_checked'] += checked
+                    summary['items_affected'] += affected
+                    if on_progress is not None:
+                        on_progress(done, total)
+
+    summary['elapsed'] = time.perf_counter() - start
+    return summary
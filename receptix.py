@@ -0,0 +1,386 @@
+"""
+Receptix command line entry point.
+
+Usage:
+    python receptix.py batch <dir> [--workers N] [--output results.jsonl]
+    python receptix.py batch <dir> --preprocess-workers N --ocr-workers M
+    python receptix.py watch [<dir>] [--journal reports/ingest.jsonl]
+    python receptix.py serve [--port 8765] [--workers N] [--max-queue 64]
+    python receptix.py report [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--category NAME]
+    python receptix.py recategorize [--rules rules.json] [--workers N]
+    python receptix.py --import-time
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import metrics
+from ocr_cache import DEFAULT_CACHE_PATH
+from expense_db import DEFAULT_DB_PATH
+
+# Receipts written to the expense database per transaction
+DB_BATCH_SIZE = 200
+# categorizer.CategoryCache snapshot shared by batch runs
+DEFAULT_CATEGORY_CACHE_PATH = os.path.join("cache", "category_cache.json")
+
+
+def load_rule_set(path=None):
+    """(table, options) from a rules file, or the built-in keyword table"""
+    if path:
+        from rule_store import load_rules
+        return load_rules(path)
+    from categorizer import CATEGORY_KEYWORDS
+    return CATEGORY_KEYWORDS, {}
+
+
+def save_category_cache(path, items, rules_path=None):
+    """
+    Categorize items through the cache seeded from the snapshot at path and
+    save it back for the next run's workers. Returns the number of entries saved.
+    """
+    from categorizer import category_cache, categorize_expenses
+    from rule_store import normalize_options
+
+    category_cache.load(path)
+    table, options = load_rule_set(rules_path)
+    categorize_expenses(sorted(items), keywords=table, **normalize_options(options))
+    category_cache.save(path)
+    return len(category_cache)
+
+
+def cmd_batch(args):
+    """Scan a directory of receipts headlessly and stream JSON lines"""
+    from batch import run_batch
+    from categorizer import DEFAULT_CATEGORY_CACHE_SIZE
+
+    stages = None
+    if args.preprocess_workers or args.ocr_workers:
+        stages = {'preprocess_workers': args.preprocess_workers, 'ocr_workers': args.ocr_workers}
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    db = None
+    pending = []
+    duplicates = []
+    # Distinct item texts, to refresh the category cache snapshot afterwards
+    seen_items = set()
+    version = None
+    if args.db:
+        from expense_db import ExpenseDB, file_sha256
+        db = ExpenseDB(args.db)
+        # Lets a later 'recategorize' diff against the rules these scans used
+        table, options = load_rule_set(args.rules)
+        from rule_store import rules_version
+        version = rules_version(table, options)
+        db.register_rules(version, table, options)
+
+    def write_result(result):
+        with metrics.span('report.write'):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if args.category_cache and result['ok'] and len(seen_items) < DEFAULT_CATEGORY_CACHE_SIZE:
+                seen_items.update(result['items'])
+            if db is not None and result['ok'] and result['duplicate_of'] is not None:
+                # Already stored: saving it again would count the expense twice
+                duplicates.append(result['path'])
+            elif db is not None and result['ok']:
+                pending.append({
+                    'source_path': result['path'],
+                    # Same content hash the GUI stores, so find_by_hash sees batch scans too
+                    'source_hash': file_sha256(result['path']) if os.path.exists(result['path']) else None,
+                    'text': result['text'],
+                    'categories': result['categories'],
+                    'total': result['total'],
+                    'amounts': result['amounts'],
+                    'items': result['items'],
+                    'rules_version': result['rules_version'],
+                    'image_hash': result['image_hash']
+                })
+                if len(pending) >= DB_BATCH_SIZE:
+                    db.add_receipts(pending)
+                    pending.clear()
+
+    try:
+        summary = run_batch(
+            args.directory,
+            workers=args.workers,
+            recursive=args.recursive,
+            on_result=write_result,
+            cache_path=None if args.no_cache else args.cache,
+            rules_path=args.rules,
+            db_path=args.db if args.duplicates != 'off' else None,
+            duplicates={'on_duplicate': args.duplicates, 'min_similarity': args.min_similarity},
+            stages=stages,
+            category_cache_path=args.category_cache
+        )
+        if db is not None and args.rules:
+            # Summed across runs, so 'report --dead-rules' sees every batch
+            db.add_rule_hits(version, summary['rule_hits'])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if db is not None:
+            if pending:
+                db.add_receipts(pending)
+            db.close()
+
+    print(
+        f"Scanned {summary['receipts']} receipts "
+        f"({summary['succeeded']} ok, {summary['failed']} failed) "
+        f"in {summary['elapsed']:.2f}s - "
+        f"{summary['receipts_per_sec']:.2f} receipts/sec, "
+        f"p50 {summary['p50_latency'] * 1000:.0f} ms, "
+        f"p95 {summary['p95_latency'] * 1000:.0f} ms",
+        file=sys.stderr
+    )
+    if duplicates:
+        print(f"{len(duplicates)} near-duplicates of stored receipts were not stored again", file=sys.stderr)
+    if args.category_cache:
+        stats = summary['category_cache']
+        entries = save_category_cache(args.category_cache, seen_items, args.rules)
+        print(f"Category cache: {stats['hits']}/{stats['hits'] + stats['misses']} item lookups hit in the "
+              f"workers ({stats['hit_rate']:.0%}), {entries} entries saved to {args.category_cache}",
+              file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+def cmd_watch(args):
+    """Run the ingestion service on a watched directory or on paths from stdin"""
+    from watcher import IngestionService
+
+    service = IngestionService(
+        args.journal,
+        watch_dir=args.directory,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        settle_seconds=args.settle,
+        cache_path=None if args.no_cache else args.cache,
+        rules_path=args.rules
+    )
+    if args.directory:
+        service.run_forever()
+    else:
+        service.start()
+        try:
+            for line in sys.stdin:
+                if line.strip():
+                    service.enqueue(line.strip())
+        finally:
+            service.shutdown()
+    return 0
+
+
+def cmd_serve(args):
+    """Run the local HTTP scanning service until interrupted"""
+    import asyncio
+    from service import ScanService
+
+    service = ScanService(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        max_batch=args.max_batch,
+        cache_path=None if args.no_cache else args.cache,
+        rules_path=args.rules
+    )
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_report(args):
+    """Print per-category totals from the expense database"""
+    from expense_db import ExpenseDB
+
+    if args.dead_rules:
+        return report_dead_rules(args)
+
+    db = ExpenseDB(args.db)
+    try:
+        if args.category:
+            totals = {args.category: db.category_total(args.category, args.start, args.end)}
+        else:
+            totals = db.category_totals(args.start, args.end)
+    finally:
+        db.close()
+
+    for category, total in totals.items():
+        print(f"{category:<25} ${total:>12,.2f}")
+    print(f"{'TOTAL':<25} ${sum(totals.values()):>12,.2f}")
+    return 0
+
+
+def report_dead_rules(args):
+    """Print the keyword rules no stored batch run has matched yet"""
+    from expense_db import ExpenseDB
+    from rule_store import dead_rules, rules_version
+
+    if not args.rules:
+        # Rule hits are only counted for scans run with a rules file
+        print("--dead-rules needs the --rules file the batches were scanned with", file=sys.stderr)
+        return 2
+    table, options = load_rule_set(args.rules)
+    version = rules_version(table, options)
+    db = ExpenseDB(args.db)
+    try:
+        hits = db.rule_hits(version)
+    finally:
+        db.close()
+
+    dead = dead_rules(table, hits)
+    for category, keyword in dead:
+        print(f"{category:<25} {keyword}")
+    print(f"{len(dead)} of {sum(len(keywords) for keywords in table.values())} keyword rules never matched "
+          f"(rules {version}, {sum(hits.values())} matches recorded)")
+    return 0
+
+
+def cmd_recategorize(args):
+    """Bring the stored archive's categories up to date with the current rules"""
+    from expense_db import ExpenseDB
+    from recategorize import recategorize_archive
+
+    def progress(done, total):
+        print(f"\rRe-categorized {done}/{total} receipts", end="", file=sys.stderr, flush=True)
+
+    table, options = load_rule_set(args.rules)
+    db = ExpenseDB(args.db)
+    try:
+        summary = recategorize_archive(db, table, options, workers=args.workers,
+                                       chunk_size=args.chunk_size, on_progress=progress)
+    finally:
+        db.close()
+
+    if summary['receipts']:
+        print(file=sys.stderr)
+    print(
+        f"Rules {summary['version']}: {summary['receipts']} receipts checked, "
+        f"{summary['changed']} re-categorized "
+        f"({summary['items_affected']} of {summary['items_checked']} items affected), "
+        f"{summary['backfilled']} parsed from stored text, in {summary['elapsed']:.2f}s",
+        file=sys.stderr
+    )
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="receptix", description="Receptix - Smart Receipt Scanner")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress to stderr")
+    parser.add_argument("--metrics-jsonl", help="append per-stage timing histograms to this JSON lines file")
+    parser.add_argument("--metrics-prom", help="write per-stage timing histograms in Prometheus text format")
+    parser.add_argument("--import-time", action="store_true",
+                        help="print the cold import cost of each module and exit")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="scan every receipt image in a directory")
+    batch_parser.add_argument("directory", help="directory containing receipt images")
+    batch_parser.add_argument("-w", "--workers", type=int, default=None,
+                              help="worker processes (default: CPU count)")
+    batch_parser.add_argument("-o", "--output", help="write JSON lines here instead of stdout")
+    batch_parser.add_argument("-r", "--recursive", action="store_true", help="scan subdirectories too")
+    batch_parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                              help=f"OCR result cache file (default: {DEFAULT_CACHE_PATH})")
+    batch_parser.add_argument("--no-cache", action="store_true", help="always run OCR, ignore the cache")
+    batch_parser.add_argument("--rules", help="category rules file (JSON, YAML or SQLite), reloaded on change")
+    batch_parser.add_argument("--db", help="also store results in this expense database")
+    batch_parser.add_argument("--duplicates", choices=("reuse", "flag", "off"), default="reuse",
+                              help="photos that look like a receipt already in --db: reuse its result "
+                                   "without OCR, OCR but flag them, or don't check (default: reuse)")
+    batch_parser.add_argument("--min-similarity", type=float, default=None,
+                              help="fraction of equal image hash bits that counts as a duplicate (default: 0.9)")
+    batch_parser.add_argument("--preprocess-workers", type=int, default=None,
+                              help="decode/preprocess processes; setting this or --ocr-workers runs the two "
+                                   "stages separately over shared memory (default: half the CPU count)")
+    batch_parser.add_argument("--ocr-workers", type=int, default=None,
+                              help="OCR processes for the two-stage pipeline (default: CPU count)")
+    batch_parser.add_argument("--category-cache", default=DEFAULT_CATEGORY_CACHE_PATH,
+                              help="item category snapshot that pre-seeds the workers and is refreshed "
+                                   f"after the batch (default: {DEFAULT_CATEGORY_CACHE_PATH})")
+    batch_parser.add_argument("--no-category-cache", dest="category_cache", action="store_const", const=None,
+                              help="don't load or save the category snapshot")
+    batch_parser.set_defaults(func=cmd_batch)
+
+    watch_parser = subparsers.add_parser("watch", help="ingest receipts continuously from a folder or stdin")
+    watch_parser.add_argument("directory", nargs="?",
+                              help="folder to watch (omit to read image paths from stdin)")
+    watch_parser.add_argument("-j", "--journal", default=os.path.join("reports", "ingest.jsonl"),
+                              help="JSON lines results journal, also the restart checkpoint")
+    watch_parser.add_argument("-w", "--workers", type=int, default=None,
+                              help="worker processes (default: CPU count)")
+    watch_parser.add_argument("--max-queue", type=int, default=100,
+                              help="queued receipts before discovery blocks")
+    watch_parser.add_argument("--settle", type=float, default=2.0,
+                              help="seconds a file must stay unchanged before it is scanned")
+    watch_parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="OCR result cache file")
+    watch_parser.add_argument("--no-cache", action="store_true", help="always run OCR, ignore the cache")
+    watch_parser.add_argument("--rules", help="category rules file (JSON, YAML or SQLite), reloaded on change")
+    watch_parser.set_defaults(func=cmd_watch)
+
+    serve_parser = subparsers.add_parser("serve", help="local HTTP service: upload receipts, poll for results")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    serve_parser.add_argument("-w", "--workers", type=int, default=None,
+                              help="worker processes (default: CPU count)")
+    serve_parser.add_argument("--max-queue", type=int, default=64,
+                              help="receipts waiting or running before uploads get 429")
+    serve_parser.add_argument("--max-batch", type=int, default=4,
+                              help="most receipts sent to one worker as a single task")
+    serve_parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="OCR result cache file")
+    serve_parser.add_argument("--no-cache", action="store_true", help="always run OCR, ignore the cache")
+    serve_parser.add_argument("--rules", help="category rules file (JSON, YAML or SQLite), reloaded on change")
+    serve_parser.set_defaults(func=cmd_serve)
+
+    report_parser = subparsers.add_parser("report", help="category totals from the expense database")
+    report_parser.add_argument("--db", default=DEFAULT_DB_PATH, help=f"expense database (default: {DEFAULT_DB_PATH})")
+    report_parser.add_argument("--from", dest="start", help="start date, inclusive (YYYY-MM-DD)")
+    report_parser.add_argument("--to", dest="end", help="end date, exclusive (YYYY-MM-DD)")
+    report_parser.add_argument("--category", help="only this category")
+    report_parser.add_argument("--dead-rules", action="store_true",
+                               help="list keyword rules that no 'batch --db' run has matched")
+    report_parser.add_argument("--rules", help="rules file the batches were scanned with, for --dead-rules")
+    report_parser.set_defaults(func=cmd_report)
+
+    recat_parser = subparsers.add_parser("recategorize",
+                                         help="re-categorize stored receipts after a rules change")
+    recat_parser.add_argument("--db", default=DEFAULT_DB_PATH, help=f"expense database (default: {DEFAULT_DB_PATH})")
+    recat_parser.add_argument("--rules", help="category rules file (default: the built-in keywords)")
+    recat_parser.add_argument("-w", "--workers", type=int, default=None,
+                              help="worker processes (default: CPU count)")
+    recat_parser.add_argument("--chunk-size", type=int, default=500, help="receipts per work unit")
+    recat_parser.set_defaults(func=cmd_recategorize)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.import_time:
+        import startup
+        startup.print_import_times()
+        return 0
+    if args.command is None:
+        parser.error("a command is required")
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    if args.metrics_jsonl or args.metrics_prom:
+        metrics.enable()
+    try:
+        return args.func(args)
+    finally:
+        if args.metrics_jsonl:
+            metrics.write_jsonl(args.metrics_jsonl)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
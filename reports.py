@@ -0,0 +1,38 @@
+import os
+from datetime import datetime
+
+
+def render_text_report(result, generated=None):
+    """Render the plain-text expense report for a ScanResult"""
+    generated = generated or datetime.now()
+    lines = [
+        "=" * 50,
+        "RECEPTIX - EXPENSE REPORT",
+        "=" * 50,
+        f"Generated: {generated.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Source Image: {os.path.basename(result.source_path) if result.source_path else 'N/A'}",
+        "-" * 50,
+        "",
+        "EXTRACTED TEXT:",
+        "-" * 20,
+        result.text,
+        "",
+        "EXPENSE BREAKDOWN:",
+        "-" * 20
+    ]
+
+    for category, data in result.categories.items():
+        if data['amounts']:
+            lines.append(f"\n{category.upper()}:")
+            lines.append(f"  Total: ${result.category_totals[category]:.2f}")
+            lines.append(f"  Items: {', '.join(data['items'])}")
+
+    lines.append(f"\nGRAND TOTAL: ${result.categorized_total:.2f}")
+    lines.append("=" * 50)
+    return "\n".join(lines) + "\n"
+
+
+def write_text_report(filename, result, generated=None):
+    """Write the plain-text report for a ScanResult to filename"""
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(render_text_report(result, generated))
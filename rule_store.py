@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import Counter
+
+from keyword_index import KeywordMatcher
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# How often (seconds) to stat the rules file for changes
+DEFAULT_CHECK_INTERVAL = 2.0
+
+# Matching options and their defaults, as accepted by CompiledRules
+RULE_OPTION_DEFAULTS = {'priorities': {}, 'word_boundary': False, 'first_match_wins': True}
+
+
+def normalize_options(options=None):
+    """options with every matching option filled in"""
+    return dict(RULE_OPTION_DEFAULTS, **{k: v for k, v in (options or {}).items() if v is not None})
+
+
+def rules_version(table, options=None):
+    """
+    Content hash of a rule set. Identical keywords, category order and
+    matching options give the same version wherever they were loaded from.
+    """
+    payload = json.dumps({
+        'table': [[category, list(keywords)] for category, keywords in table.items()],
+        'options': normalize_options(options)
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def dead_rules(table, hits):
+    """
+    (category, keyword) rules of table that never matched, given hits, a
+    Counter of (category, lowercased keyword) match counts.
+    """
+    return [
+        (category, keyword)
+        for category, keywords in table.items()
+        for keyword in keywords
+        if hits[(category, keyword.lower())] == 0
+    ]
+
+
+def merge_rule_hits(total, rows):
+    """Add [category, keyword, count] rows, as workers return them, into the Counter total"""
+    for category, keyword, count in rows:
+        total[(category, keyword)] += count
+    return total
+
+
+def rule_hit_rows(hits):
+    """JSON-friendly [category, keyword, count] rows of a hit Counter"""
+    return [[category, keyword, count] for (category, keyword), count in sorted(hits.items())]
+
+
+def affected_keywords(old_table, old_options, new_table, new_options):
+    """
+    Lowercased keywords whose presence in an item means its category may
+    differ between two rule sets, or None when every matching item may be
+    affected (matching options or the relative category order changed).
+    An item containing none of them matches exactly the same rules under both.
+    """
+    old_options = normalize_options(old_options)
+    new_options = normalize_options(new_options)
+    for option in ('word_boundary', 'first_match_wins'):
+        if old_options[option] != new_options[option]:
+            return None
+
+    # Only relative order matters; categories added or removed are covered by the keyword diff
+    shared = set(old_table) & set(new_table)
+    if [c for c in old_table if c in shared] != [c for c in new_table if c in shared]:
+        return None
+
+    def pairs(table):
+        return {(category, keyword.lower()) for category, keywords in table.items() for keyword in keywords}
+
+    keywords = {keyword for _, keyword in pairs(old_table) ^ pairs(new_table)}
+    old_priorities, new_priorities = old_options['priorities'], new_options['priorities']
+    for category in set(old_priorities) | set(new_priorities):
+        if old_priorities.get(category, 0) != new_priorities.get(category, 0):
+            for table in (old_table, new_table):
+                keywords.update(keyword.lower() for keyword in table.get(category, ()))
+    keywords.discard('')
+    return keywords
+
+
+def load_rules(path):
+    """
+    Load category rules from a JSON, YAML or SQLite file.
+
+    JSON/YAML: {"Category": ["keyword", ...], ...} or
+               {"categories": {...}, "priorities": {...},
+                "word_boundary": false, "first_match_wins": true}
+    SQLite:    table rules(category TEXT, keyword TEXT, priority INTEGER),
+               categories ordered by their first rowid
+    Returns (table, options).
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.db', '.sqlite', '.sqlite3'):
+        return _load_sqlite_rules(path)
+
+    with open(path, encoding="utf-8") as f:
+        if ext in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ValueError("PyYAML is required to load YAML rule files")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    if 'categories' not in data:
+        return data, {}
+    options = {key: data[key] for key in ('priorities', 'word_boundary', 'first_match_wins') if key in data}
+    return data['categories'], options
+
+
+def _load_sqlite_rules(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT category, keyword, priority FROM rules ORDER BY rowid").fetchall()
+    finally:
+        conn.close()
+    table = {}
+    priorities = {}
+    for category, keyword, priority in rows:
+        table.setdefault(category, []).append(keyword)
+        if priority:
+            priorities[category] = max(priorities.get(category, 0), priority)
+    # Priorities only mean something if they are allowed to decide the winner
+    return table, {'priorities': priorities, 'first_match_wins': not priorities}
+
+
+class CompiledRules:
+    """An immutable, compiled rule set: the keyword table plus its matcher"""
+
+    def __init__(self, table, priorities=None, word_boundary=False, first_match_wins=True, version=None):
+        self.table = table
+        self.priorities = priorities or {}
+        self.word_boundary = word_boundary
+        self.first_match_wins = first_match_wins
+        self.version = version
+        # Content hash, stable across reloads of an unchanged file
+        self.fingerprint = rules_version(table, {
+            'priorities': self.priorities,
+            'word_boundary': word_boundary,
+            'first_match_wins': first_match_wins
+        })
+        self.matcher = KeywordMatcher(table, word_boundary=word_boundary, priorities=self.priorities)
+
+
+class RuleStore:
+    """
+    Category rules loaded from an external file into a compiled matcher.
+
+    The file is re-checked at most every check_interval seconds; when it
+    changes, a new CompiledRules is built off to the side and swapped in with
+    a single reference assignment, so concurrent readers always see either the
+    old or the new index and never a half-built one.
+    """
+
+    def __init__(self, path, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.hits = Counter()
+        self._new_hits = Counter()
+        self._hits_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._rules = None
+        self.reload()
+
+    def reload(self):
+        """Load and compile the rules file now"""
+        with self._reload_lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            table, options = load_rules(self.path)
+            self._rules = CompiledRules(table, version=mtime, **options)
+            self._mtime = mtime
+            self._next_check = time.monotonic() + self.check_interval
+        logging.info(f"Loaded {sum(len(k) for k in table.values())} category rules from {self.path}")
+
+    def rules(self):
+        """Current compiled rules, reloading first if the file changed"""
+        if time.monotonic() >= self._next_check:
+            self._check_for_changes()
+        return self._rules
+
+    def _check_for_changes(self):
+        self._next_check = time.monotonic() + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logging.warning(f"Rules file unavailable, keeping current rules: {e}")
+            return
+        if mtime != self._mtime:
+            try:
+                self.reload()
+            except Exception as e:
+                # A half-written or invalid file must not take down the workers
+                logging.error(f"Failed to reload rules from {self.path}: {e}")
+
+    def record_hit(self, category, keyword):
+        with self._hits_lock:
+            self.hits[(category, keyword)] += 1
+            self._new_hits[(category, keyword)] += 1
+
+    def take_new_hits(self):
+        """[category, keyword, count] rows of the hits since the last call, for workers to send back"""
+        with self._hits_lock:
+            new_hits, self._new_hits = self._new_hits, Counter()
+        return rule_hit_rows(new_hits)
+
+    def dead_rules(self):
+        """Rules in the current table that have never matched in this process"""
+        return dead_rules(self.rules().table, self.hits)
@@ -0,0 +1,400 @@
+"""
+Local HTTP scanning service, so other apps can scan receipts without the GUI.
+
+    POST /scan                multipart/form-data upload, field "file"
+                              202 + job id, or with ?wait=1 the result itself
+    GET  /jobs/<id>           job status
+    GET  /jobs/<id>/result    200 result, 202 while still running
+    GET  /stats               queue depth and counters
+    GET  /rules/dead          keyword rules no scan has matched (with a rules file)
+
+Uploads are spooled to disk and scanned on a process pool. When a worker
+frees up it takes an even share of the waiting receipts as one task
+(micro-batching), so a busy service pays one round trip per batch rather
+than per receipt, while an idle one never holds a receipt back.
+Once max_queue receipts are waiting or running, new uploads get 429.
+
+Built on asyncio streams from the standard library; it speaks just enough
+HTTP/1.1 (Content-Length bodies, keep-alive) for local clients.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+import functools
+import tempfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, parse_qs
+
+from batch import IMAGE_EXTENSIONS, scan_files, _init_worker
+from rule_store import dead_rules, load_rules, merge_rule_hits
+import metrics
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 64
+# Receipts sent to a worker as one task at most
+DEFAULT_MAX_BATCH = 4
+# Seconds a ?wait=1 request waits before falling back to a 202 to poll
+DEFAULT_SYNC_TIMEOUT = 60.0
+# Finished jobs kept for polling; the oldest are forgotten first
+DEFAULT_MAX_RESULTS = 1000
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+# Seconds an idle keep-alive connection stays open
+KEEP_ALIVE_TIMEOUT = 30.0
+
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 415: "Unsupported Media Type",
+           429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def parse_multipart(body, content_type):
+    """(filename, bytes) of the "file" field of a multipart/form-data body"""
+    boundary = None
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'boundary':
+            boundary = value.strip('"')
+    if not boundary:
+        raise HTTPError(400, "multipart body without a boundary")
+
+    delimiter = b"--" + boundary.encode("latin-1")
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b"--"):
+            break
+        head, separator, data = part.partition(b"\r\n\r\n")
+        if not separator:
+            continue
+        disposition = {}
+        for line in head.decode("utf-8", "replace").split("\r\n"):
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-disposition':
+                for param in value.split(';')[1:]:
+                    key, _, param_value = param.strip().partition('=')
+                    disposition[key.lower()] = param_value.strip('"')
+        if disposition.get('name') == 'file':
+            # The part's data ends with the CRLF before the next delimiter
+            return disposition.get('filename') or 'upload', data[:-2] if data.endswith(b"\r\n") else data
+    raise HTTPError(400, 'no "file" field in the upload')
+
+
+class Job:
+    """One uploaded receipt and, once scanned, its result"""
+
+    def __init__(self, job_id, filename, path):
+        self.id = job_id
+        self.filename = filename
+        self.path = path
+        self.status = "queued"
+        self.result = None
+        self.submitted = time.perf_counter()
+        self.finished = None
+        self.done = asyncio.Event()
+
+    def to_dict(self):
+        state = {'id': self.id, 'filename': self.filename, 'status': self.status}
+        if self.finished is not None:
+            state['latency'] = self.finished - self.submitted
+        if self.result is not None and not self.result['ok']:
+            state['error'] = self.result['error']
+        return state
+
+
+class ScanService:
+    """
+    The HTTP front end, job table and micro-batching dispatcher.
+    Run it with asyncio.run(service.serve_forever()).
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, max_queue=DEFAULT_MAX_QUEUE,
+                 max_batch=DEFAULT_MAX_BATCH, sync_timeout=DEFAULT_SYNC_TIMEOUT,
+                 max_results=DEFAULT_MAX_RESULTS, cache_path=None, rules_path=None):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.sync_timeout = sync_timeout
+        self.max_results = max_results
+        self.cache_path = cache_path
+        self.rules_path = rules_path
+
+        self.jobs = OrderedDict()
+        self.active = 0
+        self.counters = {'accepted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0, 'batches': 0}
+        # Keyword rule matches summed over every worker's scans
+        self.rule_hits = Counter()
+        self._waiting = None
+        self._free_workers = None
+        self._executor = None
+        self._spool = None
+        self._server = None
+        self._tasks = set()
+
+    # --- dispatch -----------------------------------------------------------
+
+    async def _dispatch(self):
+        """Hand waiting jobs to free workers, sharing the backlog between them"""
+        while True:
+            first = await self._waiting.get()
+            await self._free_workers.acquire()
+            # An even share of the backlog per worker: the rest is left for
+            # workers that free up next rather than queued behind this one
+            share = min(self.max_batch, -(-(1 + self._waiting.qsize()) // self.workers))
+            batch = [first]
+            while len(batch) < share and not self._waiting.empty():
+                batch.append(self._waiting.get_nowait())
+            for job in batch:
+                job.status = "running"
+            self.counters['batches'] += 1
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            results = await loop.run_in_executor(executor, scan_files, [job.path for job in batch])
+        except BrokenProcessPool as e:
+            # A worker was killed (out of memory, a crash in native code) and
+            # took the pool down; every batch on it fails, the first to notice
+            # swaps in a fresh pool so later uploads still get scanned
+            if self._executor is executor:
+                logging.error(f"Worker pool broke, starting a new one: {e}")
+                self._executor = self._new_executor()
+                executor.shutdown(wait=False)
+            results = [{'ok': False, 'error': f"worker process died: {e}", 'latency': 0.0} for _ in batch]
+        except Exception as e:
+            # scan_files returns scan failures, so this is the task not reaching a worker
+            results = [{'ok': False, 'error': str(e), 'latency': 0.0} for _ in batch]
+        finally:
+            self._free_workers.release()
+
+        for job, result in zip(batch, results):
+            result['path'] = job.filename
+            self._finish(job, result)
+
+    def _finish(self, job, result):
+        job.result = result
+        job.status = "done" if result['ok'] else "failed"
+        job.finished = time.perf_counter()
+        job.done.set()
+        self.active -= 1
+        self.counters['succeeded' if result['ok'] else 'failed'] += 1
+        if result['ok']:
+            metrics.observe_all(result['stage_timings'])
+            merge_rule_hits(self.rule_hits, result['rule_hits'])
+        else:
+            logging.error(f"Error processing {job.filename}: {result['error']}")
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+        # Forget the oldest finished jobs beyond max_results
+        while len(self.jobs) > self.max_results:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.done.is_set():
+                break
+            self.jobs.popitem(last=False)
+
+    # --- endpoints ----------------------------------------------------------
+
+    async def _scan(self, query, headers, body):
+        content_type = headers.get('content-type', '')
+        if not content_type.lower().startswith('multipart/form-data'):
+            raise HTTPError(415, "upload the receipt as multipart/form-data")
+        if self.active >= self.max_queue:
+            self.counters['rejected'] += 1
+            # Roughly how long until a slot frees up, assuming ~1 s per receipt
+            retry_after = max(1, self.active // self.workers)
+            raise HTTPError(429, "scan queue is full", {'Retry-After': str(retry_after)})
+
+        filename, data = parse_multipart(body, content_type)
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in IMAGE_EXTENSIONS:
+            raise HTTPError(415, f"unsupported file type {extension or '(none)'}")
+
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self._spool, job_id + extension)
+        with open(path, "wb") as f:
+            f.write(data)
+        job = Job(job_id, filename, path)
+        self.jobs[job_id] = job
+        self.active += 1
+        self.counters['accepted'] += 1
+        self._waiting.put_nowait(job)
+
+        if query.get('wait', ['0'])[0] not in ('0', 'false', ''):
+            try:
+                await asyncio.wait_for(job.done.wait(), self.sync_timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                return 200, job.result
+        return 202, dict(job.to_dict(), status_url=f"/jobs/{job_id}", result_url=f"/jobs/{job_id}/result")
+
+    def _job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPError(404, f"unknown job {job_id}")
+        return job
+
+    def stats(self):
+        return dict(self.counters, active=self.active, waiting=self._waiting.qsize(),
+                    max_queue=self.max_queue, workers=self.workers)
+
+    def dead_rules(self):
+        if not self.rules_path:
+            raise HTTPError(404, "the service runs on the built-in keywords; start it with a rules file")
+        table, _ = load_rules(self.rules_path)
+        dead = dead_rules(table, self.rule_hits)
+        return {'dead_rules': [[category, keyword] for category, keyword in dead],
+                'matches': sum(self.rule_hits.values())}
+
+    async def _route(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+
+        if parts == ['scan']:
+            if method != 'POST':
+                raise HTTPError(405, "use POST")
+            return await self._scan(query, headers, body)
+        if method != 'GET':
+            raise HTTPError(405, "use GET")
+        if parts == ['stats']:
+            return 200, self.stats()
+        if parts == ['rules', 'dead']:
+            return 200, self.dead_rules()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            return 200, self._job(parts[1]).to_dict()
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+            job = self._job(parts[1])
+            if not job.done.is_set():
+                return 202, job.to_dict()
+            return 200, job.result
+        raise HTTPError(404, f"no such endpoint {url.path}")
+
+    # --- HTTP ---------------------------------------------------------------
+
+    async def _read_request(self, reader):
+        """(method, target, headers, body), or None when the client hung up"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(400, "request headers too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name:
+                headers[name.strip().lower()] = value.strip()
+
+        body = b""
+        if method in ('POST', 'PUT'):
+            if 'content-length' not in headers:
+                raise HTTPError(411, "Content-Length required")
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise HTTPError(400, f"invalid Content-Length {headers['content-length']!r}")
+            if length > MAX_UPLOAD_BYTES:
+                raise HTTPError(413, f"uploads are limited to {MAX_UPLOAD_BYTES} bytes")
+            body = await reader.readexactly(length)
+        return method, target, headers, body
+
+    async def _respond(self, writer, status, payload, headers=None, keep_alive=True):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+                 "Content-Type: application/json",
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    status, payload = await self._route(method, target, headers, body)
+                    extra = {}
+                except HTTPError as e:
+                    status, payload, extra = e.status, {'error': str(e)}, e.headers
+                    # The unread body of a rejected request would be parsed as the next request
+                    keep_alive = keep_alive and e.status not in (400, 411, 413)
+                except Exception as e:
+                    logging.exception(f"Request failed: {e}")
+                    status, payload, extra, keep_alive = 500, {'error': str(e)}, {}, False
+                await self._respond(writer, status, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # --- lifecycle ----------------------------------------------------------
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.cache_path, self.rules_path, metrics.is_enabled()))
+
+    async def start(self):
+        """Start the worker pool, dispatcher and listening socket"""
+        self._waiting = asyncio.Queue()
+        self._free_workers = asyncio.Semaphore(self.workers)
+        self._spool = tempfile.mkdtemp(prefix="receptix-uploads-")
+        self._executor = self._new_executor()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Scanning service listening on http://{self.host}:{self.port} with {self.workers} workers")
+
+    async def stop(self):
+        """Stop accepting connections, finish running batches and clean up"""
+        self._server.close()
+        await self._server.wait_closed()
+        self._dispatcher.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Waiting for the worker processes blocks, so it runs off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+        shutil.rmtree(self._spool, ignore_errors=True)
+        logging.info(f"Scanning service stopped: {self.stats()}")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
@@ -0,0 +1,260 @@
+"""
+Two-stage scanning: decode + preprocess workers feed OCR workers through a
+shared-memory ring buffer.
+
+Each stage has its own process count, so decoding (I/O and OpenCV) and
+Tesseract (CPU) can both be kept busy. A preprocessing worker writes the
+binarized image straight into a free ring slot and sends only the slot
+number and shape; the OCR worker reads it in place and frees the slot when
+Tesseract is done with it. With every slot taken, preprocessing waits,
+which bounds memory to the ring. An image too big for a slot (rare) travels
+through the queue instead.
+
+Multi-page documents skip the preprocessing stage; the OCR worker handles
+them with their own page pool.
+"""
+import os
+import time
+import queue
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+
+# Binarized images are at most max_edge square (see PREPROCESS_PARAMS)
+DEFAULT_SLOT_BYTES = 3000 * 3000
+# Seconds between checks that no worker died while waiting for results
+LIVENESS_INTERVAL = 1.0
+
+
+class ImageRing:
+    """
+    A fixed number of equal slots in one shared memory block, handed out
+    through a queue of free slot numbers. Created by the parent; workers
+    attach by name.
+    """
+
+    def __init__(self, slots, slot_bytes, name=None, free=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+            self.free = multiprocessing.Queue()
+            for slot in range(slots):
+                self.free.put(slot)
+            self._owner = True
+        else:
+            # Workers share the parent's resource tracker, which unlinks the
+            # block only if the parent exits without close()
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.free = free
+            self._owner = False
+
+    def attach_args(self):
+        return self.slots, self.slot_bytes, self.shm.name, self.free
+
+    def fits(self, array):
+        return array.nbytes <= self.slot_bytes
+
+    def put(self, array):
+        """Copy array into a free slot (waits for one) and return the slot number"""
+        slot = self.free.get()
+        self.view(slot, array.shape, array.dtype)[...] = array
+        return slot
+
+    def view(self, slot, shape, dtype=np.uint8):
+        """Array over a slot's memory; valid until the slot is released"""
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def close(self):
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def _preprocess_worker(tasks, ready, results, ring_args, cache_path, collect_metrics):
+    """Stage 1: decode and binarize each task into the ring"""
+    from ocr_utils import DEFAULT_MIN_CONFIDENCE, get_ocr_backend, ocr_cache_key, preprocess_image
+    from documents import is_document
+    from ocr_cache import OCRCache
+
+    if collect_metrics:
+        metrics.enable()
+    ring = ImageRing(*ring_args)
+    cache = OCRCache(cache_path) if cache_path else None
+    backend = get_ocr_backend()
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            path, start = task
+            if is_document(path):
+                ready.put({'path': path, 'start': start, 'document': True, 'timings': []})
+                continue
+
+            try:
+                with metrics.capture() as timings:
+                    if not os.path.exists(path):
+                        raise FileNotFoundError(f"File not found: {path}")
+                    message = {'path': path, 'start': start, 'timings': timings}
+                    if cache is not None:
+                        message['key'] = ocr_cache_key(path, True, backend, DEFAULT_MIN_CONFIDENCE)
+                        cached = cache.get(message['key'])
+                        if cached is not None:
+                            message['cached'] = cached
+                            ready.put(message)
+                            continue
+
+                    with metrics.span('ocr.preprocess'):
+                        image, profile = preprocess_image(path, return_profile=True)
+                    message['profile'] = profile
+                    if isinstance(image, np.ndarray) and ring.fits(image):
+                        with metrics.span('ocr.handoff'):
+                            message['slot'] = ring.put(image)
+                        message['shape'] = image.shape
+                    else:
+                        message['image'] = image
+                ready.put(message)
+            except Exception as e:
+                results.put({'path': path, 'ok': False, 'error': str(e), 'latency': time.time() - start})
+    finally:
+        ring.close()
+
+
+def _ocr_worker(ready, results, ring_args, cache_path, rules_path, collect_metrics, category_cache_path):
+    """Stage 2: OCR images from the ring, then parse and categorize"""
+    from ocr_utils import layout_from_json, layout_to_json, recognize_layout
+    from pipeline import analyze_text, scan_receipt
+    from batch import category_cache_delta
+    from categorizer import category_cache
+    from ocr_cache import OCRCache
+    from rule_store import RuleStore
+
+    if collect_metrics:
+        metrics.enable()
+    if category_cache_path:
+        category_cache.load(category_cache_path)
+    ring = ImageRing(*ring_args)
+    cache = OCRCache(cache_path) if cache_path else None
+    rules = RuleStore(rules_path) if rules_path else None
+    try:
+        while True:
+            message = ready.get()
+            if message is None:
+                break
+            path = message['path']
+            slot = message.get('slot')
+            try:
+                hits, misses = category_cache.counts()
+                with metrics.capture() as timings:
+                    if message.get('document'):
+                        result = scan_receipt(path, cache=cache, rules=rules)
+                    else:
+                        ocr_start = time.perf_counter()
+                        if 'cached' in message:
+                            layout = layout_from_json(message['cached'])
+                        else:
+                            image = message['image'] if slot is None else ring.view(slot, message['shape'])
+                            with metrics.span('ocr.extract'):
+                                layout = recognize_layout(image, profile=message['profile'],
+                                                          learned_order=cache is None)
+                            if slot is not None:
+                                ring.release(slot)
+                                slot = None
+                            if cache is not None:
+                                cache.put(message['key'], layout_to_json(layout))
+                        result = analyze_text(layout.text, source_path=path, rules=rules,
+                                              ocr_seconds=time.perf_counter() - ocr_start, lines=layout.lines)
+                results.put(dict(
+                    result.to_dict(),
+                    ok=True,
+                    stage_timings=message['timings'] + timings,
+                    category_cache=category_cache_delta(hits, misses),
+                    rule_hits=rules.take_new_hits() if rules is not None else [],
+                    latency=time.time() - message['start']
+                ))
+            except Exception as e:
+                results.put({'path': path, 'ok': False, 'error': str(e), 'latency': time.time() - message['start']})
+            finally:
+                if slot is not None:
+                    ring.release(slot)
+    finally:
+        ring.close()
+
+
+def scan_staged(image_paths, preprocess_workers=None, ocr_workers=None, slots=None,
+                slot_bytes=DEFAULT_SLOT_BYTES, cache_path=None, rules_path=None, category_cache_path=None):
+    """
+    Scan receipts through the two-stage pipeline and yield results as they
+    finish, in the same form as batch.scan_batch. The ring holds `slots`
+    preprocessed images (default: two per OCR worker).
+    """
+    cpus = os.cpu_count() or 1
+    ocr_workers = ocr_workers or cpus
+    preprocess_workers = preprocess_workers or max(1, cpus // 2)
+    slots = slots or ocr_workers * 2
+    max_pending = (preprocess_workers + ocr_workers) * 2 + slots
+    collect_metrics = metrics.is_enabled()
+
+    ring = ImageRing(slots, slot_bytes)
+    tasks = multiprocessing.Queue()
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_preprocess_worker, name=f"preprocess-{i}", daemon=True,
+                                args=(tasks, ready, results, ring.attach_args(), cache_path, collect_metrics))
+        for i in range(preprocess_workers)
+    ] + [
+        multiprocessing.Process(target=_ocr_worker, name=f"ocr-{i}", daemon=True,
+                                args=(ready, results, ring.attach_args(), cache_path, rules_path, collect_metrics,
+                                      category_cache_path))
+        for i in range(ocr_workers)
+    ]
+    logging.info(f"Staged scan: {preprocess_workers} preprocess workers, {ocr_workers} OCR workers, "
+                 f"{slots} ring slots of {slot_bytes / 1e6:.1f} MB")
+    for worker in workers:
+        worker.start()
+
+    paths = iter(image_paths)
+    pending = 0
+    try:
+        for path in paths:
+            tasks.put((path, time.time()))
+            pending += 1
+            if pending >= max_pending:
+                break
+
+        while pending:
+            try:
+                result = results.get(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                dead = [worker.name for worker in workers if not worker.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Scan workers died: {', '.join(dead)}")
+                continue
+            pending -= 1
+            yield result
+            next_path = next(paths, None)
+            if next_path is not None:
+                tasks.put((next_path, time.time()))
+                pending += 1
+    finally:
+        if pending:
+            # Stopped early: queued receipts are abandoned, not finished
+            for worker in workers:
+                worker.terminate()
+        else:
+            for _ in range(preprocess_workers):
+                tasks.put(None)
+            for _ in range(ocr_workers):
+                ready.put(None)
+        for worker in workers:
+            worker.join()
+        ring.close()
@@ -0,0 +1,26 @@
+"""
+The pipeline benchmark scores failed scans as finding nothing instead of
+crashing. Scanning is stubbed, so Tesseract is not needed.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import bench_pipeline
+from synthetic_receipts import generate_corpus
+
+
+def test_failed_scans_count_as_nothing_found(tmp_path, monkeypatch):
+    corpus = str(tmp_path / "corpus")
+    generate_corpus(corpus, 2)
+
+    def failing_scan_batch(paths, workers=None):
+        for path in paths:
+            yield {'path': path, 'ok': False, 'error': "tesseract is not installed", 'latency': 0.01}
+
+    monkeypatch.setattr(bench_pipeline, 'scan_batch', failing_scan_batch)
+    report = bench_pipeline.run(corpus, workers=1)
+
+    assert report['throughput']['failed'] == 2
+    assert report['accuracy'] == {'amount_recall': 0.0, 'category_accuracy': 0.0, 'total_match_rate': 0.0}
@@ -0,0 +1,37 @@
+"""
+A keyword table's rules version is hashed once per table change and handed
+down, not re-derived by every layer on every call.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline
+import rule_store
+from categorizer import CATEGORY_KEYWORDS, categorize_expenses, keyword_rule_set
+from keyword_index import table_changed
+
+
+def test_rule_set_is_hashed_once_per_table_change(monkeypatch):
+    hashed = []
+    original = rule_store.rules_version
+    monkeypatch.setattr(rule_store, 'rules_version', lambda *args: hashed.append(args) or original(*args))
+
+    table = {'Food & Dining': ['coffee']}
+    first = keyword_rule_set(table)
+    for _ in range(3):
+        categorize_expenses(['Coffee Latte'], keywords=table)
+    assert keyword_rule_set(table) is first
+    assert len(hashed) == 1
+
+    table['Transportation'] = ['uber']
+    table_changed(table)
+    assert keyword_rule_set(table).fingerprint != first.fingerprint
+    assert len(hashed) == 2
+
+
+def test_scan_result_is_labeled_with_the_rules_it_was_categorized_with():
+    result = pipeline.analyze_parsed("Coffee Latte 120.00", [120.0], ["Coffee Latte"])
+    assert result.rules_version == rule_store.rules_version(CATEGORY_KEYWORDS)
+    assert result.categories['Food & Dining']['items'] == ('Coffee Latte',)
@@ -0,0 +1,67 @@
+"""
+The image hash index finds every stored receipt within the lookup's
+distance, including databases indexed under the old chunk layout.
+"""
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense_db import ExpenseDB
+
+HASH_BITS = 256
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << bit
+    return value
+
+
+def to_hex(value):
+    return value.to_bytes(HASH_BITS // 8, 'big').hex()
+
+
+def store(db, values):
+    return db.add_receipts([{'source_path': f"receipt_{i}.jpg", 'text': '', 'categories': {}, 'total': 0.0,
+                             'image_hash': to_hex(value)} for i, value in enumerate(values)])
+
+
+def test_every_hash_within_max_distance_is_found(tmp_path):
+    rng = random.Random(7)
+    values = [rng.getrandbits(HASH_BITS) for _ in range(200)]
+    db = ExpenseDB(str(tmp_path / "expenses.sqlite3"))
+    ids = store(db, values)
+    try:
+        for max_distance in (0, 12, 25, 38):
+            for _ in range(100):
+                index = rng.randrange(len(values))
+                query = flip_bits(values[index], max_distance, rng)
+                assert db.find_similar_image(to_hex(query), max_distance) == (ids[index], max_distance)
+        assert db.find_similar_image(to_hex(flip_bits(values[0], 26, rng)), 25) is None
+    finally:
+        db.close()
+
+
+def test_old_chunk_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / "expenses.sqlite3")
+    value = random.Random(8).getrandbits(HASH_BITS)
+    db = ExpenseDB(path)
+    receipt_id = store(db, [value])[0]
+    db.close()
+
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("DELETE FROM receipt_image_keys")
+        conn.execute("CREATE TABLE receipt_image_chunks (chunk INTEGER NOT NULL, receipt_id INTEGER NOT NULL)")
+    conn.close()
+
+    db = ExpenseDB(path)
+    try:
+        assert db.find_similar_image(to_hex(value ^ 1), 25) == (receipt_id, 1)
+        tables = {name for (name,) in db._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'receipt_image_chunks' not in tables
+    finally:
+        db.close()
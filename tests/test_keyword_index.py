@@ -0,0 +1,30 @@
+"""
+get_matcher reuses the compiled automaton until the table is replaced or
+reported as edited, without re-reading the table on each call.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keyword_index import get_matcher, table_changed
+
+
+def test_matcher_is_reused_until_the_table_changes():
+    table = {'Food & Dining': ['coffee'], 'Transportation': ['uber']}
+    matcher = get_matcher(table)
+    assert get_matcher(table) is matcher
+
+    table['Shopping'] = ['store']
+    table_changed(table)
+    rebuilt = get_matcher(table)
+    assert rebuilt is not matcher
+    assert rebuilt.match('corner store') == 'Shopping'
+
+
+def test_another_table_or_option_gets_its_own_matcher():
+    table = {'Food & Dining': ['coffee']}
+    other = {'Food & Dining': ['coffee']}
+    matcher = get_matcher(table)
+    assert get_matcher(other) is not matcher
+    assert get_matcher(other, word_boundary=True) is not get_matcher(other)
@@ -0,0 +1,88 @@
+"""
+A scan parses and categorizes its text exactly once; everything downstream
+reads the ScanResult. OCR is stubbed, so Tesseract is not needed.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import categorizer
+import ocr_utils
+import pipeline
+from expense_db import ExpenseDB
+from reports import render_text_report
+
+RECEIPT_TEXT = "Coffee Latte 120.00\nUber Trip 250.00\nGST 18.00"
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Count calls to the parse and categorize stages, wherever they are looked up"""
+    counts = {'parse': 0, 'categorize': 0}
+
+    def counting(name, func):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    parse = counting('parse', categorizer.parse_amounts_and_items)
+    categorize = counting('categorize', categorizer.categorize_parsed)
+    for module in (pipeline, categorizer):
+        monkeypatch.setattr(module, 'parse_amounts_and_items', parse)
+        monkeypatch.setattr(module, 'categorize_parsed', categorize)
+    return counts
+
+
+@pytest.fixture
+def receipt(tmp_path, monkeypatch):
+    path = tmp_path / "receipt.png"
+    path.write_bytes(b"not decoded: OCR is stubbed")
+    layout = ocr_utils.OCRLayout(RECEIPT_TEXT, [], 90.0, 6)
+    monkeypatch.setattr(ocr_utils, 'extract_layout_from_image', lambda image_path, **kwargs: layout)
+    return str(path)
+
+
+def test_scan_receipt_runs_each_stage_once(calls, receipt):
+    result = pipeline.scan_receipt(receipt)
+    assert calls == {'parse': 1, 'categorize': 1}
+    assert result.text == RECEIPT_TEXT
+    assert result.amounts == (120.0, 250.0, 18.0)
+    assert result.total == 388.0
+
+
+def test_analyze_text_runs_each_stage_once(calls):
+    result = pipeline.analyze_text(RECEIPT_TEXT)
+    assert calls == {'parse': 1, 'categorize': 1}
+    assert set(result.categories) == {'Food & Dining', 'Transportation', 'Miscellaneous'}
+    assert result.category_totals['Transportation'] == 250.0
+
+
+def test_reports_and_db_read_the_scan_result(calls, receipt, tmp_path):
+    result = pipeline.scan_receipt(receipt)
+
+    report = render_text_report(result)
+    db = ExpenseDB(str(tmp_path / "expenses.sqlite3"))
+    try:
+        receipt_id = db.add_scan(result)
+        text, amounts, items = db.get_parse(receipt_id)
+    finally:
+        db.close()
+
+    assert calls == {'parse': 1, 'categorize': 1}
+    assert "GRAND TOTAL: $388.00" in report
+    assert (text, tuple(amounts), tuple(items)) == (result.text, result.amounts, result.items)
+
+
+def test_report_lines_add_up_to_the_rounded_grand_total():
+    # 10.10 + 10.20 is 20.299999999999997 in floating point
+    result = pipeline.analyze_text("Coffee 10.10\nPizza 10.20\nUber Trip 10.70")
+    assert result.category_totals['Food & Dining'] == 20.3
+    assert result.categorized_total == 31.0
+
+    report = render_text_report(result)
+    assert "Total: $20.30" in report and "Total: $10.70" in report
+    assert "GRAND TOTAL: $31.00" in report
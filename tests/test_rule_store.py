@@ -0,0 +1,51 @@
+"""
+Rule hits recorded in a worker travel back as per-scan deltas, add up in
+the expense database across runs, and leave the never-matched rules dead.
+"""
+import json
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline
+from expense_db import ExpenseDB
+from rule_store import RuleStore, dead_rules, merge_rule_hits, rules_version
+
+TABLE = {'Food & Dining': ['coffee', 'pizza'], 'Transportation': ['Uber', 'taxi']}
+
+
+def make_store(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(TABLE), encoding="utf-8")
+    return RuleStore(str(path))
+
+
+def test_new_hits_are_taken_once_per_scan(tmp_path):
+    store = make_store(tmp_path)
+    pipeline.analyze_text("Coffee 3.50\nUber Trip 12.00", rules=store)
+    first = store.take_new_hits()
+    assert first == [['Food & Dining', 'coffee', 1], ['Transportation', 'uber', 1]]
+    assert store.take_new_hits() == []
+
+    pipeline.analyze_text("Coffee 3.50", rules=store)
+    total = Counter()
+    merge_rule_hits(total, first)
+    merge_rule_hits(total, store.take_new_hits())
+    assert total == store.hits
+    assert dead_rules(TABLE, total) == store.dead_rules() == [('Food & Dining', 'pizza'), ('Transportation', 'taxi')]
+
+
+def test_rule_hits_add_up_in_the_database(tmp_path):
+    version = rules_version(TABLE)
+    db = ExpenseDB(str(tmp_path / "expenses.sqlite3"))
+    try:
+        db.add_rule_hits(version, [['Food & Dining', 'coffee', 2]])
+        db.add_rule_hits(version, [['Food & Dining', 'coffee', 1], ['Transportation', 'uber', 4]])
+        db.add_rule_hits('other', [['Transportation', 'taxi', 1]])
+        hits = db.rule_hits(version)
+    finally:
+        db.close()
+    assert hits == Counter({('Food & Dining', 'coffee'): 3, ('Transportation', 'uber'): 4})
+    assert dead_rules(TABLE, hits) == [('Food & Dining', 'pizza'), ('Transportation', 'taxi')]
@@ -0,0 +1,47 @@
+"""
+A worker process dying fails the receipts of its batch, and the service
+keeps scanning on a fresh pool instead of failing every later upload.
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import service
+from service import Job, ScanService
+
+
+def scan_or_die(paths):
+    if 'crash.jpg' in paths:
+        os._exit(1)
+    return [{'ok': True, 'path': path, 'stage_timings': {}, 'rule_hits': [], 'latency': 0.0} for path in paths]
+
+
+def test_broken_pool_is_replaced(monkeypatch):
+    monkeypatch.setattr(service, 'scan_files', scan_or_die)
+
+    async def run():
+        scanner = ScanService(workers=1)
+        scanner._free_workers = asyncio.Semaphore(1)
+        scanner._executor = scanner._new_executor()
+        jobs = []
+        for name in ('crash.jpg', 'next.jpg'):
+            job = Job(name, name, name)
+            scanner.jobs[name] = job
+            scanner.active += 1
+            jobs.append(job)
+        try:
+            broken = scanner._executor
+            await scanner._free_workers.acquire()
+            await scanner._run_batch(jobs[:1])
+            assert scanner._executor is not broken
+            await scanner._free_workers.acquire()
+            await scanner._run_batch(jobs[1:])
+        finally:
+            scanner._executor.shutdown(wait=True)
+        return jobs
+
+    crashed, scanned = asyncio.run(run())
+    assert crashed.status == "failed" and "worker process died" in crashed.result['error']
+    assert scanned.status == "done"
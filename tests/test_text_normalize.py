@@ -0,0 +1,44 @@
+"""
+OCR text cleaning reads O/I/l as digits only inside amounts, so merchant
+names and item words keep their letters and still match category keywords.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ocr_utils
+import pipeline
+from text_normalize import normalize_text, iter_normalized_lines
+
+
+def test_merchant_name_with_o_survives_cleaning_and_is_categorized():
+    text = ocr_utils.clean_extracted_text("  FOOD COURT 1O.5O \n\nOFFICE DEPOT 12.00")
+    assert text == "FOOD COURT 10.50\nOFFICE DEPOT 12.00"
+
+    result = pipeline.analyze_text(text)
+    assert result.categories['Food & Dining']['items'] == ('FOOD COURT',)
+    assert result.categories['Food & Dining']['amounts'] == (10.5,)
+    assert result.categories['Office & Business']['items'] == ('OFFICE DEPOT',)
+    assert 'Miscellaneous' not in result.categories
+
+
+@pytest.mark.parametrize('raw, cleaned', [
+    ("Milk 2l 1.50", "Milk 2l 1.50"),
+    ("TOTAL:1,OOO.OO", "TOTAL:1,000.00"),
+    ("₹lO.5O", "₹10.50"),
+    ("Oil 3.OO)", "Oil 3.00)"),
+    ("GST 12.5O%", "GST 12.50%"),
+    ("Invoice #1O5", "Invoice #1O5"),
+    ("ab1.5O", "ab1.5O"),
+    ("Table|2 —", "TableI2 -"),
+])
+def test_digits_are_fixed_only_inside_amounts(raw, cleaned):
+    assert normalize_text(raw) == cleaned
+
+
+def test_streaming_matches_whole_text():
+    lines = ["  Coffee 1O.OO ", "", "\t", "Uber Trip 25O.OO", "Milk 2l 1.50"] * 500
+    assert list(iter_normalized_lines(lines)) == normalize_text('\n'.join(lines)).split('\n')
@@ -0,0 +1,110 @@
+"""
+Normalization of raw OCR text in a fixed number of C-level passes.
+
+Plain character fixes are applied everywhere. Letters OCR confuses with
+digits (O/o -> 0, I/l -> 1) are only fixed inside amount-shaped tokens with
+a decimal separator, so merchant names, item words and unit suffixes keep
+their letters:
+
+    'FOOD COURT 1O.5O'  ->  'FOOD COURT 10.50'   (not 'F00D C0URT 10.50')
+    'Milk 2l 1.50'      ->  'Milk 2l 1.50'       (not 'Milk 21 1.50')
+
+Nothing here adds or removes whitespace inside a line, so word positions
+from the OCR layout still line up with the cleaned text.
+"""
+import re
+from itertools import islice
+
+# Character fixes applied everywhere. A chain of str.replace calls is several
+# times faster in CPython than one str.translate with multi-character or
+# non-Latin-1 entries, and characters that are absent cost one scan each.
+# NUL is dropped because it marks fixed decimal points below.
+CHAR_FIXES = (
+    ('|', 'I'),
+    ('§', 'S'),
+    ('ﬁ', 'fi'),
+    ('ﬂ', 'fl'),
+    ('—', '-'),
+    ('’', "'"),
+    ('\x00', '')
+)
+
+_MARK = '\x00'
+_SEP = '\x01'
+
+# Amount tokens are found by their decimal point, the one character the regex
+# engine can search for at memchr speed. The scan runs over the reversed text
+# so the integer part, of any length, follows the point: '1O.5O' reads
+# 'O5.O1'. A match is the point plus the integer part, when the token has two
+# decimals, ends at whitespace, ')' or '%', starts at whitespace, a label
+# separator ('TOTAL:1O.OO') or a currency sign, and holds a confusable letter.
+_REVERSED_AMOUNT_RE = re.compile(
+    r'(\.(?<=[0-9OoIl]{2}\.)(?<![^\s)%]...)'
+    r'(?:(?<=[OoIl]\.)|(?<=[OoIl].\.)|(?=[0-9,]*[OoIl]))'
+    r'[0-9OoIl,]+(?![^\s:#=(₹$€£]))'
+)
+# Fixing the integer part turns the point into _MARK, which then leads the
+# forward scan for the decimals of the same tokens
+_MARKED_DECIMALS_RE = re.compile(r'(\x00[0-9OoIl]{2})')
+
+_FIX_INTEGER_PART = str.maketrans({'O': '0', 'o': '0', 'I': '1', 'l': '1', '.': _MARK})
+_FIX_DECIMALS = str.maketrans({'O': '0', 'o': '0', 'I': '1', 'l': '1', _MARK: '.'})
+
+# Lines per chunk normalized at once by iter_normalized_lines
+STREAM_CHUNK_LINES = 1000
+
+
+def _translate_matches(pattern, text, table):
+    """Translate every match of pattern (one capturing group) with a single str.translate"""
+    pieces = pattern.split(text)
+    if len(pieces) == 1:
+        return text
+    pieces[1::2] = _SEP.join(pieces[1::2]).translate(table).split(_SEP)
+    return ''.join(pieces)
+
+
+def _fix_amounts(text):
+    if '.' not in text:
+        return text
+    text = _translate_matches(_REVERSED_AMOUNT_RE, text[::-1], _FIX_INTEGER_PART)[::-1]
+    if _MARK not in text:
+        return text
+    return _translate_matches(_MARKED_DECIMALS_RE, text, _FIX_DECIMALS)
+
+
+def _fix_chars(text):
+    for old, new in CHAR_FIXES:
+        if old in text:
+            text = text.replace(old, new)
+    return _fix_amounts(text)
+
+
+def normalize_line(line):
+    """Normalize one line (no line breaks); surrounding whitespace is kept"""
+    return _fix_chars(line)
+
+
+def normalize_text(text):
+    """
+    Normalize a whole OCR dump: strip every line, drop blank ones and fix
+    characters. Every pass runs over the joined text, never line by line.
+    """
+    if not text:
+        return ""
+    return _fix_chars('\n'.join(filter(None, map(str.strip, text.split('\n')))))
+
+
+def iter_normalized_lines(lines):
+    """
+    Stream normalized, stripped, non-blank lines from any iterable of lines
+    (a file object, a generator of OCR pages split into lines, ...). Lines
+    are normalized STREAM_CHUNK_LINES at a time, so memory stays bounded.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, STREAM_CHUNK_LINES))
+        if not chunk:
+            return
+        cleaned = normalize_text('\n'.join(chunk))
+        if cleaned:
+            yield from cleaned.split('\n')
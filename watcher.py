@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import IMAGE_EXTENSIONS, scan_file, _init_worker
+import metrics
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Seconds a file's size and mtime must stay unchanged before we read it
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_MAX_QUEUE = 100
+
+
+def file_signature(path):
+    """(size, mtime_ns) of a file - a changed file is treated as a new receipt"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_journal(journal_path):
+    """
+    Read completed (path, size, mtime_ns) entries from a results journal.
+    A torn last line from a crash is cut off so new records append cleanly.
+    """
+    done = set()
+    if not os.path.exists(journal_path):
+        return done
+
+    with open(journal_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logging.warning(f"Discarding incomplete journal record in {journal_path}")
+            f.truncate(end)
+
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+            done.add((record['path'], record['size'], record['mtime_ns']))
+        except (ValueError, KeyError):
+            continue
+    return done
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, service):
+        self.service = service
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.service.notice(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.service.notice(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.service.notice(event.dest_path)
+
+
+class IngestionService:
+    """
+    Long-running receipt ingestion: watch a directory (inotify through
+    watchdog when installed, polling otherwise) or take paths from enqueue(),
+    wait for files to finish being written, and scan them on a bounded
+    process pool.
+
+    Every result is appended to a JSON lines journal and fsync'd before the
+    file counts as done, so a restart skips everything already scanned.
+    When the work queue is full, discovery blocks until workers catch up.
+    """
+
+    def __init__(self, journal_path, watch_dir=None, workers=None, max_queue=DEFAULT_MAX_QUEUE,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 cache_path=None, rules_path=None):
+        self.journal_path = journal_path
+        self.watch_dir = watch_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.cache_path = cache_path
+        self.rules_path = rules_path
+
+        self.done = load_journal(journal_path)
+        self.processed = 0
+        self.failed = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._in_flight = threading.BoundedSemaphore(self.workers * 2)
+        self._queued = set()
+        self._candidates = {}
+        self._candidates_lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._journal = None
+        self._executor = None
+        self._observer = None
+
+    def notice(self, path):
+        """Mark a path as possibly new; it is queued once it stops changing"""
+        if path.lower().endswith(IMAGE_EXTENSIONS):
+            with self._candidates_lock:
+                self._candidates.setdefault(path, None)
+
+    def enqueue(self, path, block=True):
+        """
+        Queue a finished file for scanning. Blocks while the queue is full
+        (backpressure); with block=False raises queue.Full instead.
+        A path that is missing or unreadable is logged and skipped.
+        """
+        path = os.path.abspath(path)
+        try:
+            signature = file_signature(path)
+        except OSError as e:
+            logging.error(f"Skipping {path}: {e}")
+            return False
+        key = (path, *signature)
+        with self._journal_lock:
+            if key in self.done or key in self._queued:
+                return False
+            self._queued.add(key)
+        self._queue.put((path, signature), block=block)
+        return True
+
+    def _is_known(self, path, signature):
+        """Whether this version of the file is already scanned or queued"""
+        key = (path, *signature)
+        with self._journal_lock:
+            return key in self.done or key in self._queued
+
+    def _scan_directory(self):
+        for entry in os.scandir(self.watch_dir):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            # Finished files stay in the directory; don't settle them again every pass
+            if not self._is_known(entry.path, (stat.st_size, stat.st_mtime_ns)):
+                self.notice(entry.path)
+
+    def _promote_settled(self):
+        """Queue candidates whose size and mtime have been stable long enough"""
+        now = time.monotonic()
+        with self._candidates_lock:
+            candidates = list(self._candidates.items())
+
+        for path, seen in candidates:
+            try:
+                signature = file_signature(path)
+            except OSError:
+                with self._candidates_lock:
+                    self._candidates.pop(path, None)
+                continue
+
+            if self._is_known(path, signature):
+                with self._candidates_lock:
+                    self._candidates.pop(path, None)
+            elif seen is None or seen[0] != signature:
+                with self._candidates_lock:
+                    self._candidates[path] = (signature, now)
+            elif now - seen[1] >= self.settle_seconds:
+                with self._candidates_lock:
+                    self._candidates.pop(path, None)
+                self.enqueue(path)
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._in_flight.acquire()
+            path, signature = item
+            future = self._executor.submit(scan_file, path)
+            future.add_done_callback(lambda f, p=path, s=signature: self._record(p, s, f))
+
+    def _record(self, path, signature, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            # scan_file reports its own failures, so only a lost worker process lands here
+            result = {'path': path, 'ok': False, 'error': str(e), 'latency': 0.0}
+        result['path'] = path
+        result['size'], result['mtime_ns'] = signature
+
+        with self._journal_lock, metrics.span('report.write'):
+            self._journal.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self.done.add((path, *signature))
+            self._queued.discard((path, *signature))
+            self.processed += 1
+            if not result['ok']:
+                self.failed += 1
+
+        if result['ok']:
+            metrics.observe_all(result['stage_timings'])
+            logging.info(f"Receipt processed: {path}")
+        else:
+            logging.error(f"Error processing {path}: {result['error']}")
+        self._in_flight.release()
+
+    def start(self):
+        """Start the worker pool, dispatcher and directory watcher"""
+        journal_dir = os.path.dirname(self.journal_path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.cache_path, self.rules_path,
+                                                       metrics.is_enabled()))
+        self._dispatcher = threading.Thread(target=self._dispatch, name="ingest-dispatch", daemon=True)
+        self._dispatcher.start()
+
+        if self.watch_dir:
+            self.watch_dir = os.path.abspath(self.watch_dir)
+            if Observer is not None:
+                self._observer = Observer()
+                self._observer.schedule(_EventHandler(self), self.watch_dir, recursive=False)
+                self._observer.start()
+                logging.info(f"Watching {self.watch_dir} with inotify")
+            else:
+                logging.info(f"Watching {self.watch_dir} by polling every {self.poll_interval}s")
+            # Pick up anything that arrived while we were down
+            self._scan_directory()
+
+    def run_forever(self):
+        """Watch until stop() is called (or Ctrl+C)"""
+        self.start()
+        try:
+            while not self._stop.is_set():
+                if self.watch_dir and self._observer is None:
+                    self._scan_directory()
+                self._promote_settled()
+                self._stop.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            logging.info("Ingestion interrupted, finishing in-flight receipts")
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self._stop.set()
+
+    def shutdown(self):
+        """Stop watching, finish queued work and close the journal"""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+        self._journal.close()
+        logging.info(f"Ingestion stopped: {self.processed} receipts processed, {self.failed} failed")